@@ -8,19 +8,38 @@
 
 from typing import List, Dict, Any, Optional
 import asyncio
+import weakref
+
+import httpx
 
 # AutoGen 0.4+ API
 from autogen_agentchat.agents import AssistantAgent
+from autogen_core.models import ChatCompletionClient
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import StdioServerParams, mcp_server_tools
 
 from config import get_model_config, get_agent_config, MCP_SERVERS_CONFIG
 from prompt import get_prompt
-
-
-def create_model_client(model_config: Dict[str, Any]) -> OpenAIChatCompletionClient:
-    """创建模型客户端"""
-    return OpenAIChatCompletionClient(
+from mcp_pool import get_mcp_pool
+from tool_cache import cache_tools
+from llm_cache import wrap_model_client
+from client_registry import AgentModelClient, get_client_registry
+from rate_limiter import rate_limit_model_client, rate_limit_tools
+from profiler import profile_model_client, profile_tools
+from single_flight import coalesce_tools
+from deadlines import timeout_tools
+from budget import budget_model_client, budget_tools
+from tool_output import postprocess_tools
+from research_memory import memory_tools
+
+# 创建时未能获取到工具的MCP服务器，按智能体对象记录
+_missing_tool_servers: "weakref.WeakKeyDictionary[AssistantAgent, List[str]]" = weakref.WeakKeyDictionary()
+
+
+def create_model_client(model_config: Dict[str, Any],
+                        http_client: Optional[httpx.AsyncClient] = None) -> ChatCompletionClient:
+    """创建模型客户端，按配置加上限流和记录/回放/缓存功能；传入 http_client 时使用该连接池"""
+    extra_kwargs = {"http_client": http_client} if http_client is not None else {}
+    client = OpenAIChatCompletionClient(
         model=model_config["name"],
         api_key=model_config["api_key"],
         base_url=model_config["base_url"],
@@ -29,12 +48,25 @@ def create_model_client(model_config: Dict[str, Any]) -> OpenAIChatCompletionCli
         max_retries=model_config.get("max_retries", 5),
         temperature=model_config.get("temperature", 0.7),
         parallel_tool_calls=False,  # 禁用并行工具调用
+        **extra_kwargs,
     )
+    # 限流在缓存内层：缓存命中的调用不占用限流额度
+    client = rate_limit_model_client(client)
+    return wrap_model_client(client, model_config["name"])
+
 
+async def collect_tools_for_agent(agent_name: str, mcp_servers: Dict[str, Any],
+                                  missing_servers: Optional[List[str]] = None) -> List:
+    """
+    为智能体收集MCP工具 - 从进程级会话池获取，服务器只启动一次
 
-async def collect_tools_for_agent(agent_name: str, mcp_servers: Dict[str, Any]) -> List:
-    """为智能体收集MCP工具"""
+    Args:
+        agent_name: 智能体名称
+        mcp_servers: MCP服务器配置
+        missing_servers: 传入列表时，把获取工具失败的服务器名称加入其中
+    """
     tools = []
+    pool = get_mcp_pool()
     
     # 智能体工具映射 - 简化版本
     agent_tool_mapping = {
@@ -42,41 +74,58 @@ async def collect_tools_for_agent(agent_name: str, mcp_servers: Dict[str, Any])
         "strategy_advisor": ["tavily"],  # 策略顾问也需要搜索工具
     }
     
-    server_names = agent_tool_mapping.get(agent_name, [])
-    
-    for server_name in server_names:
-        if server_name in mcp_servers:
-            server_config = mcp_servers[server_name]
-            try:
-                server_params = StdioServerParams(
-                    command=server_config["command"],
-                    args=server_config["args"],
-                    env=server_config.get("env", {}),
-                    read_timeout_seconds=60,
-                )
-                
-                server_tools = await mcp_server_tools(server_params)
-                tools.extend(server_tools)
-                print(f"   📋 {agent_name} 获取 {server_name} 工具: {len(server_tools)} 个")
-                
-            except Exception as e:
-                print(f"   ⚠️ {agent_name} 获取 {server_name} 工具失败: {e}")
-    
-    return tools
+    server_names = [name for name in agent_tool_mapping.get(agent_name, []) if name in mcp_servers]
+    
+    # 多个服务器并发获取工具
+    results = await asyncio.gather(
+        *[pool.get_tools(server_name, mcp_servers[server_name]) for server_name in server_names],
+        return_exceptions=True,
+    )
+    for server_name, server_tools in zip(server_names, results):
+        if isinstance(server_tools, BaseException):
+            if isinstance(server_tools, asyncio.CancelledError):
+                raise server_tools
+            print(f"   ⚠️ {agent_name} 获取 {server_name} 工具失败: {server_tools}")
+            if missing_servers is not None:
+                missing_servers.append(server_name)
+            continue
+        # 限流在缓存内层：缓存命中的调用不占用限流额度；合并在缓存外层：并发相同调用只查询一次缓存
+        # 超时在限流外层：对冲请求同样受限流约束，排队时间计入超时
+        server_tools_wrapped = cache_tools(
+            server_name, timeout_tools(server_name, rate_limit_tools(server_name, server_tools))
+        )
+        # 后处理在合并外层：并发相同调用共享原始结果，URL 去重按各自智能体进行
+        tools.extend(profile_tools(agent_name, server_name, postprocess_tools(
+            agent_name, server_name, coalesce_tools(server_name, server_tools_wrapped)
+        )))
+        print(f"   📋 {agent_name} 获取 {server_name} 工具: {len(server_tools)} 个")
+    
+    # 预算检查在最外层：超出预算的调用不计入缓存、限流和性能统计
+    # 研究记忆是本地检索，不占用工具调用预算
+    return budget_tools(agent_name, tools) + profile_tools(
+        agent_name, "research_memory", cache_tools("research_memory", memory_tools(agent_name))
+    )
 
 
 async def create_agent(agent_name: str, model_config: Dict[str, Any], 
-                      mcp_servers: Dict[str, Any]) -> AssistantAgent:
-    """创建智能体"""
+                      mcp_servers: Dict[str, Any],
+                      model_client: Optional[ChatCompletionClient] = None) -> AssistantAgent:
+    """创建智能体 - 默认使用注册表中的共享客户端，传入 model_client 时复用该客户端"""
     agent_config = get_agent_config(agent_name)
     if not agent_config:
         raise ValueError(f"未找到智能体配置: {agent_name}")
     
-    model_client = create_model_client(model_config)
+    if model_client is None:
+        model_client = get_client_registry().get_client(model_config)
+    # 智能体各自的 temperature / model 通过调用参数覆盖，共享同一连接池
+    model_client = AgentModelClient(model_client, agent_config.get("model_overrides"))
+    model_client = profile_model_client(model_client, agent_name)
+    model_client = budget_model_client(model_client, agent_name)
     system_message = get_prompt(agent_name)
     
     # 收集工具
-    tools = await collect_tools_for_agent(agent_name, mcp_servers)
+    missing_servers: List[str] = []
+    tools = await collect_tools_for_agent(agent_name, mcp_servers, missing_servers)
     
     # 创建智能体
     agent = AssistantAgent(
@@ -85,12 +134,19 @@ async def create_agent(agent_name: str, model_config: Dict[str, Any],
         tools=tools,
         system_message=system_message,
         reflect_on_tool_use=agent_config.get("reflect_on_tool_use", True),
+        model_client_stream=agent_config.get("model_client_stream", False),
     )
     
+    _missing_tool_servers[agent] = missing_servers
     print(f"✅ 智能体创建: {agent_name} ({agent_config['role']}) - {len(tools)} 个工具")
     return agent
 
 
+def get_missing_tool_servers(agent: AssistantAgent) -> List[str]:
+    """获取智能体创建时未能获取到工具的MCP服务器"""
+    return list(_missing_tool_servers.get(agent, []))
+
+
 async def create_simple_analysis_team(model_config: Dict[str, Any]) -> List[AssistantAgent]:
     """创建简化的分析团队 - 只包含两个核心智能体"""
     mcp_servers = {server["name"]: server for server in MCP_SERVERS_CONFIG}
@@ -116,8 +172,9 @@ async def create_simple_analysis_team(model_config: Dict[str, Any]) -> List[Assi
     return agents
 
 
-async def create_full_analysis_team(model_config: Dict[str, Any]) -> List[AssistantAgent]:
-    """创建完整的分析团队 - 保留所有分析师但使用并行工作流"""
+async def create_full_analysis_team(model_config: Dict[str, Any],
+                                    model_client: Optional[ChatCompletionClient] = None) -> List[AssistantAgent]:
+    """创建完整的分析团队 - 保留所有分析师但使用并行工作流，传入 model_client 时所有智能体共享"""
     mcp_servers = {server["name"]: server for server in MCP_SERVERS_CONFIG}
     
     agent_names = [
@@ -131,14 +188,19 @@ async def create_full_analysis_team(model_config: Dict[str, Any]) -> List[Assist
         "strategy_advisor"
     ]
     
+    # 并发创建所有智能体：同一MCP服务器只会启动一次，有工具定义缓存时不启动服务器
+    results = await asyncio.gather(
+        *[create_agent(agent_name, model_config, mcp_servers, model_client) for agent_name in agent_names],
+        return_exceptions=True,
+    )
     agents = []
-    for agent_name in agent_names:
-        try:
-            agent = await create_agent(agent_name, model_config, mcp_servers)
-            agents.append(agent)
-        except Exception as e:
-            print(f"❌ 创建智能体 {agent_name} 失败: {e}")
+    for agent_name, result in zip(agent_names, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            print(f"❌ 创建智能体 {agent_name} 失败: {result}")
             continue
+        agents.append(result)
     
     print(f"✅ 完整分析团队创建完成: {len(agents)} 个智能体")
     print("   🎯 GraphFlow团队:")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量分析模块
+在同一个事件循环中并发运行多个 GraphFlow 实例 - 限制并发数，单只股票失败互不影响
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from autogen_core.models import ChatCompletionClient
+
+from config import get_batch_config
+from runner import analyze_stock
+
+
+def parse_stock_codes(text: str) -> List[str]:
+    """
+    从文本中解析股票代码列表
+
+    支持换行、空格、逗号分隔，# 之后的内容视为注释，重复代码只保留第一次出现
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        List[str]: 去重后的股票代码列表
+    """
+    codes = []
+    seen = set()
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        for code in re.split(r"[\s,，]+", line):
+            code = code.strip().upper()
+            if code and code not in seen:
+                seen.add(code)
+                codes.append(code)
+    return codes
+
+
+def load_stock_codes(path: str) -> List[str]:
+    """
+    从文件读取股票代码列表，path 为 "-" 时从标准输入读取
+
+    Args:
+        path: 文件路径或 "-"
+
+    Returns:
+        List[str]: 股票代码列表
+    """
+    if path == "-":
+        return parse_stock_codes(sys.stdin.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_stock_codes(f.read())
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """计算百分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class BatchRunner:
+    """批量分析执行器 - 共享模型客户端与MCP会话池，使用信号量限制并发"""
+
+    def __init__(self, concurrency: int = 4, mode: str = "sequential", verbose: bool = False,
+                 output_dir: Optional[str] = None, resume: bool = False,
+                 rerun_agents: Optional[List[str]] = None,
+                 model_client: Optional[ChatCompletionClient] = None,
+                 peer_group: Optional[Dict[str, Any]] = None):
+        """
+        初始化批量执行器
+
+        Args:
+            concurrency: 同时运行的最大分析数
+            mode: 工作流模式 (sequential / parallel)
+            verbose: 是否打印每条智能体消息（并发时输出会交错）
+            output_dir: 汇总文件输出目录，默认为 reports 目录
+            resume: 是否从各股票上次中断的检查点继续
+            rerun_agents: 只重新运行这些智能体，其余章节从各股票最近的报告或检查点加载
+            model_client: 所有分析共享的模型客户端，None 表示使用注册表中的共享客户端
+            peer_group: 同业比较模式下的同组信息，共享的行业与市场章节不再逐只运行
+        """
+        if concurrency < 1:
+            raise ValueError(f"并发数必须大于0: {concurrency}")
+        self.concurrency = concurrency
+        self.mode = mode
+        self.verbose = verbose
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
+        self.output_dir = output_dir
+        self.resume = resume
+        self.rerun_agents = rerun_agents
+        self.model_client = model_client
+        self.peer_group = peer_group
+        self.results: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def new_record(stock_code: str, error: Optional[str] = None) -> Dict[str, Any]:
+        """单只股票的结果记录（初始为失败状态）"""
+        return {"stock_code": stock_code, "status": "failed", "report_path": "",
+                "agents": 0, "resumed_agents": 0, "error": error, "elapsed": 0.0,
+                "profile_path": "", "tokens": 0, "reused_from": "",
+                "degraded_agents": []}
+
+    async def _run_one(self, stock_code: str, semaphore: asyncio.Semaphore,
+                       index: int, total: int) -> Dict[str, Any]:
+        """运行单只股票分析，捕获所有异常以隔离失败"""
+        async with semaphore:
+            print(f"🚀 [{index}/{total}] 开始分析: {stock_code}")
+            start_time = time.perf_counter()
+            record = self.new_record(stock_code)
+            try:
+                result = await analyze_stock(stock_code, mode=self.mode, model_client=self.model_client,
+                                             verbose=self.verbose, resume=self.resume,
+                                             rerun_agents=self.rerun_agents, peer_group=self.peer_group)
+                record["report_path"] = result["report_path"]
+                record["agents"] = len(result["agent_results"])
+                record["resumed_agents"] = result["resumed_agents"]
+                record["reused_from"] = result["reused_from"]
+                record["degraded_agents"] = result["degraded_agents"]
+                profile = result["profile"]
+                if profile:
+                    record["profile_path"] = next(iter(profile["files"]), "")
+                    record["tokens"] = profile["prompt_tokens"] + profile["completion_tokens"]
+                record["error"] = result["error"]
+                if result["agent_results"] and result["error"] is None:
+                    record["status"] = "succeeded"
+                elif not result["agent_results"]:
+                    record["error"] = record["error"] or "未收到任何分析结果"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["elapsed"] = time.perf_counter() - start_time
+
+            if record["status"] == "succeeded":
+                print(f"✅ [{index}/{total}] {stock_code} 完成 ({record['elapsed']:.1f}秒)")
+            else:
+                print(f"❌ [{index}/{total}] {stock_code} 失败 ({record['elapsed']:.1f}秒): {record['error']}")
+            return record
+
+    async def run(self, stock_codes: List[str], save: bool = True) -> Dict[str, Any]:
+        """
+        并发分析所有股票
+
+        Args:
+            stock_codes: 股票代码列表
+            save: 是否保存并打印汇总（分片批量的工作进程只返回结果，由协调进程合并汇总）
+
+        Returns:
+            Dict[str, Any]: 批量运行汇总
+        """
+        total = len(stock_codes)
+        print(f"📦 批量分析: {total} 只股票, 并发数 {self.concurrency}, 工作流模式 {self.mode}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # 所有分析共享注册表中的模型客户端（连接池）和MCP会话池
+        start_time = time.perf_counter()
+        self.results = await asyncio.gather(*[
+            self._run_one(code, semaphore, i, total)
+            for i, code in enumerate(stock_codes, 1)
+        ])
+
+        summary = self.build_summary(time.perf_counter() - start_time)
+        if save:
+            summary["summary_path"] = self.save_summary(summary)
+            self.print_summary(summary)
+        return summary
+
+    def build_summary(self, wall_time: float) -> Dict[str, Any]:
+        """生成吞吐量与失败统计"""
+        succeeded = [r for r in self.results if r["status"] == "succeeded"]
+        failed = [r for r in self.results if r["status"] != "succeeded"]
+        latencies = [r["elapsed"] for r in succeeded]
+        return {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "total": len(self.results),
+            "succeeded": len(succeeded),
+            "failed": len(failed),
+            "wall_time": round(wall_time, 2),
+            "throughput_per_minute": round(len(succeeded) / wall_time * 60, 3) if wall_time > 0 else 0.0,
+            "latency": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p50": round(_percentile(latencies, 50), 2),
+                "p95": round(_percentile(latencies, 95), 2),
+                "max": round(max(latencies), 2) if latencies else 0.0,
+            },
+            "failures": [{"stock_code": r["stock_code"], "error": r["error"]} for r in failed],
+            "results": self.results,
+        }
+
+    def save_summary(self, summary: Dict[str, Any]) -> str:
+        """保存汇总为JSON文件，失败时返回空字符串"""
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            filename = f"批量分析汇总_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            filepath = os.path.join(self.output_dir, filename)
+            with open(filepath, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            return filepath
+        except Exception as e:
+            print(f"⚠️ 保存批量汇总失败: {e}")
+            return ""
+
+    @staticmethod
+    def print_summary(summary: Dict[str, Any]):
+        """打印汇总信息"""
+        latency = summary["latency"]
+        print("\n📊 批量分析汇总:")
+        print(f"   总数: {summary['total']}  成功: {summary['succeeded']}  失败: {summary['failed']}")
+        print(f"   总耗时: {summary['wall_time']}秒  吞吐量: {summary['throughput_per_minute']} 只/分钟")
+        print(f"   单只耗时: 平均 {latency['mean']}秒  p50 {latency['p50']}秒  "
+              f"p95 {latency['p95']}秒  最大 {latency['max']}秒")
+        for failure in summary["failures"]:
+            print(f"   ❌ {failure['stock_code']}: {failure['error']}")
+        if summary.get("summary_path"):
+            print(f"   📁 汇总已保存到: {summary['summary_path']}")
+
+
+async def run_batch(stock_codes: List[str], concurrency: Optional[int] = None,
+                    mode: str = "sequential", verbose: bool = False, resume: bool = False,
+                    rerun_agents: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    批量分析便捷函数
+
+    Args:
+        stock_codes: 股票代码列表
+        concurrency: 最大并发数，None 表示使用配置值
+        mode: 工作流模式
+        verbose: 是否打印每条智能体消息
+        resume: 是否从各股票上次中断的检查点继续
+        rerun_agents: 只重新运行这些智能体
+
+    Returns:
+        Dict[str, Any]: 批量运行汇总
+    """
+    if concurrency is None:
+        concurrency = get_batch_config()["concurrency"]
+    runner = BatchRunner(concurrency=concurrency, mode=mode, verbose=verbose, resume=resume,
+                         rerun_agents=rerun_agents)
+    return await runner.run(stock_codes)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+离线基准测试模块
+不依赖在线模型和 Tavily，测量 GraphFlow、ReportSaver 和智能体工厂本身的编排开销：
+- 模型：确定性的假模型客户端，延迟和 token 数可配置，有工具时先发出一次工具调用
+- 工具：本地 stdio MCP 服务器（benchmark_mcp_server.py），工具名称和参数与 tavily-mcp 一致，返回固定内容
+- 场景：单只股票顺序工作流 (single)、并行工作流 (parallel)、批量并发 (batch)
+- 指标：吞吐量、单次耗时百分位、模型/工具调用次数、扣除模拟延迟后的编排开销、峰值内存
+
+与基线结果比较时，任一指标变差超过容差即返回非零退出码，便于发现性能回退：
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence, Union
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken, FunctionCall
+from autogen_core.models import (AssistantMessage, ChatCompletionClient, CreateResult, LLMMessage,
+                                 ModelInfo, RequestUsage)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import PROJECT_CONFIG, get_mcp_servers
+from batch_runner import BatchRunner, _percentile
+from runner import analyze_stock
+
+BENCHMARK_SCENARIOS = ["single", "parallel", "batch"]
+
+# 基准测试使用的股票代码前缀，结束后删除 reports 目录中这些代码的报告和性能分析文件
+BENCH_CODE_PREFIX = "BENCH"
+
+# 参与回退检查的指标：(指标路径, 越大越好)
+REGRESSION_METRICS = [
+    ("throughput_per_minute", True),
+    ("latency.p50", False),
+    ("latency.p90", False),
+    ("overhead_per_run", False),
+    ("peak_rss_mb", False),
+]
+
+# 耗时类指标的绝对容差（秒），避免毫秒级抖动被判定为回退
+_MIN_SECONDS_DELTA = 0.01
+
+
+class FakeChatCompletionClient(ChatCompletionClient):
+    """确定性的假模型客户端 - 固定延迟和输出长度，有工具可用时先发出工具调用"""
+
+    def __init__(self, latency: float = 0.05, completion_tokens: int = 300, tool_calls: int = 1):
+        """
+        初始化客户端
+
+        Args:
+            latency: 每次调用的模拟延迟（秒）
+            completion_tokens: 每次文本回复的 token 数（一个汉字计为一个 token）
+            tool_calls: 每个智能体在给出文本回复前发出的工具调用次数
+        """
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.tool_calls = tool_calls
+        self.calls = 0
+        self.tool_calls_issued = 0
+        self.simulated_seconds = 0.0
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._last_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._model_info = ModelInfo(vision=False, function_calling=True, json_output=True,
+                                     family="unknown", structured_output=True)
+
+    @staticmethod
+    def _tool_arguments(tool: Union[Tool, ToolSchema], seed: str) -> Dict[str, Any]:
+        """按工具参数定义生成必填参数"""
+        schema = tool.schema if isinstance(tool, Tool) else tool
+        parameters = schema.get("parameters", {})
+        arguments: Dict[str, Any] = {}
+        for name in parameters.get("required", []):
+            kind = parameters.get("properties", {}).get(name, {}).get("type", "string")
+            if kind == "array":
+                arguments[name] = [f"https://example.com/benchmark/{seed}"]
+            elif kind in ("integer", "number"):
+                arguments[name] = 1
+            elif kind == "boolean":
+                arguments[name] = False
+            else:
+                arguments[name] = f"基准测试 {seed}"
+        return arguments
+
+    def _reply(self, messages: Sequence[LLMMessage],
+               tools: Sequence[Union[Tool, ToolSchema]], tool_choice: Any) -> CreateResult:
+        text = "".join(str(message.content) for message in messages)
+        prompt_tokens = len(text) // 2
+        issued = sum(1 for message in messages
+                     if isinstance(message, AssistantMessage) and isinstance(message.content, list))
+        if tools and tool_choice != "none" and issued < self.tool_calls:
+            names = [tool.name if isinstance(tool, Tool) else tool["name"] for tool in tools]
+            index = next((i for i, name in enumerate(names) if "search" in name), 0)
+            seed = hashlib.sha256(text[:2000].encode("utf-8")).hexdigest()[:8]
+            call = FunctionCall(id=f"call_{self.calls}", name=names[index],
+                                arguments=json.dumps(self._tool_arguments(tools[index], seed), ensure_ascii=False))
+            self.tool_calls_issued += 1
+            usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=20)
+            return CreateResult(finish_reason="function_calls", content=[call], usage=usage, cached=False)
+        body = ("基准测试分析内容。" * (self.completion_tokens // 9 + 1))[:self.completion_tokens]
+        usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=self.completion_tokens)
+        return CreateResult(finish_reason="stop", content=f"## 基准测试结论\n\n{body}", usage=usage, cached=False)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        self.calls += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+            self.simulated_seconds += self.latency
+        result = self._reply(messages, tools, tool_choice)
+        self._last_usage = result.usage
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + result.usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + result.usage.completion_tokens,
+        )
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        result = await self.create(messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                                   extra_create_args=extra_create_args, cancellation_token=cancellation_token)
+        if isinstance(result.content, str):
+            step = max(1, len(result.content) // 4)
+            for i in range(0, len(result.content), step):
+                yield result.content[i:i + step]
+        yield result
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._last_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return sum(len(str(message.content)) for message in messages) // 2
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *,
+                         tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return max(0, 128000 - self.count_tokens(messages, tools=tools))
+
+    @property
+    def capabilities(self) -> ModelInfo:
+        return self._model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._model_info
+
+
+def _current_rss_mb() -> float:
+    """当前进程的常驻内存（MB），非 Linux 系统使用历史峰值"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _RssSampler:
+    """后台定时采样常驻内存，记录场景运行期间的峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, _current_rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = _current_rss_mb()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> float:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.peak = max(self.peak, _current_rss_mb())
+        return self.peak
+
+
+def configure_offline(work_dir: str, tool_latency: float):
+    """
+    把进程内配置切换为离线基准测试环境（只影响当前进程）
+
+    Args:
+        work_dir: 临时目录，存放检查点、工具定义缓存和批量汇总
+        tool_latency: 本地 MCP 服务器每次工具调用的模拟延迟（秒）
+    """
+    servers = get_mcp_servers()
+    servers[:] = [{
+        "name": "tavily",
+        "command": sys.executable,
+        "args": [os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_mcp_server.py")],
+        "env": {"BENCH_MCP_LATENCY": str(tool_latency)},
+    }]
+    PROJECT_CONFIG["mcp_pool"].update({"lazy_connect": False, "health_check_interval": 0,
+                                       "tool_schema_cache": os.path.join(work_dir, "mcp_tools.json")})
+    # 限流和缓存会让测量结果取决于运行顺序，基准测试中关闭
+    PROJECT_CONFIG["rate_limit"]["enabled"] = False
+    PROJECT_CONFIG["tool_cache"]["enabled"] = False
+    PROJECT_CONFIG["research_memory"]["enabled"] = False
+    PROJECT_CONFIG["llm_cache"]["mode"] = "off"
+    PROJECT_CONFIG["report"]["reuse_max_age_hours"] = 0
+    PROJECT_CONFIG["checkpoint"]["dir"] = os.path.join(work_dir, "checkpoints")
+
+
+@contextlib.contextmanager
+def _quiet(enabled: bool = True):
+    """运行期间丢弃标准输出"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def cleanup_outputs():
+    """删除基准测试在 reports 目录中生成的报告和性能分析文件"""
+    reports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
+    for path in glob.glob(os.path.join(reports_dir, f"*_{BENCH_CODE_PREFIX}[0-9]*")):
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+async def run_scenario(name: str, client: FakeChatCompletionClient, runs: int,
+                       concurrency: int, work_dir: str) -> Dict[str, Any]:
+    """
+    运行一个基准测试场景
+
+    Args:
+        name: 场景名称 (single / parallel / batch)
+        client: 假模型客户端
+        runs: 分析次数（batch 场景为股票数量）
+        concurrency: batch 场景的并发数
+        work_dir: 临时目录
+
+    Returns:
+        Dict[str, Any]: 场景指标
+    """
+    codes = [f"{BENCH_CODE_PREFIX}{i:03d}" for i in range(1, runs + 1)]
+    mode = "parallel" if name == "parallel" else "sequential"
+    calls_before, tools_before = client.calls, client.tool_calls_issued
+    simulated_before = client.simulated_seconds
+    sampler = _RssSampler()
+    sampler.start()
+    start_time = time.perf_counter()
+    if name == "batch":
+        runner = BatchRunner(concurrency=concurrency, mode=mode, output_dir=work_dir, model_client=client)
+        await runner.run(codes)
+        records = [(r["elapsed"], r["status"] == "succeeded") for r in runner.results]
+    else:
+        records = []
+        for code in codes:
+            result = await analyze_stock(code, mode=mode, model_client=client, verbose=False)
+            records.append((result["elapsed"], result["error"] is None and bool(result["agent_results"])))
+    wall_time = time.perf_counter() - start_time
+    peak_rss = await sampler.stop()
+
+    latencies = [elapsed for elapsed, ok in records if ok]
+    simulated_per_run = (client.simulated_seconds - simulated_before) / max(1, runs)
+    p50 = _percentile(latencies, 50)
+    return {
+        "runs": runs,
+        "succeeded": len(latencies),
+        "mode": mode,
+        "concurrency": concurrency if name == "batch" else 1,
+        "wall_time": round(wall_time, 3),
+        "throughput_per_minute": round(len(latencies) / wall_time * 60, 3) if wall_time > 0 else 0.0,
+        "latency": {
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+            "p50": round(p50, 4),
+            "p90": round(_percentile(latencies, 90), 4),
+            "p99": round(_percentile(latencies, 99), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0,
+        },
+        "model_calls_per_run": round((client.calls - calls_before) / max(1, runs), 2),
+        "tool_calls_per_run": round((client.tool_calls_issued - tools_before) / max(1, runs), 2),
+        "simulated_seconds_per_run": round(simulated_per_run, 4),
+        # 并行工作流中模型调用相互重叠，模拟延迟之和不是关键路径，不计算开销
+        "overhead_per_run": round(p50 - simulated_per_run, 4) if mode == "sequential" else None,
+        "peak_rss_mb": round(peak_rss, 1),
+    }
+
+
+def _metric(metrics: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = metrics
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    与基线结果比较
+
+    Args:
+        results: 本次基准测试结果
+        baseline: 基线结果
+        tolerance: 相对容差，例如 0.2 表示变差超过 20% 视为回退
+
+    Returns:
+        List[str]: 回退说明，为空表示没有回退
+    """
+    regressions = []
+    for name, metrics in results["scenarios"].items():
+        base_metrics = baseline.get("scenarios", {}).get(name)
+        if base_metrics is None:
+            continue
+        for path, higher_is_better in REGRESSION_METRICS:
+            current, base = _metric(metrics, path), _metric(base_metrics, path)
+            if current is None or base is None:
+                continue
+            if higher_is_better:
+                regressed = current < base * (1 - tolerance)
+            else:
+                regressed = current > base * (1 + tolerance) + (0 if path == "peak_rss_mb" else _MIN_SECONDS_DELTA)
+            if regressed:
+                regressions.append(f"{name}.{path}: {base} → {current}")
+    return regressions
+
+
+async def run_benchmark(scenarios: List[str], runs: int = 5, batch_size: int = 8, concurrency: int = 4,
+                        latency: float = 0.02, tool_latency: float = 0.01, completion_tokens: int = 300,
+                        tool_calls: int = 1, show_output: bool = False) -> Dict[str, Any]:
+    """
+    运行离线基准测试
+
+    Args:
+        scenarios: 要运行的场景
+        runs: single / parallel 场景的分析次数
+        batch_size: batch 场景的股票数量
+        concurrency: batch 场景的并发数
+        latency: 每次模型调用的模拟延迟（秒）
+        tool_latency: 每次工具调用的模拟延迟（秒）
+        completion_tokens: 每次文本回复的 token 数
+        tool_calls: 每个有工具的智能体发出的工具调用次数
+        show_output: 是否显示分析过程中的输出
+
+    Returns:
+        Dict[str, Any]: 各场景的指标与运行参数
+    """
+    import tempfile
+    from main import shutdown_resources
+
+    results: Dict[str, Any] = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "parameters": {"runs": runs, "batch_size": batch_size, "concurrency": concurrency, "latency": latency,
+                       "tool_latency": tool_latency, "completion_tokens": completion_tokens,
+                       "tool_calls": tool_calls},
+        "scenarios": {},
+    }
+    client = FakeChatCompletionClient(latency=latency, completion_tokens=completion_tokens, tool_calls=tool_calls)
+    with tempfile.TemporaryDirectory(prefix="research_bench_") as work_dir:
+        configure_offline(work_dir, tool_latency)
+        try:
+            # 预热：启动本地MCP服务器、完成模块导入，不计入结果
+            print("🔥 预热中（启动本地MCP服务器）...")
+            with _quiet(not show_output):
+                await analyze_stock(f"{BENCH_CODE_PREFIX}000", model_client=client, verbose=False)
+            for name in scenarios:
+                count = batch_size if name == "batch" else runs
+                print(f"⏱️ 场景 {name}: {count} 次分析...")
+                with _quiet(not show_output):
+                    results["scenarios"][name] = await run_scenario(name, client, count, concurrency, work_dir)
+        finally:
+            with _quiet():
+                await shutdown_resources(print_stats=False)
+            cleanup_outputs()
+    return results
+
+
+def print_results(results: Dict[str, Any]):
+    """打印基准测试结果"""
+    print("\n📊 基准测试结果:")
+    for name, metrics in results["scenarios"].items():
+        latency = metrics["latency"]
+        print(f"   {name} ({metrics['mode']}, 并发 {metrics['concurrency']}): "
+              f"成功 {metrics['succeeded']}/{metrics['runs']}  吞吐量 {metrics['throughput_per_minute']} 次/分钟")
+        print(f"      耗时 p50 {latency['p50']}秒  p90 {latency['p90']}秒  p99 {latency['p99']}秒  "
+              f"最大 {latency['max']}秒")
+        overhead = metrics["overhead_per_run"]
+        print(f"      每次模型调用 {metrics['model_calls_per_run']}  工具调用 {metrics['tool_calls_per_run']}  "
+              f"模拟延迟 {metrics['simulated_seconds_per_run']}秒"
+              + (f"  编排开销 {overhead}秒" if overhead is not None else ""))
+        print(f"      峰值内存 {metrics['peak_rss_mb']} MB")
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="离线基准测试：假模型 + 本地MCP服务器，测量编排开销")
+    parser.add_argument("--scenarios", default=",".join(BENCHMARK_SCENARIOS),
+                        help=f"要运行的场景，逗号分隔 (默认: {','.join(BENCHMARK_SCENARIOS)})")
+    parser.add_argument("--runs", type=int, default=5, help="single / parallel 场景的分析次数 (默认: 5)")
+    parser.add_argument("--batch-size", type=int, default=8, help="batch 场景的股票数量 (默认: 8)")
+    parser.add_argument("--concurrency", type=int, default=4, help="batch 场景的并发数 (默认: 4)")
+    parser.add_argument("--latency", type=float, default=0.02, help="每次模型调用的模拟延迟，秒 (默认: 0.02)")
+    parser.add_argument("--tool-latency", type=float, default=0.01, help="每次工具调用的模拟延迟，秒 (默认: 0.01)")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="每次文本回复的 token 数 (默认: 300)")
+    parser.add_argument("--tool-calls", type=int, default=1, help="每个有工具的智能体的工具调用次数 (默认: 1)")
+    parser.add_argument("--output", help="结果保存路径 (JSON)")
+    parser.add_argument("--baseline", help="基线结果路径，指标变差超过容差时返回非零退出码")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="回退判定的相对容差 (默认: 0.2)")
+    parser.add_argument("--show-output", action="store_true", help="显示分析过程中的输出")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in BENCHMARK_SCENARIOS]
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(unknown)}，可选: {', '.join(BENCHMARK_SCENARIOS)}")
+
+    results = asyncio.run(run_benchmark(
+        scenarios, runs=args.runs, batch_size=args.batch_size, concurrency=args.concurrency,
+        latency=args.latency, tool_latency=args.tool_latency, completion_tokens=args.completion_tokens,
+        tool_calls=args.tool_calls, show_output=args.show_output,
+    ))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"   📁 结果已保存到: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 相对基线的性能回退 (容差 {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ 与基线相比没有超过 {args.tolerance:.0%} 的回退")
+
+
+if __name__ == "__main__":
+    main()
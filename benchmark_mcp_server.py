@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试用的本地 MCP 服务器
+通过 stdio 提供与 tavily-mcp 相同名称和参数的 tavily-search / tavily-extract 工具，返回固定内容，
+不访问网络。每次调用的延迟由环境变量 BENCH_MCP_LATENCY（秒）控制。
+
+    python benchmark_mcp_server.py
+"""
+
+import asyncio
+import os
+from typing import List, Optional
+
+from mcp.server.fastmcp import FastMCP
+
+# 每次工具调用的模拟延迟（秒）
+LATENCY = float(os.getenv("BENCH_MCP_LATENCY", "0"))
+
+server = FastMCP("tavily-benchmark", log_level="WARNING")
+
+
+def _search_result(query: str, index: int) -> str:
+    """生成一条固定的搜索结果（格式与 tavily-mcp 的文本输出一致）"""
+    return (f"Title: {query} - 基准测试结果 {index}\n"
+            f"URL: https://example.com/benchmark/{index}\n"
+            f"Content: 这是关于「{query}」的第 {index} 条固定搜索结果，用于离线基准测试。"
+            "公司经营稳健，营收同比增长，行业景气度平稳，技术面处于震荡区间。\n")
+
+
+@server.tool(name="tavily-search", description="A search engine optimized for comprehensive, accurate, "
+             "and trusted results (benchmark stand-in returning canned results).")
+async def tavily_search(query: str, search_depth: str = "basic", topic: str = "general",
+                        days: int = 3, time_range: Optional[str] = None, max_results: int = 10,
+                        include_images: bool = False, include_image_descriptions: bool = False,
+                        include_raw_content: bool = False, include_domains: Optional[List[str]] = None,
+                        exclude_domains: Optional[List[str]] = None) -> str:
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    count = max(1, min(max_results, 5))
+    return "Detailed Results:\n\n" + "\n".join(_search_result(query, i) for i in range(1, count + 1))
+
+
+@server.tool(name="tavily-extract", description="A powerful web content extraction tool "
+             "(benchmark stand-in returning canned content).")
+async def tavily_extract(urls: List[str], extract_depth: str = "basic", include_images: bool = False) -> str:
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    return "\n\n".join(f"URL: {url}\nRaw Content: 基准测试网页内容，包含公司简介、主营业务和最新财务数据。"
+                       for url in urls)
+
+
+if __name__ == "__main__":
+    server.run("stdio")
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+运行预算模块
+每只股票的一次运行有总 token、总工具调用次数和总耗时上限，按权重分配给工作流中的智能体：
+- 智能体开始时按剩余预算和尚未完成智能体的权重确定其工具调用上限、token 额度和时间额度
+- 预算接近用完（超过 tighten_at）时，之后开始的智能体工具调用上限减半
+- 超出上限的工具调用直接返回错误，提示智能体基于已有信息完成分析；时间额度由智能体期限执行
+- token 额度在模型调用时执行：剩余额度不足单次生成上限时按剩余额度限制生成长度（max_tokens），
+  已不足以生成有效回复时不再调用模型，直接输出降级章节（策略顾问等不调用工具的智能体同样受限）
+
+当前运行的预算通过 contextvars 传递，与性能分析相同，并发运行的多只股票互不干扰
+"""
+
+import contextvars
+import math
+import time
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence, Union
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, RequestUsage
+from autogen_core.tools import BaseTool, Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import get_agent_config, get_budget_config, get_llm_cache_config
+from context_policy import estimate_tokens
+from model_middleware import ModelClientWrapper
+from tool_middleware import ToolWrapper, wrap_tools
+
+# 当前运行的预算
+_current_budget: contextvars.ContextVar[Optional["RunBudget"]] = contextvars.ContextVar(
+    "current_budget", default=None
+)
+
+# 剩余额度低于该值时不再调用模型
+_MIN_COMPLETION_TOKENS = 256
+
+
+class BudgetExceededError(RuntimeError):
+    """工具调用超出预算"""
+
+
+class RunBudget:
+    """单次运行的预算 - 记录用量并在智能体开始时分配额度"""
+
+    def __init__(self, agents: Sequence[str], max_tokens: int = 0, max_tool_calls: int = 0,
+                 max_seconds: float = 0.0, weights: Optional[Mapping[str, float]] = None,
+                 tighten_at: float = 0.8, min_agent_seconds: float = 30.0):
+        """
+        初始化预算
+
+        Args:
+            agents: 本次运行需要执行的智能体（续跑或复用时跳过的智能体不分配预算）
+            max_tokens: 总 token 上限（提示 + 生成），0 表示不限制
+            max_tool_calls: 总工具调用次数上限，0 表示不限制
+            max_seconds: 总耗时上限（秒），0 表示不限制
+            weights: 智能体权重，未列出的智能体权重为 1
+            tighten_at: 任一维度的已用比例超过该值后，之后开始的智能体工具调用上限减半
+            min_agent_seconds: 每个智能体至少分配的时间（秒）
+        """
+        self.agents = list(agents)
+        self.max_tokens = max_tokens
+        self.max_tool_calls = max_tool_calls
+        self.max_seconds = max_seconds
+        self.weights = {name: (weights or {}).get(name, 1.0) for name in self.agents}
+        self.tighten_at = tighten_at
+        self.min_agent_seconds = min_agent_seconds
+        self.started_at = time.perf_counter()
+        self.tokens = 0
+        self.tool_calls = 0
+        self.denied_tool_calls = 0
+        self.denied_model_calls = 0
+        self.finished: set = set()
+        # 智能体开始时确定的额度与之后的用量
+        self.allocations: Dict[str, Dict[str, Any]] = {}
+
+    # ==================== 用量 ====================
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def spent_fraction(self) -> float:
+        """各维度已用比例的最大值"""
+        fractions = [0.0]
+        if self.max_tokens:
+            fractions.append(self.tokens / self.max_tokens)
+        if self.max_tool_calls:
+            fractions.append(self.tool_calls / self.max_tool_calls)
+        if self.max_seconds:
+            fractions.append(self.elapsed() / self.max_seconds)
+        return max(fractions)
+
+    def _pending_weight(self, agent_name: str) -> float:
+        """尚未完成的智能体（含当前智能体）的权重之和"""
+        pending = [name for name in self.agents if name not in self.finished or name == agent_name]
+        return sum(self.weights.get(name, 1.0) for name in pending) or 1.0
+
+    # ==================== 分配 ====================
+
+    def agent_started(self, agent_name: str) -> Dict[str, Any]:
+        """
+        智能体开始时按剩余预算分配额度
+
+        Args:
+            agent_name: 智能体名称
+
+        Returns:
+            Dict[str, Any]: 额度，tool_cap / token_allowance / seconds 为 None 表示不限制
+        """
+        if agent_name in self.allocations:
+            return self.allocations[agent_name]
+        weight = self.weights.get(agent_name, 1.0)
+        share = weight / self._pending_weight(agent_name)
+        tightened = self.spent_fraction() >= self.tighten_at
+
+        agent_config = get_agent_config(agent_name) or {}
+        tool_cap = agent_config.get("max_tool_iterations")
+        if self.max_tool_calls:
+            remaining_calls = max(0, self.max_tool_calls - self.tool_calls)
+            fair_share = math.floor(remaining_calls * share)
+            tool_cap = fair_share if tool_cap is None else min(tool_cap, fair_share)
+        if tightened and tool_cap is not None:
+            tool_cap //= 2
+
+        token_allowance = None
+        if self.max_tokens:
+            token_allowance = int(max(0, self.max_tokens - self.tokens) * share)
+
+        seconds = None
+        if self.max_seconds:
+            remaining_seconds = self.max_seconds - self.elapsed()
+            # 为尚未开始的策略顾问保留时间，保证最终建议能够生成
+            advisor = "strategy_advisor"
+            if agent_name != advisor and advisor in self.agents and advisor not in self.allocations:
+                remaining_seconds -= self.max_seconds * self.weights[advisor] / sum(self.weights.values())
+            seconds = max(self.min_agent_seconds, remaining_seconds)
+
+        allocation = {"tool_cap": tool_cap, "token_allowance": token_allowance, "seconds": seconds,
+                      "tightened": tightened, "tool_calls": 0, "tokens": 0, "denied_tool_calls": 0,
+                      "denied_model_calls": 0}
+        self.allocations[agent_name] = allocation
+        if tightened:
+            print(f"💰 {agent_name} 开始时预算已用 {self.spent_fraction():.0%}，工具调用上限收紧为 {tool_cap}")
+        return allocation
+
+    def agent_finished(self, agent_name: str):
+        """智能体完成，释放其对剩余预算的占用"""
+        self.finished.add(agent_name)
+
+    # ==================== 记账 ====================
+
+    def record_tokens(self, agent_name: str, tokens: int):
+        """记录模型调用的 token 用量"""
+        self.tokens += tokens
+        self.agent_started(agent_name)["tokens"] += tokens
+
+    def remaining_tokens(self, agent_name: str) -> Optional[int]:
+        """
+        智能体还可以使用的 token 数（取智能体额度与运行总上限的剩余量中较小的一个）
+
+        Returns:
+            Optional[int]: 剩余 token 数，不限制时返回 None
+        """
+        allocation = self.agent_started(agent_name)
+        remaining = []
+        if allocation["token_allowance"] is not None:
+            remaining.append(allocation["token_allowance"] - allocation["tokens"])
+        if self.max_tokens:
+            remaining.append(self.max_tokens - self.tokens)
+        return max(0, min(remaining)) if remaining else None
+
+    def record_denied_model_call(self, agent_name: str):
+        """记录一次因 token 额度不足未执行的模型调用"""
+        self.denied_model_calls += 1
+        self.agent_started(agent_name)["denied_model_calls"] += 1
+
+    def check_tool_call(self, agent_name: str) -> Optional[str]:
+        """
+        检查工具调用是否在预算内
+
+        Returns:
+            Optional[str]: 超出预算的原因，在预算内返回 None
+        """
+        allocation = self.agent_started(agent_name)
+        if allocation["tool_cap"] is not None and allocation["tool_calls"] >= allocation["tool_cap"]:
+            return f"{agent_name} 的工具调用次数已达上限 ({allocation['tool_cap']})"
+        if self.max_tool_calls and self.tool_calls >= self.max_tool_calls:
+            return f"本次运行的工具调用总数已达上限 ({self.max_tool_calls})"
+        if allocation["token_allowance"] is not None and allocation["tokens"] >= allocation["token_allowance"]:
+            return f"{agent_name} 的 token 额度已用完 ({allocation['token_allowance']})"
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            return f"本次运行的 token 总数已达上限 ({self.max_tokens})"
+        if self.max_seconds and self.elapsed() >= self.max_seconds:
+            return f"本次运行已达耗时上限 ({self.max_seconds:g}秒)"
+        return None
+
+    def record_tool_call(self, agent_name: str, allowed: bool):
+        """记录一次工具调用（或被拒绝的调用）"""
+        allocation = self.agent_started(agent_name)
+        if allowed:
+            self.tool_calls += 1
+            allocation["tool_calls"] += 1
+        else:
+            self.denied_tool_calls += 1
+            allocation["denied_tool_calls"] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """预算与用量汇总"""
+        return {
+            "limits": {"tokens": self.max_tokens, "tool_calls": self.max_tool_calls, "seconds": self.max_seconds},
+            "used": {"tokens": self.tokens, "tool_calls": self.tool_calls, "seconds": round(self.elapsed(), 3)},
+            "denied_tool_calls": self.denied_tool_calls,
+            "denied_model_calls": self.denied_model_calls,
+            "agents": {name: dict(allocation) for name, allocation in self.allocations.items()},
+        }
+
+
+class BudgetedModelClient(ModelClientWrapper):
+    """按当前运行预算限制模型调用的生成长度，并把 token 用量计入预算的客户端"""
+
+    def __init__(self, client: ChatCompletionClient, agent_name: str, max_completion_tokens: int = 0,
+                 count_cached: bool = False):
+        """
+        初始化客户端
+
+        Args:
+            client: 被包装的模型客户端
+            agent_name: 智能体名称
+            max_completion_tokens: 单次生成的上限，剩余额度低于该值时才限制生成长度，0 表示总是限制
+            count_cached: 缓存命中的结果也计入用量（回放时预算与记录时一致，生成长度限制参数不变）
+        """
+        super().__init__(client)
+        self.agent_name = agent_name
+        self.max_completion_tokens = max_completion_tokens
+        self.count_cached = count_cached
+
+    def _limit(self, messages: Sequence[LLMMessage],
+               extra_create_args: Mapping[str, Any]) -> Union[Mapping[str, Any], CreateResult]:
+        """
+        按剩余 token 额度限制本次调用
+
+        Returns:
+            Union[Mapping[str, Any], CreateResult]: 调整后的 extra_create_args；额度已用完时返回降级回复
+        """
+        budget = _current_budget.get()
+        remaining = budget.remaining_tokens(self.agent_name) if budget is not None else None
+        if remaining is None:
+            return extra_create_args
+        prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        room = remaining - prompt_tokens
+        if room < _MIN_COMPLETION_TOKENS:
+            from deadlines import DEGRADED_MARKER
+
+            budget.record_denied_model_call(self.agent_name)
+            print(f"   💰 {self.agent_name} 的 token 额度已用完（剩余 {remaining}，提示约 {prompt_tokens}），章节降级")
+            content = (f"{DEGRADED_MARKER}：{self.agent_name} 的 token 额度已用完，本章节结论缺失。\n\n"
+                       "后续分析请基于其他章节的结论进行判断。")
+            return CreateResult(finish_reason="stop", content=content,
+                                usage=RequestUsage(prompt_tokens=0, completion_tokens=0), cached=False)
+        if self.max_completion_tokens and room >= self.max_completion_tokens:
+            return extra_create_args
+        limited = dict(extra_create_args)
+        limited["max_tokens"] = min(room, limited.get("max_tokens") or room)
+        return limited
+
+    def _record(self, result: Optional[CreateResult]):
+        budget = _current_budget.get()
+        if budget is not None and result is not None and (self.count_cached or not result.cached):
+            budget.record_tokens(self.agent_name, result.usage.prompt_tokens + result.usage.completion_tokens)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        extra_create_args = self._limit(messages, extra_create_args)
+        if isinstance(extra_create_args, CreateResult):
+            return extra_create_args
+        result = await super().create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        self._record(result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        extra_create_args = self._limit(messages, extra_create_args)
+        if isinstance(extra_create_args, CreateResult):
+            yield extra_create_args
+            return
+        async for chunk in super().create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                self._record(chunk)
+            yield chunk
+
+
+class BudgetedTool(ToolWrapper):
+    """超出运行预算时拒绝调用的工具"""
+
+    def __init__(self, tool: BaseTool, agent_name: str):
+        super().__init__(tool)
+        self.agent_name = agent_name
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        budget = _current_budget.get()
+        if budget is not None:
+            reason = budget.check_tool_call(self.agent_name)
+            budget.record_tool_call(self.agent_name, allowed=reason is None)
+            if reason is not None:
+                print(f"   💰 {self.agent_name} 工具调用被拒绝: {reason}")
+                raise BudgetExceededError(f"{reason}。请不要再调用工具，基于已有信息完成分析。")
+        return await self.call_tool(args, cancellation_token)
+
+
+def current_budget() -> Optional[RunBudget]:
+    """获取当前运行的预算，未启用时返回 None"""
+    return _current_budget.get()
+
+
+def start_budget(agents: Sequence[str]) -> Optional[contextvars.Token]:
+    """
+    为当前上下文创建并激活运行预算
+
+    Args:
+        agents: 本次运行需要执行的智能体
+
+    Returns:
+        Optional[contextvars.Token]: 用于 stop_budget 的令牌，未启用时返回 None
+    """
+    budget_config = get_budget_config()
+    if not budget_config.get("enabled", False):
+        return None
+    return _current_budget.set(RunBudget(
+        agents,
+        max_tokens=budget_config.get("max_tokens", 0),
+        max_tool_calls=budget_config.get("max_tool_calls", 0),
+        max_seconds=budget_config.get("max_seconds", 0.0),
+        weights=budget_config.get("weights", {}),
+        tighten_at=budget_config.get("tighten_at", 0.8),
+        min_agent_seconds=budget_config.get("min_agent_seconds", 30.0),
+    ))
+
+
+def stop_budget(token: Optional[contextvars.Token]) -> Dict[str, Any]:
+    """
+    结束当前运行的预算
+
+    Returns:
+        Dict[str, Any]: 预算与用量汇总，未启用时返回空字典
+    """
+    if token is None:
+        return {}
+    budget = _current_budget.get()
+    _current_budget.reset(token)
+    return budget.to_dict()
+
+
+def budget_model_client(client: ChatCompletionClient, agent_name: str) -> ChatCompletionClient:
+    """按配置为智能体的模型客户端加上 token 额度限制和预算记账"""
+    budget_config = get_budget_config()
+    if not budget_config.get("enabled", False):
+        return client
+    return BudgetedModelClient(client, agent_name, budget_config.get("max_completion_tokens", 0),
+                               count_cached=get_llm_cache_config().get("mode") == "replay")
+
+
+def budget_tools(agent_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """按配置为智能体的工具加上预算检查"""
+    if not get_budget_config().get("enabled", False):
+        return tools
+    return wrap_tools(tools, lambda tool: BudgetedTool(tool, agent_name))
+
+
+def print_budget_summary(budget: Dict[str, Any]):
+    """打印预算用量"""
+    if not budget:
+        return
+    limits, used = budget["limits"], budget["used"]
+
+    def usage(key: str, unit: str = "") -> str:
+        return f"{used[key]:g}{unit}" + (f" / {limits[key]:g}{unit}" if limits[key] else "")
+
+    print(f"\n💰 运行预算: tokens {usage('tokens')}  工具调用 {usage('tool_calls')}  "
+          f"耗时 {usage('seconds', '秒')}")
+    if budget["denied_tool_calls"]:
+        print(f"   超出预算被拒绝的工具调用: {budget['denied_tool_calls']}")
+    if budget.get("denied_model_calls"):
+        print(f"   token 额度用完未执行的模型调用: {budget['denied_model_calls']}")
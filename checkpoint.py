@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+断点续跑模块
+每个智能体完成后把其最终输出写入本地检查点文件，运行中断后可从第一个未完成的节点继续，
+已完成智能体的输出作为任务消息重新广播给剩余智能体，不再重复调用模型
+"""
+
+import json
+import os
+import re
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Union
+
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+
+from config import get_checkpoint_config
+from workflow import REQUIRED_AGENTS
+from deadlines import is_degraded
+
+# 检查点文件格式版本，格式不兼容时忽略旧文件
+CHECKPOINT_VERSION = 1
+
+
+class RunCheckpoint:
+    """单只股票分析的检查点 - 记录任务描述和已完成智能体的最终输出"""
+
+    def __init__(self, path: str, stock_code: str, mode: str, task: str):
+        """
+        初始化检查点
+
+        Args:
+            path: 检查点文件路径
+            stock_code: 股票代码
+            mode: 工作流模式
+            task: 任务描述（续跑时沿用，保证与中断前的上下文一致）
+        """
+        self.path = path
+        self.stock_code = stock_code
+        self.mode = mode
+        self.task = task
+        self.created_at = time.time()
+        # 智能体名称到最终输出的映射，按完成顺序排列
+        self.completed: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RunCheckpoint"]:
+        """
+        读取检查点文件
+
+        Args:
+            path: 检查点文件路径
+
+        Returns:
+            Optional[RunCheckpoint]: 检查点，文件不存在或无法解析时返回 None
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CHECKPOINT_VERSION:
+                print(f"⚠️ 检查点格式版本不兼容，忽略: {path}")
+                return None
+            checkpoint = cls(path, data["stock_code"], data["mode"], data["task"])
+            checkpoint.created_at = data.get("created_at", checkpoint.created_at)
+            checkpoint.completed = {item["agent"]: item["content"] for item in data["completed"]}
+            return checkpoint
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ 读取检查点失败，忽略: {path} ({e})")
+            return None
+
+    @property
+    def remaining(self) -> List[str]:
+        """尚未完成的智能体，按工作流顺序排列"""
+        return [name for name in REQUIRED_AGENTS if name not in self.completed]
+
+    def record(self, agent_name: str, content: str):
+        """记录一个智能体的最终输出，并立即写入磁盘"""
+        self.completed[agent_name] = content
+        self.save()
+
+    def save(self):
+        """原子写入检查点文件（先写临时文件再重命名，中断时不会留下半个文件）"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "stock_code": self.stock_code,
+            "mode": self.mode,
+            "task": self.task,
+            "created_at": self.created_at,
+            "updated_at": time.time(),
+            "completed": [{"agent": name, "content": content} for name, content in self.completed.items()],
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """删除检查点文件（分析成功完成后调用）"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def resume_messages(self) -> List[BaseChatMessage]:
+        """续跑时的任务消息：原始任务 + 已完成智能体的最终输出"""
+        return build_resume_messages(self.task, self.completed)
+
+    async def replay(self) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, TaskResult], None]:
+        """所有智能体均已完成时直接回放记录的消息，不再运行工作流"""
+        messages = self.resume_messages()
+        for message in messages:
+            yield message
+        yield TaskResult(messages=messages, stop_reason="已从检查点恢复全部智能体结果")
+
+
+def build_resume_messages(task: str, completed: Dict[str, str]) -> List[BaseChatMessage]:
+    """
+    生成跳过部分智能体时的任务消息：原始任务 + 已有智能体的最终输出
+
+    Args:
+        task: 任务描述
+        completed: 智能体名称到最终输出的映射
+
+    Returns:
+        List[BaseChatMessage]: 任务消息列表
+    """
+    messages: List[BaseChatMessage] = [TextMessage(source="user", content=task)]
+    for agent_name, content in completed.items():
+        messages.append(TextMessage(source=agent_name, content=content))
+    return messages
+
+
+def get_checkpoint_path(stock_code: str) -> str:
+    """获取股票对应的检查点文件路径"""
+    directory = get_checkpoint_config().get("dir", ".cache/checkpoints")
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+    safe_code = re.sub(r"[^\w.-]", "_", stock_code)
+    return os.path.join(directory, f"{safe_code}.json")
+
+
+async def track_checkpoint(stream: AsyncGenerator, checkpoint: RunCheckpoint) -> AsyncGenerator:
+    """
+    透传消息流，每个智能体输出最终消息时写入检查点（超时降级的章节不记录，续跑时重新运行）
+
+    Args:
+        stream: 工作流的消息流
+        checkpoint: 检查点
+
+    Yields:
+        原始消息
+    """
+    async for message in stream:
+        if isinstance(message, BaseChatMessage) and message.source in REQUIRED_AGENTS:
+            content = message.content if isinstance(message.content, str) else message.to_text()
+            if not is_degraded(content) and checkpoint.completed.get(message.source) != content:
+                checkpoint.record(message.source, content)
+        yield message
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模型客户端注册表
+进程内所有智能体共享同一个带连接池的模型客户端 - 按模型端点区分，
+各智能体的 temperature / model 等差异通过每次调用的参数覆盖实现，而不是创建独立客户端
+"""
+
+import asyncio
+import hashlib
+from typing import Any, AsyncGenerator, Dict, Literal, Mapping, Optional, Sequence, Union
+
+import httpx
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import get_model_pool_config
+from model_middleware import ModelClientWrapper
+from profiler import observe_request
+from rate_limiter import get_rate_limiter
+
+
+class AgentModelClient(ModelClientWrapper):
+    """
+    智能体模型客户端视图
+
+    共享底层客户端及其连接池，每次调用时合并该智能体的参数覆盖（如 temperature、model）。
+    关闭视图不会关闭共享客户端，共享客户端由注册表统一关闭。
+    """
+
+    def __init__(self, client: ChatCompletionClient, overrides: Optional[Mapping[str, Any]] = None):
+        super().__init__(client)
+        self.overrides = dict(overrides or {})
+
+    def _merge(self, extra_create_args: Mapping[str, Any]) -> Dict[str, Any]:
+        merged = dict(self.overrides)
+        merged.update(extra_create_args)
+        return merged
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        return await super().create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=self._merge(extra_create_args),
+            cancellation_token=cancellation_token,
+        )
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        # 流式调用默认不返回 token 用量，显式请求以保证性能分析和运行预算的统计
+        merged = self._merge(extra_create_args)
+        merged.setdefault("stream_options", {"include_usage": True})
+        return super().create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=merged,
+            cancellation_token=cancellation_token,
+        )
+
+    async def close(self) -> None:
+        # 共享客户端由注册表关闭
+        pass
+
+
+class ModelClientRegistry:
+    """模型客户端注册表 - 每个模型端点只创建一个客户端和一个 HTTP 连接池"""
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0):
+        """
+        初始化注册表
+
+        Args:
+            max_connections: 连接池最大连接数
+            max_keepalive_connections: 最大保持活动的空闲连接数
+            keepalive_expiry: 空闲连接保持时间（秒）
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients: Dict[str, ChatCompletionClient] = {}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """注册表所属的事件循环"""
+        return self._loop
+
+    @staticmethod
+    def _key(model_config: Dict[str, Any]) -> str:
+        api_key_hash = hashlib.sha256(str(model_config.get("api_key", "")).encode("utf-8")).hexdigest()[:12]
+        return f"{model_config['name']}@{model_config.get('base_url', '')}#{api_key_hash}"
+
+    def get_client(self, model_config: Dict[str, Any]) -> ChatCompletionClient:
+        """
+        获取共享的模型客户端，首次调用时创建
+
+        Args:
+            model_config: 模型配置
+
+        Returns:
+            ChatCompletionClient: 共享客户端
+        """
+        # 延迟导入，避免与 agent_factory 循环导入
+        from agent_factory import create_model_client
+
+        key = self._key(model_config)
+        if key not in self._clients:
+            # 请求钩子统计客户端内部重试次数，响应钩子让内部重试掉的 429 也能反馈给限流器
+            event_hooks = {"request": [observe_request], "response": []}
+            limiter = get_rate_limiter("model")
+            if limiter is not None:
+                event_hooks["response"].append(limiter.observe_response)
+            http_client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=model_config.get("timeout", 120.0),
+                event_hooks=event_hooks,
+            )
+            self._http_clients[key] = http_client
+            self._clients[key] = create_model_client(model_config, http_client=http_client)
+            print(f"🔌 创建共享模型客户端: {model_config['name']} "
+                  f"(最大连接 {self.limits.max_connections}, 保持连接 {self.limits.max_keepalive_connections})")
+        return self._clients[key]
+
+    def get_agent_client(self, model_config: Dict[str, Any],
+                         overrides: Optional[Mapping[str, Any]] = None) -> ChatCompletionClient:
+        """获取带参数覆盖的智能体客户端视图"""
+        return AgentModelClient(self.get_client(model_config), overrides)
+
+    async def close(self):
+        """关闭所有共享客户端和连接池"""
+        for key, client in self._clients.items():
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"⚠️ 关闭模型客户端 {key} 时出错: {e}")
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._clients.clear()
+        self._http_clients.clear()
+
+
+# 进程级注册表
+_registry: Optional[ModelClientRegistry] = None
+
+
+def get_client_registry() -> ModelClientRegistry:
+    """
+    获取进程级模型客户端注册表（必须在事件循环中调用）
+
+    Returns:
+        ModelClientRegistry: 当前事件循环对应的注册表
+    """
+    global _registry
+    loop = asyncio.get_running_loop()
+    if _registry is None or _registry.loop is not loop:
+        pool_config = get_model_pool_config()
+        _registry = ModelClientRegistry(
+            max_connections=pool_config.get("max_connections", 100),
+            max_keepalive_connections=pool_config.get("max_keepalive_connections", 20),
+            keepalive_expiry=pool_config.get("keepalive_expiry", 30.0),
+        )
+    return _registry
+
+
+async def close_model_clients():
+    """关闭进程级注册表中的所有模型客户端"""
+    global _registry
+    if _registry is not None:
+        registry, _registry = _registry, None
+        if registry.loop is asyncio.get_running_loop():
+            await registry.close()
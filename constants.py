@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+常量模块
+代码使用的固定取值，不属于用户配置：config.py 由用户从模板复制，这里的取值随代码更新
+不依赖 AutoGen，主程序解析命令行参数时可以直接导入
+"""
+
+# 支持的工作流模式
+WORKFLOW_MODES = ("sequential", "parallel")
+
+# 支持的模型调用缓存模式
+LLM_CACHE_MODES = ("off", "record", "replay", "cache")
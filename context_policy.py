@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上下文策略模块
+GraphFlow 会把之前所有智能体的完整输出广播给后续智能体，提示词随链路长度线性增长。
+compact 策略在消息交给智能体之前进行压缩：
+- 领域分析师：用户任务 + 协调者的分析计划（完整）+ 其他分析师结论的摘要
+- 策略顾问：用户任务 + 按报告格式整理的各智能体最终章节
+"""
+
+from typing import AsyncGenerator, Dict, List, Mapping, Sequence, Union
+
+# AutoGen 0.4+ API
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+
+from config import AGENT_NAMES
+from profiler import record_context_tokens
+from report_saver import format_agent_section
+
+# 支持的上下文策略
+CONTEXT_POLICIES = ("full", "compact")
+
+# 策略顾问收到的汇总消息的来源名称（OpenAI 接口要求 name 只含字母、数字、下划线和连字符）
+BRIEF_SOURCE = "analysis_report"
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数，tiktoken 不可用时按字符数估算"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 2
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _message_text(message: BaseChatMessage) -> str:
+    content = getattr(message, "content", None)
+    return content if isinstance(content, str) else message.to_text()
+
+
+def summarize_section(content: str, max_chars: int) -> str:
+    """
+    抽取式摘要：保留 Markdown 标题及每个标题下的第一行内容，不调用模型
+
+    Args:
+        content: 智能体完整输出
+        max_chars: 摘要最大字符数，0 表示不截断
+
+    Returns:
+        str: 摘要文本
+    """
+    if max_chars <= 0 or len(content) <= max_chars:
+        return content
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    picked: List[str] = []
+    after_heading = True
+    for line in lines:
+        if line.startswith("#"):
+            picked.append(line)
+            after_heading = True
+        elif after_heading:
+            picked.append(line)
+            after_heading = False
+    summary = "\n".join(picked) if any(line.startswith("#") for line in picked) else content
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rstrip()
+    return summary + "\n…（已压缩）"
+
+
+def _latest_by_source(messages: Sequence[BaseChatMessage]) -> Dict[str, BaseChatMessage]:
+    latest: Dict[str, BaseChatMessage] = {}
+    for message in messages:
+        latest[message.source] = message
+    return latest
+
+
+def compact_for_analyst(messages: Sequence[BaseChatMessage], summary_max_chars: int = 600) -> List[BaseChatMessage]:
+    """领域分析师的上下文：用户任务 + 协调者计划 + 其他分析师结论摘要"""
+    result: List[BaseChatMessage] = []
+    for source, message in _latest_by_source(messages).items():
+        if source in ("user", "coordinator_agent"):
+            result.append(message)
+        else:
+            summary = summarize_section(_message_text(message), summary_max_chars)
+            result.append(TextMessage(source=source, content=summary))
+    return result
+
+
+def compact_for_advisor(messages: Sequence[BaseChatMessage], section_max_chars: int = 0) -> List[BaseChatMessage]:
+    """策略顾问的上下文：用户任务 + 按报告格式整理的各智能体最终章节"""
+    latest = _latest_by_source(messages)
+    result: List[BaseChatMessage] = [latest["user"]] if "user" in latest else []
+    # 按智能体顺序整理章节，未知来源排在最后
+    order = [name for name in AGENT_NAMES if name in latest] + \
+            [name for name in latest if name not in AGENT_NAMES and name != "user"]
+    if order:
+        sections = "".join(
+            format_agent_section(name, summarize_section(_message_text(latest[name]), section_max_chars))
+            for name in order
+        )
+        result.append(TextMessage(source=BRIEF_SOURCE, content=f"## 智能体分析结果\n\n{sections}"))
+    return result
+
+
+class CompactContextAgent(BaseChatAgent):
+    """按上下文策略压缩输入消息后再交给被包装智能体的代理"""
+
+    def __init__(self, wrapped_agent: BaseChatAgent, summary_max_chars: int = 600,
+                 advisor_section_max_chars: int = 0):
+        """
+        初始化代理
+
+        Args:
+            wrapped_agent: 被包装的智能体，代理使用相同的名称，工作流与报告不受影响
+            summary_max_chars: 分析师结论摘要的最大字符数
+            advisor_section_max_chars: 策略顾问收到的每个章节的最大字符数，0 表示不截断
+        """
+        super().__init__(name=wrapped_agent.name, description=wrapped_agent.description)
+        self._wrapped_agent = wrapped_agent
+        self.summary_max_chars = summary_max_chars
+        self.advisor_section_max_chars = advisor_section_max_chars
+
+    @property
+    def produced_message_types(self) -> Sequence[type[BaseChatMessage]]:
+        return self._wrapped_agent.produced_message_types
+
+    def compact(self, messages: Sequence[BaseChatMessage]) -> Sequence[BaseChatMessage]:
+        """压缩输入消息并记录压缩前后的 token 数"""
+        if not messages or self.name == "coordinator_agent":
+            return messages
+        if self.name == "strategy_advisor":
+            compacted = compact_for_advisor(messages, self.advisor_section_max_chars)
+        else:
+            compacted = compact_for_analyst(messages, self.summary_max_chars)
+        before = sum(estimate_tokens(_message_text(m)) for m in messages)
+        after = sum(estimate_tokens(_message_text(m)) for m in compacted)
+        record_context_tokens(self.name, before, after)
+        print(f"🗜️ {self.name} 上下文压缩: {before} → {after} tokens")
+        return compacted
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage],
+                          cancellation_token: CancellationToken) -> Response:
+        return await self._wrapped_agent.on_messages(self.compact(messages), cancellation_token)
+
+    async def on_messages_stream(
+        self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken
+    ) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, Response], None]:
+        async for item in self._wrapped_agent.on_messages_stream(self.compact(messages), cancellation_token):
+            yield item
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        await self._wrapped_agent.on_reset(cancellation_token)
+
+    async def save_state(self) -> Mapping[str, object]:
+        return await self._wrapped_agent.save_state()
+
+    async def load_state(self, state: Mapping[str, object]) -> None:
+        await self._wrapped_agent.load_state(state)
+
+    async def close(self) -> None:
+        await self._wrapped_agent.close()
+
+
+def apply_context_policy(agents: List[BaseChatAgent], policy: str = "compact",
+                         summary_max_chars: int = 600,
+                         advisor_section_max_chars: int = 0) -> List[BaseChatAgent]:
+    """
+    按上下文策略包装智能体
+
+    Args:
+        agents: 智能体列表
+        policy: full 不做处理 / compact 压缩
+        summary_max_chars: 分析师结论摘要的最大字符数
+        advisor_section_max_chars: 策略顾问收到的每个章节的最大字符数
+
+    Returns:
+        List[BaseChatAgent]: 包装后的智能体列表
+    """
+    if policy not in CONTEXT_POLICIES:
+        raise ValueError(f"未知的上下文策略: {policy}，可选: {', '.join(CONTEXT_POLICIES)}")
+    if policy == "full":
+        return agents
+    return [CompactContextAgent(agent, summary_max_chars, advisor_section_max_chars) for agent in agents]
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+超时与降级模块
+- 智能体期限：每个智能体一轮分析有最长时间，超时后输出降级章节，工作流继续执行后续节点
+- 工具超时：单次工具调用有最长时间，超时作为工具错误返回给智能体
+- 对冲请求：无状态工具的调用超过一定时间未返回时发出重复请求，先返回的结果生效
+启用运行预算时，智能体期限取配置期限与预算分配的时间额度中较小的一个
+"""
+
+import asyncio
+from typing import AsyncGenerator, Dict, List, Mapping, Optional, Sequence, Union
+
+# AutoGen 0.4+ API
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool
+from pydantic import BaseModel
+
+from config import get_budget_config, get_timeout_config
+from budget import current_budget
+from tool_middleware import ToolWrapper, wrap_tools
+
+# 降级章节的开头标记，检查点不记录降级章节，报告复用时视为缺失
+DEGRADED_MARKER = "> ⚠️ 本章节已降级"
+
+# 超时与对冲统计
+_stats: Dict[str, int] = {"agent_timeouts": 0, "tool_timeouts": 0, "hedges": 0, "hedge_wins": 0}
+
+
+def is_degraded(content: str) -> bool:
+    """判断章节内容是否为超时降级输出"""
+    return content.lstrip().startswith(DEGRADED_MARKER)
+
+
+def degraded_content(agent_name: str, deadline: float) -> str:
+    """生成降级章节内容"""
+    return (f"{DEGRADED_MARKER}：{agent_name} 未能在 {deadline:g} 秒内完成分析，本章节结论缺失。\n\n"
+            "后续分析请基于其他章节的结论进行判断。")
+
+
+class DeadlineAgent(BaseChatAgent):
+    """给被包装智能体加上期限的代理 - 超时后取消其执行并输出降级章节"""
+
+    def __init__(self, wrapped_agent: BaseChatAgent, deadline: float):
+        """
+        初始化代理
+
+        Args:
+            wrapped_agent: 被包装的智能体，代理使用相同的名称，工作流与报告不受影响
+            deadline: 一轮分析的最长时间（秒），0 表示只受运行预算限制
+        """
+        super().__init__(name=wrapped_agent.name, description=wrapped_agent.description)
+        self._wrapped_agent = wrapped_agent
+        self.deadline = deadline
+
+    @property
+    def produced_message_types(self) -> Sequence[type[BaseChatMessage]]:
+        return self._wrapped_agent.produced_message_types
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage],
+                          cancellation_token: CancellationToken) -> Response:
+        response = None
+        async for item in self.on_messages_stream(messages, cancellation_token):
+            if isinstance(item, Response):
+                response = item
+        return response
+
+    async def on_messages_stream(
+        self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken
+    ) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, Response], None]:
+        budget = current_budget()
+        deadline = self.deadline
+        if budget is not None:
+            seconds = budget.agent_started(self.name)["seconds"]
+            if seconds is not None:
+                deadline = min(deadline, seconds) if deadline > 0 else seconds
+        if deadline <= 0:
+            try:
+                async for item in self._wrapped_agent.on_messages_stream(messages, cancellation_token):
+                    yield item
+            finally:
+                if budget is not None:
+                    budget.agent_finished(self.name)
+            return
+
+        # 被包装智能体的消息流在独立任务中运行，超时后整体取消，不会在任务之间切换执行
+        inner_token = CancellationToken()
+        cancellation_token.add_callback(inner_token.cancel)
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in self._wrapped_agent.on_messages_stream(messages, inner_token):
+                    await queue.put(item)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                await queue.put(done)
+
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + deadline
+        task = asyncio.create_task(pump())
+        try:
+            while True:
+                remaining = deadline_at - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                item = await asyncio.wait_for(queue.get(), remaining)
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        except asyncio.TimeoutError:
+            if loop.time() < deadline_at:
+                # 被包装智能体自身抛出的超时错误，不是期限到达
+                raise
+            _stats["agent_timeouts"] += 1
+            inner_token.cancel()
+            task.cancel()
+            print(f"⏱️ {self.name} 超过 {deadline:g} 秒未完成，章节降级，工作流继续")
+            yield Response(chat_message=TextMessage(source=self.name,
+                                                    content=degraded_content(self.name, deadline)))
+        finally:
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if budget is not None:
+                budget.agent_finished(self.name)
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        await self._wrapped_agent.on_reset(cancellation_token)
+
+    async def save_state(self) -> Mapping[str, object]:
+        return await self._wrapped_agent.save_state()
+
+    async def load_state(self, state: Mapping[str, object]) -> None:
+        await self._wrapped_agent.load_state(state)
+
+    async def close(self) -> None:
+        await self._wrapped_agent.close()
+
+
+class TimeoutTool(ToolWrapper):
+    """带超时和对冲请求的工具"""
+
+    def __init__(self, tool: BaseTool, timeout: float, hedge_delay: float = 0.0, max_hedges: int = 0):
+        """
+        初始化工具
+
+        Args:
+            tool: 被包装的工具
+            timeout: 调用的最长时间（秒），包括对冲请求
+            hedge_delay: 最近一个请求超过该时间未返回时发出重复请求，0 表示不对冲
+            max_hedges: 最多发出的重复请求数
+        """
+        super().__init__(tool)
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.max_hedges = max_hedges if hedge_delay > 0 else 0
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.timeout
+        first = asyncio.ensure_future(self.call_tool(args, CancellationToken()))
+        attempts: List[asyncio.Task] = [first]
+        cancellation_token.add_callback(lambda: [attempt.cancel() for attempt in attempts])
+        hedges = 0
+        last_error: Optional[BaseException] = None
+        try:
+            while attempts:
+                remaining = deadline_at - loop.time()
+                if remaining <= 0:
+                    break
+                wait = min(remaining, self.hedge_delay) if hedges < self.max_hedges else remaining
+                done, _ = await asyncio.wait(attempts, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    attempts.remove(attempt)
+                    if attempt.cancelled():
+                        continue
+                    if attempt.exception() is None:
+                        if attempt is not first:
+                            _stats["hedge_wins"] += 1
+                        return attempt.result()
+                    last_error = attempt.exception()
+                if not done and hedges < self.max_hedges and loop.time() < deadline_at:
+                    hedges += 1
+                    _stats["hedges"] += 1
+                    print(f"   🪁 {self.name} 超过 {self.hedge_delay:g} 秒未返回，发出对冲请求")
+                    attempts.append(asyncio.ensure_future(self.call_tool(args, CancellationToken())))
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+        if cancellation_token.is_cancelled():
+            raise asyncio.CancelledError()
+        if last_error is not None and not attempts:
+            raise last_error
+        _stats["tool_timeouts"] += 1
+        raise TimeoutError(f"工具 {self.name} 调用超时 ({self.timeout:g}秒)")
+
+
+def get_agent_deadline(agent_name: str) -> float:
+    """获取智能体的期限（秒），0 表示不限制"""
+    timeout_config = get_timeout_config()
+    return timeout_config.get("agent_deadlines", {}).get(agent_name, timeout_config.get("agent_deadline", 0))
+
+
+def apply_agent_deadlines(agents: List[BaseChatAgent]) -> List[BaseChatAgent]:
+    """
+    按配置给智能体加上期限
+
+    Args:
+        agents: 智能体列表
+
+    Returns:
+        List[BaseChatAgent]: 包装后的智能体列表，超时和运行预算都未启用时原样返回
+    """
+    timeouts_enabled = get_timeout_config().get("enabled", False)
+    # 启用运行预算时所有智能体都需要包装，由代理在开始和结束时通知预算
+    budget_enabled = get_budget_config().get("enabled", False)
+    if not timeouts_enabled and not budget_enabled:
+        return agents
+    wrapped = []
+    for agent in agents:
+        deadline = get_agent_deadline(agent.name) if timeouts_enabled else 0
+        wrapped.append(DeadlineAgent(agent, deadline) if deadline > 0 or budget_enabled else agent)
+    return wrapped
+
+
+def timeout_tools(server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """
+    按配置给MCP工具加上超时，并对允许对冲的服务器启用对冲请求
+
+    Args:
+        server_name: MCP服务器名称
+        tools: 工具列表
+
+    Returns:
+        List[BaseTool]: 包装后的工具列表，未启用时原样返回
+    """
+    timeout_config = get_timeout_config()
+    if not timeout_config.get("enabled", False):
+        return tools
+    hedge = server_name in timeout_config.get("hedge_servers", [])
+
+    def wrap(tool: BaseTool) -> BaseTool:
+        timeout = timeout_config.get("tool_timeouts", {}).get(tool.name, timeout_config.get("tool_timeout", 0))
+        if timeout <= 0:
+            return tool
+        return TimeoutTool(
+            tool, timeout,
+            hedge_delay=timeout_config.get("hedge_delay", 0.0) if hedge else 0.0,
+            max_hedges=timeout_config.get("max_hedges", 1),
+        )
+
+    return wrap_tools(tools, wrap)
+
+
+def get_timeout_stats() -> Dict[str, int]:
+    """获取超时与对冲统计"""
+    return dict(_stats)
+
+
+def print_timeout_stats():
+    """打印超时与对冲统计（没有发生时不输出）"""
+    if not any(_stats.values()):
+        return
+    print("\n⏱️ 超时与对冲统计:")
+    print(f"   智能体超时降级: {_stats['agent_timeouts']}  工具超时: {_stats['tool_timeouts']}  "
+          f"对冲请求: {_stats['hedges']} (先于原请求返回 {_stats['hedge_wins']} 次)")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+结构化事件日志模块
+把 GraphFlow 消息流中的每个事件写成一行紧凑的 JSON（来源、类型、时间戳、token 用量、工具名称和参数、内容长度），
+用于离线分析延迟和回放时间线，不需要在内存中保留完整对话。
+
+写入由后台任务批量完成：事件先进入内存缓冲，达到条数上限或间隔到期时在线程池中写入文件，
+消息流本身只做一次字典构造，不等待磁盘 I/O。可选 gzip 压缩。
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Optional
+
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
+
+from config import get_event_log_config
+
+
+class EventLogWriter:
+    """缓冲的异步 JSONL 写入器 - 单个后台任务负责所有写入，保证行顺序"""
+
+    def __init__(self, path: str, compress: bool = False, flush_interval: float = 1.0, buffer_size: int = 256):
+        """
+        初始化写入器（必须在事件循环中创建）
+
+        Args:
+            path: 日志文件路径
+            compress: 是否使用 gzip 压缩
+            flush_interval: 缓冲写入磁盘的最长间隔（秒）
+            buffer_size: 缓冲达到该条数时立即写入
+        """
+        self.path = path
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.records = 0
+        self._buffer: List[str] = []
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "wt", encoding="utf-8") if compress else open(path, "w", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+
+    def emit(self, record: Dict[str, Any]):
+        """追加一条记录（不等待写入）"""
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self.records += 1
+        if len(self._buffer) >= self.buffer_size:
+            self._wakeup.set()
+
+    def _write(self, lines: List[str]):
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._buffer:
+                lines, self._buffer = self._buffer, []
+                try:
+                    await loop.run_in_executor(None, self._write, lines)
+                except OSError as e:
+                    print(f"⚠️ 写入事件日志失败: {e}")
+            if self._closing and not self._buffer:
+                return
+
+    async def close(self):
+        """写入剩余缓冲并关闭文件"""
+        self._closing = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._file.close()
+
+
+def _usage(message: Any) -> Dict[str, int]:
+    usage = getattr(message, "models_usage", None)
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+def _content_length(content: Any) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(_content_length(getattr(item, "content", getattr(item, "arguments", ""))) for item in content)
+    return len(str(content))
+
+
+def event_record(message: Any, started_at: float, preview_chars: int = 0) -> Dict[str, Any]:
+    """
+    把消息流中的一个事件转换为日志记录
+
+    Args:
+        message: 消息、事件或 TaskResult
+        started_at: 运行开始时的 time.perf_counter()
+        preview_chars: 记录内容的前若干个字符，0 表示只记录长度
+
+    Returns:
+        Dict[str, Any]: 日志记录
+    """
+    record: Dict[str, Any] = {
+        "ts": round(time.time(), 6),
+        "t": round(time.perf_counter() - started_at, 6),
+        "type": type(message).__name__,
+    }
+    if isinstance(message, TaskResult):
+        record["stop_reason"] = message.stop_reason
+        record["messages"] = len(message.messages)
+        return record
+
+    record["source"] = getattr(message, "source", "")
+    record.update(_usage(message))
+    content = getattr(message, "content", None)
+    if isinstance(content, list):
+        calls = [item for item in content if hasattr(item, "arguments")]
+        results = [item for item in content if hasattr(item, "is_error")]
+        if calls:
+            record["tools"] = [{"id": call.id, "name": call.name, "arguments": call.arguments} for call in calls]
+        if results:
+            record["results"] = [{"id": result.call_id, "name": getattr(result, "name", ""),
+                                  "is_error": result.is_error, "length": len(result.content)} for result in results]
+    record["length"] = _content_length(content) if content is not None else 0
+    if preview_chars > 0 and isinstance(content, str):
+        record["preview"] = content[:preview_chars]
+    return record
+
+
+async def track_events(stream: AsyncGenerator, writer: EventLogWriter,
+                       run_info: Optional[Dict[str, Any]] = None) -> AsyncGenerator:
+    """
+    透传消息流，把每个事件写入事件日志
+
+    Args:
+        stream: 工作流的消息流
+        writer: 事件日志写入器
+        run_info: 写在第一行的运行信息（股票代码、模式等）
+
+    Yields:
+        原始消息
+    """
+    event_config = get_event_log_config()
+    skip_types = set(event_config.get("skip_types", []))
+    preview_chars = event_config.get("preview_chars", 0)
+    started_at = time.perf_counter()
+    writer.emit({"ts": round(time.time(), 6), "t": 0.0, "type": "RunStarted", **(run_info or {})})
+    async for message in stream:
+        if type(message).__name__ not in skip_types and isinstance(message, (BaseAgentEvent, BaseChatMessage,
+                                                                             TaskResult)):
+            writer.emit(event_record(message, started_at, preview_chars))
+        yield message
+
+
+def get_event_log_path(output_dir: str, stock_code: str, timestamp: str) -> str:
+    """事件日志与报告放在同一目录，按股票代码和报告时间戳命名"""
+    suffix = ".jsonl.gz" if get_event_log_config().get("compress", False) else ".jsonl"
+    return os.path.join(output_dir, f"事件日志_{stock_code}_{timestamp}{suffix}")
+
+
+def open_event_log(output_dir: str, stock_code: str, timestamp: str) -> Optional[EventLogWriter]:
+    """按配置创建事件日志写入器，未启用时返回 None"""
+    event_config = get_event_log_config()
+    if not event_config.get("enabled", False):
+        return None
+    return EventLogWriter(
+        get_event_log_path(output_dir, stock_code, timestamp),
+        compress=event_config.get("compress", False),
+        flush_interval=event_config.get("flush_interval", 1.0),
+        buffer_size=event_config.get("buffer_size", 256),
+    )
+
+
+def read_events(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐行读取事件日志（自动识别 gzip 压缩）
+
+    Args:
+        path: 日志文件路径
+
+    Yields:
+        Dict[str, Any]: 日志记录
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模型调用缓存与回放模块
+记录模型请求与响应到本地 SQLite，键为消息与工具定义的哈希，支持三种模式：
+- record: 始终调用在线接口，并记录响应
+- replay: 只从本地记录回放，未命中直接报错（离线、确定性；工具结果同样只从工具结果缓存读取）
+- cache: 读穿缓存，命中时回放，未命中时调用在线接口并记录
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence, Tuple, Union
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import get_llm_cache_config
+from model_middleware import ModelClientWrapper
+
+
+class ReplayMissError(RuntimeError):
+    """回放模式下未找到对应的模型调用记录"""
+
+
+class CompletionStore:
+    """模型调用记录存储 - SQLite 持久化"""
+
+    def __init__(self, path: str):
+        """
+        初始化存储
+
+        Args:
+            path: SQLite 数据库文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                request TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[CreateResult]:
+        """读取记录，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return CreateResult.model_validate_json(row[0])
+
+    def put(self, key: str, model: str, request: str, result: CreateResult):
+        """写入（或覆盖）记录"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, model, request, result.model_dump_json(), time.time()),
+            )
+            self._conn.commit()
+
+    def size(self) -> int:
+        """记录条数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+def _tool_schema(tool: Union[Tool, ToolSchema]) -> Dict[str, Any]:
+    if isinstance(tool, dict):
+        return dict(tool)
+    return dict(tool.schema)
+
+
+class CachingChatCompletionClient(ModelClientWrapper):
+    """带记录/回放/缓存功能的模型客户端"""
+
+    def __init__(self, client: ChatCompletionClient, store: CompletionStore, mode: str = "cache",
+                 model_name: str = "", normalize_patterns: Optional[List[str]] = None,
+                 stats: Optional[Dict[str, int]] = None):
+        """
+        初始化客户端
+
+        Args:
+            client: 被包装的在线客户端（replay 模式下不会被调用）
+            store: 调用记录存储
+            mode: 缓存模式 record / replay / cache
+            model_name: 模型名称，参与键计算，避免不同模型共用记录
+            normalize_patterns: 计算键之前从消息文本中移除的正则表达式（例如提示词中的当前日期）
+            stats: 命中统计字典，多个客户端可共享同一个字典
+        """
+        super().__init__(client)
+        if mode not in ("record", "replay", "cache"):
+            raise ValueError(f"未知的缓存模式: {mode}")
+        self.mode = mode
+        self.model_name = model_name
+        self._store = store
+        self._patterns = [re.compile(p) for p in (normalize_patterns or [])]
+        self.stats = stats if stats is not None else {"hits": 0, "misses": 0, "records": 0}
+
+    def _normalize_text(self, text: str) -> str:
+        for pattern in self._patterns:
+            text = pattern.sub("", text)
+        return text
+
+    def _normalize(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return self._normalize_text(value)
+        if isinstance(value, dict):
+            return {k: self._normalize(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._normalize(v) for v in value]
+        return value
+
+    def make_key(self, messages: Sequence[LLMMessage], tools: Sequence[Union[Tool, ToolSchema]],
+                 tool_choice: Any, json_output: Any, extra_create_args: Mapping[str, Any]) -> Tuple[str, str]:
+        """
+        计算请求的哈希键
+
+        Returns:
+            Tuple[str, str]: 哈希键和用于记录的规范化请求 JSON
+        """
+        if isinstance(json_output, type):
+            json_output = json_output.__name__
+        if not isinstance(tool_choice, str):
+            tool_choice = tool_choice.name
+        request = {
+            "model": self.model_name,
+            "messages": [self._normalize(m.model_dump(mode="json")) for m in messages],
+            "tools": [_tool_schema(t) for t in tools],
+            "tool_choice": tool_choice,
+            "json_output": json_output,
+            "extra_create_args": dict(extra_create_args),
+        }
+        request_json = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(request_json.encode("utf-8")).hexdigest(), request_json
+
+    def _lookup(self, key: str) -> Optional[CreateResult]:
+        if self.mode == "record":
+            return None
+        result = self._store.get(key)
+        if result is None:
+            self.stats["misses"] += 1
+            if self.mode == "replay":
+                raise ReplayMissError(f"回放模式下未找到模型调用记录: {key[:12]}")
+            return None
+        self.stats["hits"] += 1
+        return result.model_copy(update={"cached": True})
+
+    def _record(self, key: str, request_json: str, result: CreateResult):
+        self._store.put(key, self.model_name, request_json, result)
+        self.stats["records"] += 1
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        key, request_json = self.make_key(messages, tools, tool_choice, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        result = await super().create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        self._record(key, request_json, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key, request_json = self.make_key(messages, tools, tool_choice, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            # 回放时把完整文本作为一个分块输出
+            if isinstance(cached.content, str) and cached.content:
+                yield cached.content
+            yield cached
+            return
+        async for chunk in super().create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                self._record(key, request_json, chunk)
+            yield chunk
+
+
+# 进程级记录存储
+_store: Optional[CompletionStore] = None
+# 所有缓存客户端共享的命中统计
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "records": 0}
+
+
+def get_completion_store() -> CompletionStore:
+    """获取进程级模型调用记录存储"""
+    global _store
+    if _store is None:
+        path = get_llm_cache_config()["path"]
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        _store = CompletionStore(path)
+    return _store
+
+
+def wrap_model_client(client: ChatCompletionClient, model_name: str = "") -> ChatCompletionClient:
+    """
+    根据配置为模型客户端加上记录/回放/缓存功能
+
+    Args:
+        client: 在线模型客户端
+        model_name: 模型名称
+
+    Returns:
+        ChatCompletionClient: 包装后的客户端，模式为 off 时原样返回
+    """
+    cache_config = get_llm_cache_config()
+    mode = cache_config.get("mode", "off")
+    if mode == "off":
+        return client
+    return CachingChatCompletionClient(
+        client,
+        get_completion_store(),
+        mode=mode,
+        model_name=model_name,
+        normalize_patterns=cache_config.get("normalize_patterns", []),
+        stats=_stats,
+    )
+
+
+def print_llm_cache_stats():
+    """打印所有缓存客户端的汇总统计（未启用时不输出）"""
+    if _store is None:
+        return
+    mode = get_llm_cache_config().get("mode", "off")
+    print(f"\n💾 模型调用缓存 ({mode}): 命中 {_stats['hits']} / "
+          f"未命中 {_stats['misses']} / 记录 {_stats['records']} / 存储 {_store.size()} 条")
@@ -4,8 +4,14 @@
 """
 主程序入口
 基于 AutoGen 0.4+ 最新API - 修复重复问题，简化流程
+AutoGen 相关模块在真正使用时才导入，--help 和参数错误无需等待导入
 """
 
+import time
+
+# 进程启动时间，用于 --test 报告启动耗时
+_START_TIME = time.perf_counter()
+
 import asyncio
 import argparse
 import sys
@@ -16,79 +22,224 @@ from datetime import datetime
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-from config import get_model_config, print_config
-from agent_factory import create_simple_analysis_team, create_full_analysis_team
-from workflow import create_analysis_workflow
-from task import get_stock_analysis_task
-from report_saver import ReportSaver
+from config import (get_model_config, get_workflow_config, get_batch_config, get_llm_cache_config,
+                    get_checkpoint_config, get_report_config, print_config)
+from constants import WORKFLOW_MODES, LLM_CACHE_MODES
+
 
+async def shutdown_resources(print_stats: bool = True):
+    """输出缓存与限流统计并关闭共享的模型客户端和MCP会话"""
+    from mcp_pool import shutdown_mcp_pool
+    from client_registry import close_model_clients
+    from rate_limiter import print_rate_limit_state
+    from tool_cache import print_tool_cache_stats
+    from llm_cache import print_llm_cache_stats
+    from single_flight import print_single_flight_stats
+    from deadlines import print_timeout_stats
+    from research_memory import print_research_memory_stats, close_research_memory
 
-async def run_stock_analysis(stock_code: str):
+    if print_stats:
+        print_tool_cache_stats()
+        print_llm_cache_stats()
+        print_single_flight_stats()
+        print_timeout_stats()
+        print_research_memory_stats()
+        print_rate_limit_state()
+    await close_model_clients()
+    await shutdown_mcp_pool()
+    close_research_memory()
+
+
+async def run_stock_analysis(stock_code: str, mode: str = "sequential", resume: bool = False,
+                             rerun_agents: list = None, base_report: str = None):
     """运行股票分析
 
     Args:
         stock_code: 股票代码
+        mode: 工作流模式 (sequential / parallel)
+        resume: 是否从上次中断的检查点继续
+        rerun_agents: 只重新运行这些智能体，其余章节从已有报告或检查点加载
+        base_report: rerun_agents 使用的基础报告路径
     """
+    from runner import analyze_stock
+    from profiler import print_profile_summary
+    from budget import print_budget_summary
+    from tool_output import print_tool_output_summary
+
     try:
-        print("📋 AutoGen 0.4+ 股票分析系统 (顺序工作流)")
+        mode_label = "并行工作流" if mode == "parallel" else "顺序工作流"
+        print(f"📋 AutoGen 0.4+ 股票分析系统 ({mode_label})")
         print_config()
 
-        # 创建完整的8智能体团队
-        model_config = get_model_config()
-        agents = await create_full_analysis_team(model_config)
-        print("\n🔄 使用完整顺序工作流 (8个智能体)")
-
-        # 创建顺序工作流
-        from workflow import create_analysis_workflow
-        team = await create_analysis_workflow(agents)
-
-        # 执行分析
-        task_description = get_stock_analysis_task(stock_code)
-        
         print(f"\n🚀 开始分析: {stock_code}")
+        if rerun_agents:
+            print(f"   🔄 只重新运行 {len(rerun_agents)} 个智能体: {', '.join(rerun_agents)}")
+        else:
+            print(f"   🔄 使用完整{mode_label} (8个智能体)")
         print("   📝 使用 GraphFlow 流式处理")
         print("   🤖 智能体团队协作分析中...")
-        
-        # 使用新的ReportSaver处理流
-        report_saver = ReportSaver()
-
-        # 设置用户请求信息
-        report_saver.set_user_request(task_description)
 
-        # 处理流并收集结果
-        agent_results = await report_saver.process_stream(team.run_stream(task=task_description), stock_code)
+        # 创建团队和工作流并处理流式结果
+        result = await analyze_stock(stock_code, mode=mode, resume=resume,
+                                     rerun_agents=rerun_agents, base_report=base_report)
+        agent_results = result["agent_results"]
 
-        if agent_results:
+        if result["error"] is not None:
+            print(f"\n⚠️ 分析中断: {result['error']}")
+            if get_checkpoint_config().get("enabled", False):
+                print(f"   💾 已完成的智能体已保存到检查点，继续分析: python main.py {stock_code} --resume")
+        elif agent_results:
             print(f"\n✅ 分析完成！智能体数量: {len(agent_results)}")
-            print(f"   📁 报告已保存到 reports/ 目录")
+            if result["reused_from"] and rerun_agents:
+                print(f"   ♻️ 其余 {result['resumed_agents']} 个章节来自: {result['reused_from']}")
+            elif result["reused_from"]:
+                print(f"   ♻️ 复用近期报告的 {result['resumed_agents']} 个章节 (--max-age 0 强制重新分析)")
+            elif result["resumed_agents"]:
+                print(f"   ⏭️ 从检查点恢复 {result['resumed_agents']} 个智能体")
+            print(f"   📁 报告已保存到: {result['report_path'] or 'reports/ 目录'}")
+            if result["first_output_seconds"] is not None:
+                print(f"   ⚡ 首个输出: {result['first_output_seconds']:.1f}秒")
+            if result["degraded_agents"]:
+                print(f"   ⏱️ 超时降级的章节: {', '.join(result['degraded_agents'])} "
+                      f"(--agents {','.join(result['degraded_agents'])} 单独补跑)")
         else:
             print("\n⚠️ 未收到任何分析结果")
+
+        print_budget_summary(result["budget"])
+        print_tool_output_summary(result["tool_output"])
+        print_profile_summary(result["profile"])
+        for path in result["profile"].get("files", []):
+            print(f"   📁 性能分析已保存到: {path}")
+        if result["event_log"]:
+            print(f"   📁 事件日志已保存到: {result['event_log']}")
         
     except Exception as e:
         print(f"\n❌ 错误: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        await shutdown_resources()
+
+
+async def run_batch_analysis(stock_codes: list, mode: str = "sequential", concurrency: int = None,
+                             resume: bool = False, rerun_agents: list = None, processes: int = 1):
+    """批量运行股票分析 - 单只股票失败不会中断整个批次
+
+    Args:
+        stock_codes: 股票代码列表
+        mode: 工作流模式 (sequential / parallel)
+        concurrency: 最大并发数（多进程时为每个工作进程内的并发数）
+        resume: 是否从各股票上次中断的检查点继续
+        rerun_agents: 只重新运行这些智能体，其余章节从各股票最近的报告或检查点加载
+        processes: 工作进程数，大于 1 时按分片分配给多个进程
+    """
+    from batch_runner import run_batch
+    from sharded_batch import run_sharded_batch
+
+    try:
+        print("📋 AutoGen 0.4+ 股票分析系统 (批量模式)")
+        print_config()
+        if processes > 1:
+            summary = await run_sharded_batch(stock_codes, processes=processes, concurrency=concurrency,
+                                              mode=mode, resume=resume, rerun_agents=rerun_agents)
+        else:
+            summary = await run_batch(stock_codes, concurrency=concurrency, mode=mode, resume=resume,
+                                      rerun_agents=rerun_agents)
+        if summary["succeeded"] == 0:
+            sys.exit(1)
+    finally:
+        await shutdown_resources()
+
+
+async def run_peer_analysis(stock_codes: list, sector: str = None, mode: str = "sequential",
+                            concurrency: int = None):
+    """同业比较分析 - 行业与市场研究整组运行一次，策略顾问输出横向比较排名
+
+    Args:
+        stock_codes: 同组股票代码（至少两只）
+        sector: 行业名称，None 表示由分析师判断
+        mode: 单只股票的工作流模式 (sequential / parallel)
+        concurrency: 最大并发数
+    """
+    from peer_group import analyze_peer_group
+
+    try:
+        print("📋 AutoGen 0.4+ 股票分析系统 (同业比较模式)")
+        print_config()
+        result = await analyze_peer_group(stock_codes, sector=sector, mode=mode,
+                                          concurrency=concurrency or get_batch_config()["concurrency"])
+        if result["shared_agents"]:
+            print(f"\n♻️ 共享章节: {', '.join(result['shared_agents'])}，"
+                  f"少运行 {result['saved_agent_runs']} 次智能体")
+        if result["error"] is not None:
+            print(f"⚠️ 同业比较未完成: {result['error']}")
+            sys.exit(1)
+        print(f"✅ 同业比较完成，耗时 {result['elapsed']:.1f}秒")
+        print(f"   📁 比较报告已保存到: {result['report_path']}")
+    finally:
+        await shutdown_resources()
 
 
-async def test_setup():
-    """测试设置"""
+async def run_research_service(mode: str, host: str = None, port: int = None,
+                               socket_path: str = None, workers: int = None):
+    """以常驻服务方式运行，直到收到 SIGINT / SIGTERM
+
+    Args:
+        mode: 提交时未指定 mode 的作业使用的工作流模式
+        host: 监听地址，None 表示使用配置值
+        port: 监听端口，None 表示使用配置值
+        socket_path: Unix socket 路径，None 表示使用配置值
+        workers: 工作协程数，None 表示使用配置值
+    """
+    from service import run_service
+
+    try:
+        print("📋 AutoGen 0.4+ 股票分析系统 (常驻服务模式)")
+        print_config()
+        await run_service(host=host, port=port, socket_path=socket_path, workers=workers, mode=mode)
+    finally:
+        await shutdown_resources()
+
+
+async def test_setup(mode: str = "sequential"):
+    """测试设置，并报告各阶段的启动耗时"""
     print("🧪 测试 AutoGen 0.4+ 设置...")
+    timings = {"进程启动": time.perf_counter() - _START_TIME}
     
     try:
+        stage_start = time.perf_counter()
+        from agent_factory import create_full_analysis_team
+        from workflow import create_analysis_workflow
+        from mcp_pool import get_mcp_pool
+        timings["导入 AutoGen"] = time.perf_counter() - stage_start
+
         # 测试模型配置
         model_config = get_model_config()
         print(f"✅ 模型配置: {model_config['name']}")
         
         # 测试完整团队创建
+        stage_start = time.perf_counter()
         full_agents = await create_full_analysis_team(model_config)
+        timings["团队创建"] = time.perf_counter() - stage_start
         print(f"✅ 完整团队创建: {len(full_agents)} 个智能体")
 
         # 测试工作流创建
-        from workflow import create_analysis_workflow
+        stage_start = time.perf_counter()
+        await create_analysis_workflow(full_agents, mode=mode)
+        timings["工作流创建"] = time.perf_counter() - stage_start
+        if mode == "parallel":
+            print(f"✅ 并行工作流创建: 协调者 → 6个分析师并行 → 策略顾问")
+        else:
+            print(f"✅ 顺序工作流创建: 8个智能体顺序执行")
 
-        sequential_flow = await create_analysis_workflow(full_agents)
-        print(f"✅ 顺序工作流创建: 8个智能体顺序执行")
+        print("\n⏱️ 启动耗时:")
+        for stage, seconds in timings.items():
+            print(f"   ├─ {stage}: {seconds:.2f}秒")
+        print(f"   └─ 总计: {time.perf_counter() - _START_TIME:.2f}秒 (到第一个模型调用之前)")
+        for server_name, status in get_mcp_pool().get_status().items():
+            state = "已连接" if status["connected"] else "未连接 (首次调用工具时连接)"
+            print(f"   🔌 MCP服务器 {server_name}: {state}, {status['tools']} 个工具")
         
         print("🎉 测试完成！")
         
@@ -96,6 +247,8 @@ async def test_setup():
         print(f"❌ 测试失败: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        await shutdown_resources(print_stats=False)
 
 
 def main():
@@ -105,23 +258,103 @@ def main():
         epilog="""
 示例:
   python main.py 600519                  # 分析贵州茅台
+  python main.py 600519 --mode parallel  # 6个领域分析师并行执行
+  python main.py 600519 000001 000002    # 批量分析多只股票
+  python main.py --batch watchlist.txt   # 从文件读取股票列表批量分析
+  cat watchlist.txt | python main.py --batch - --concurrency 8
+  python main.py --batch all.txt --processes 8  # 数千只股票：分片分配给8个工作进程
+  python main.py 600519 --llm-cache replay  # 离线回放已记录的模型调用
+  python main.py 600519 --resume         # 从上次中断的智能体继续分析
+  python main.py 600519 --max-age 0      # 不复用近期报告，强制重新分析
+  python main.py 600519 --agents news_analyst,technical_analyst,strategy_advisor  # 只刷新部分章节
+  python main.py 600519 000858 000568 --peers --sector 白酒  # 同业比较，行业研究整组只做一次
+  python main.py --serve                 # 常驻服务，通过本地HTTP接口提交作业
   python main.py --test                  # 测试系统设置
-        """
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
     )
 
-    parser.add_argument("stock_code", nargs="?", help="股票代码")
+    parser.add_argument("stock_code", nargs="*", help="股票代码，多个代码时使用批量模式")
     parser.add_argument("--test", action="store_true", help="测试设置")
+    parser.add_argument("--batch", metavar="FILE", help="从文件读取股票代码批量分析，- 表示标准输入")
+    parser.add_argument("--concurrency", type=int, default=get_batch_config()["concurrency"],
+                        help="批量模式下同时运行的最大分析数")
+    parser.add_argument("--processes", type=int, default=get_batch_config().get("processes", 1),
+                        help="批量模式下的工作进程数，大于1时股票按分片分配给多个进程")
+    parser.add_argument("--llm-cache", choices=LLM_CACHE_MODES,
+                        help="模型调用缓存: off 关闭 / record 记录 / replay 离线回放 / cache 读穿缓存")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断的检查点继续，跳过已完成的智能体")
+    parser.add_argument("--agents", metavar="NAMES",
+                        help="只重新运行这些智能体（逗号分隔），其余章节从最近的报告或检查点加载")
+    parser.add_argument("--from-report", metavar="FILE",
+                        help="--agents 使用的基础报告，默认为该股票最近的报告或检查点")
+    parser.add_argument("--max-age", type=float, metavar="HOURS",
+                        help="复用该时间内生成的报告（时效性强的章节按配置单独重新运行），0 表示总是重新分析")
+    parser.add_argument("--peers", action="store_true",
+                        help="同业比较：行业与市场研究整组运行一次，最后输出横向比较排名")
+    parser.add_argument("--sector", metavar="NAME", help="--peers 的行业名称，默认由分析师判断")
+    parser.add_argument("--serve", action="store_true",
+                        help="以常驻服务方式运行，通过本地HTTP接口提交作业")
+    parser.add_argument("--host", help="服务监听地址 (默认读取配置)")
+    parser.add_argument("--port", type=int, help="服务监听端口 (默认读取配置)")
+    parser.add_argument("--socket", metavar="PATH", help="服务改为监听 Unix socket")
+    parser.add_argument("--workers", type=int, help="服务同时运行的最大作业数 (默认读取配置)")
+    parser.add_argument("--mode", choices=WORKFLOW_MODES, default=get_workflow_config()["mode"],
+                        help="工作流模式: sequential 顺序执行 / parallel 分析师并行执行")
 
     args = parser.parse_args()
 
+    if args.llm_cache:
+        get_llm_cache_config()["mode"] = args.llm_cache
+    if args.max_age is not None:
+        get_report_config()["reuse_max_age_hours"] = args.max_age
+    rerun_agents = None
+    if args.agents:
+        from workflow import REQUIRED_AGENTS
+        rerun_agents = [name.strip() for name in args.agents.split(",") if name.strip()]
+        unknown = [name for name in rerun_agents if name not in REQUIRED_AGENTS]
+        if unknown:
+            parser.error(f"未知的智能体: {', '.join(unknown)}，可选: {', '.join(REQUIRED_AGENTS)}")
+        if args.resume:
+            parser.error("--agents 不能与 --resume 同时使用")
+    if args.from_report and not args.agents:
+        parser.error("--from-report 需要与 --agents 一起使用")
+
+    if args.sector and not args.peers:
+        parser.error("--sector 需要与 --peers 一起使用")
+
     if args.test:
-        asyncio.run(test_setup())
+        asyncio.run(test_setup(args.mode))
+    elif args.serve:
+        asyncio.run(run_research_service(args.mode, args.host, args.port, args.socket, args.workers))
+    elif args.batch or len(args.stock_code) > 1:
+        stock_codes = [code.upper() for code in args.stock_code]
+        if args.batch:
+            from batch_runner import load_stock_codes
+            stock_codes += [code for code in load_stock_codes(args.batch) if code not in stock_codes]
+        if not stock_codes:
+            parser.error("批量模式未读取到任何股票代码")
+        if args.from_report:
+            parser.error("--from-report 只能用于单只股票")
+        if args.peers:
+            if args.resume or rerun_agents:
+                parser.error("--peers 不能与 --resume 或 --agents 同时使用")
+            asyncio.run(run_peer_analysis(stock_codes, args.sector, args.mode, args.concurrency))
+            return
+        if args.processes < 1:
+            parser.error("--processes 必须大于0")
+        asyncio.run(run_batch_analysis(stock_codes, args.mode, args.concurrency, args.resume, rerun_agents,
+                                       args.processes))
     elif args.stock_code:
-        asyncio.run(run_stock_analysis(args.stock_code.upper()))
+        if args.peers:
+            parser.error("--peers 至少需要两只股票")
+        asyncio.run(run_stock_analysis(args.stock_code[0].upper(), args.mode, args.resume,
+                                       rerun_agents, args.from_report))
     else:
         parser.print_help()
         print("\n💡 系统特性:")
-        print("   • 8个专业智能体顺序执行")
+        print("   • 8个专业智能体顺序执行 (或 --mode parallel 并行执行)")
         print("   • 协调者制定分析策略")
         print("   • 完整的股票分析流程")
         print("   • 使用 DiGraphBuilder 正确API")
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+MCP会话池模块
+进程级共享的MCP服务器会话池 - 每个stdio服务器只启动一次，
+所有智能体和所有运行共享同一会话与工具列表，并负责健康检查、重启与关闭。
+工具定义缓存到本地后，创建智能体时不再启动服务器，第一次调用工具时才建立连接
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Any
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_ext.tools.mcp import StdioMcpToolAdapter, StdioServerParams, create_mcp_server_session
+from mcp.types import Tool as McpToolDefinition
+from pydantic import BaseModel
+
+from config import get_mcp_servers, get_mcp_pool_config
+
+
+def create_server_params(server_config: Dict[str, Any], read_timeout_seconds: float = 60) -> StdioServerParams:
+    """
+    根据服务器配置创建 StdioServerParams
+
+    Args:
+        server_config: 服务器配置字典
+        read_timeout_seconds: 读取超时时间（秒）
+
+    Returns:
+        StdioServerParams: 服务器参数
+    """
+    return StdioServerParams(
+        command=server_config["command"],
+        args=server_config["args"],
+        env=server_config.get("env", {}),
+        read_timeout_seconds=read_timeout_seconds,
+    )
+
+
+class PooledMcpTool(StdioMcpToolAdapter):
+    """从会话池获取会话的MCP工具 - 服务器重启后自动使用新会话"""
+
+    def __init__(self, pool: "MCPSessionPool", server_name: str,
+                 server_params: StdioServerParams, tool: Any):
+        super().__init__(server_params=server_params, tool=tool)
+        self._pool = pool
+        self._server_name = server_name
+
+    @property
+    def server_name(self) -> str:
+        """工具所属的MCP服务器名称"""
+        return self._server_name
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> Any:
+        kwargs = args.model_dump(exclude_unset=True)
+        session = await self._pool.get_session(self._server_name)
+        try:
+            return await self._run(args=kwargs, cancellation_token=cancellation_token, session=session)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 工具本身报错时会话仍然健康，直接抛出；会话失效时重启后重试一次
+            if await self._pool.health_check(self._server_name):
+                raise
+            print(f"   🔄 MCP服务器 {self._server_name} 会话失效，重启后重试 {self.name}")
+            await self._pool.restart(self._server_name)
+            session = await self._pool.get_session(self._server_name)
+            return await self._run(args=kwargs, cancellation_token=cancellation_token, session=session)
+
+
+class _PooledServer:
+    """会话池中的单个MCP服务器"""
+
+    def __init__(self, name: str, params: StdioServerParams):
+        self.name = name
+        self.params = params
+        self.session = None
+        self.task: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        self.error: Optional[BaseException] = None
+        self.tools: List[PooledMcpTool] = []
+        self.lock = asyncio.Lock()
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.task is not None and not self.task.done() and self.session is not None
+
+
+class MCPSessionPool:
+    """
+    进程级MCP会话池
+
+    stdio 会话的上下文必须在同一个任务中进入和退出，
+    因此每个服务器由一个后台任务持有会话，直到池被关闭或服务器被重启。
+    """
+
+    def __init__(self, server_configs: Optional[List[Dict[str, Any]]] = None,
+                 read_timeout_seconds: float = 60, health_check_interval: float = 30.0,
+                 startup_timeout: float = 120.0, lazy_connect: bool = False,
+                 tool_schema_cache: Optional[str] = None):
+        """
+        初始化会话池
+
+        Args:
+            server_configs: MCP服务器配置列表，默认读取 config.py
+            read_timeout_seconds: 会话读取超时时间（秒）
+            health_check_interval: 后台健康检查间隔（秒），0 表示不启用
+            startup_timeout: 单个服务器启动超时时间（秒）
+            lazy_connect: 有工具定义缓存时 get_tools 不启动服务器，第一次调用工具时再连接
+            tool_schema_cache: 工具定义缓存文件路径，None 表示不缓存
+        """
+        if server_configs is None:
+            server_configs = get_mcp_servers()
+        self.server_configs = {config["name"]: config for config in server_configs}
+        self.read_timeout_seconds = read_timeout_seconds
+        self.health_check_interval = health_check_interval
+        self.startup_timeout = startup_timeout
+        self.lazy_connect = lazy_connect
+        self.tool_schema_cache = tool_schema_cache
+        self._servers: Dict[str, _PooledServer] = {}
+        self._lock = asyncio.Lock()
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """会话池所属的事件循环"""
+        return self._loop
+
+    def register(self, server_config: Dict[str, Any]):
+        """注册（或更新）服务器配置，已启动的服务器不受影响"""
+        self.server_configs.setdefault(server_config["name"], server_config)
+
+    async def _get_server(self, server_name: str) -> _PooledServer:
+        if self._closed:
+            raise RuntimeError("MCP会话池已关闭")
+        if server_name not in self.server_configs:
+            raise ValueError(f"未知的MCP服务器: {server_name}")
+        async with self._lock:
+            if server_name not in self._servers:
+                params = create_server_params(self.server_configs[server_name], self.read_timeout_seconds)
+                self._servers[server_name] = _PooledServer(server_name, params)
+            return self._servers[server_name]
+
+    async def _hold_session(self, server: _PooledServer):
+        """后台任务：持有服务器会话直到收到停止信号"""
+        try:
+            async with create_mcp_server_session(server.params) as session:
+                await session.initialize()
+                server.session = session
+                server.error = None
+                server.ready.set()
+                await server.stop_event.wait()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            server.error = e
+        finally:
+            server.session = None
+            server.ready.set()
+
+    async def _start(self, server: _PooledServer):
+        """启动服务器并加载工具列表（调用方需持有 server.lock）"""
+        print(f"🔄 正在启动MCP服务器: {server.name}")
+        server.ready = asyncio.Event()
+        server.stop_event = asyncio.Event()
+        server.task = asyncio.create_task(self._hold_session(server), name=f"mcp-{server.name}")
+
+        try:
+            await asyncio.wait_for(server.ready.wait(), timeout=self.startup_timeout)
+        except asyncio.TimeoutError:
+            await self._stop(server)
+            raise RuntimeError(f"MCP服务器 {server.name} 启动超时 ({self.startup_timeout}秒)")
+
+        if server.session is None:
+            error = server.error
+            await self._stop(server)
+            raise RuntimeError(f"MCP服务器 {server.name} 启动失败: {error}")
+
+        # 工具对象只在首次启动（或从缓存加载）时创建，重启后复用同一批工具对象；
+        # 每次启动都刷新缓存，服务器升级后的工具定义在下一次运行生效
+        result = await server.session.list_tools()
+        if not server.tools:
+            server.tools = [PooledMcpTool(self, server.name, server.params, tool) for tool in result.tools]
+        self._save_tool_definitions(server.name, result.tools)
+        print(f"✅ MCP服务器 {server.name} 已启动 - {len(server.tools)} 个工具")
+
+        if self.health_check_interval > 0 and (self._monitor_task is None or self._monitor_task.done()):
+            self._monitor_task = asyncio.create_task(self._monitor(), name="mcp-pool-monitor")
+
+    async def _stop(self, server: _PooledServer):
+        """停止服务器会话"""
+        task = server.task
+        if task is None:
+            return
+        server.stop_event.set()
+        try:
+            await asyncio.wait_for(task, timeout=10)
+        except asyncio.TimeoutError:
+            task.cancel()
+        except BaseException:
+            pass
+        server.task = None
+        server.session = None
+
+    async def get_session(self, server_name: str):
+        """获取服务器会话，未启动或已失效时自动（重新）启动"""
+        server = await self._get_server(server_name)
+        if server.alive:
+            return server.session
+        async with server.lock:
+            if not server.alive:
+                if server.task is not None:
+                    await self._stop(server)
+                    server.restarts += 1
+                await self._start(server)
+            return server.session
+
+    async def get_tools(self, server_name: str, server_config: Optional[Dict[str, Any]] = None) -> List[PooledMcpTool]:
+        """
+        获取服务器的工具列表 - 所有调用方共享同一批工具对象
+
+        Args:
+            server_name: MCP服务器名称
+            server_config: 服务器配置，未注册的服务器需要提供
+
+        Returns:
+            List[PooledMcpTool]: 工具列表
+        """
+        if server_config is not None:
+            self.register(server_config)
+        server = await self._get_server(server_name)
+        if not server.tools and self.lazy_connect:
+            async with server.lock:
+                if not server.tools:
+                    definitions = self._load_tool_definitions(server_name)
+                    if definitions:
+                        server.tools = [PooledMcpTool(self, server_name, server.params, tool) for tool in definitions]
+                        print(f"⚡ MCP服务器 {server_name} 使用缓存的工具定义 ({len(server.tools)} 个)，首次调用时连接")
+        if not server.tools:
+            await self.get_session(server_name)
+        return list(server.tools)
+
+    def _server_signature(self, server_name: str) -> str:
+        """服务器配置签名 - 命令、参数或环境变量名变化时缓存失效（不包含环境变量的值）"""
+        config = self.server_configs[server_name]
+        payload = json.dumps(
+            {"command": config["command"], "args": config["args"], "env": sorted(config.get("env", {}))},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _read_tool_cache(self) -> Dict[str, Any]:
+        if not self.tool_schema_cache or not os.path.exists(self.tool_schema_cache):
+            return {}
+        try:
+            with open(self.tool_schema_cache, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_tool_definitions(self, server_name: str) -> List[McpToolDefinition]:
+        """读取缓存的工具定义，签名不匹配或缓存损坏时返回空列表"""
+        entry = self._read_tool_cache().get(server_name)
+        if not entry or entry.get("signature") != self._server_signature(server_name):
+            return []
+        try:
+            return [McpToolDefinition.model_validate(tool) for tool in entry["tools"]]
+        except Exception:
+            return []
+
+    def _save_tool_definitions(self, server_name: str, definitions: List[McpToolDefinition]):
+        """写入工具定义缓存（先写临时文件再重命名）"""
+        if not self.tool_schema_cache:
+            return
+        cache = self._read_tool_cache()
+        cache[server_name] = {
+            "signature": self._server_signature(server_name),
+            "updated_at": time.time(),
+            "tools": [tool.model_dump(mode="json", exclude_none=True) for tool in definitions],
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.tool_schema_cache)), exist_ok=True)
+            tmp_path = self.tool_schema_cache + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.tool_schema_cache)
+        except OSError as e:
+            print(f"⚠️ 保存MCP工具定义缓存失败: {e}")
+
+    async def health_check(self, server_name: str, timeout: float = 10.0) -> bool:
+        """通过 ping 检查服务器是否健康"""
+        server = self._servers.get(server_name)
+        if server is None or not server.alive:
+            return False
+        try:
+            await asyncio.wait_for(server.session.send_ping(), timeout=timeout)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return False
+
+    async def restart(self, server_name: str):
+        """重启服务器会话"""
+        server = await self._get_server(server_name)
+        async with server.lock:
+            await self._stop(server)
+            server.restarts += 1
+            await self._start(server)
+
+    async def _monitor(self):
+        """后台健康检查：定期 ping 所有已启动的服务器，失效则重启"""
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            for server_name, server in list(self._servers.items()):
+                if self._closed or server.task is None or server.lock.locked():
+                    continue
+                if not await self.health_check(server_name):
+                    print(f"⚠️  MCP服务器 {server_name} 健康检查失败，正在重启")
+                    try:
+                        await self.restart(server_name)
+                    except Exception as e:
+                        print(f"❌ MCP服务器 {server_name} 重启失败: {e}")
+
+    def get_status(self) -> Dict[str, Dict[str, Any]]:
+        """获取会话池状态"""
+        return {
+            name: {
+                "alive": server.alive,
+                "connected": server.task is not None,
+                "tools": len(server.tools),
+                "restarts": server.restarts,
+            }
+            for name, server in self._servers.items()
+        }
+
+    async def close(self):
+        """关闭所有服务器会话"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except BaseException:
+                pass
+        for server in self._servers.values():
+            if server.task is not None:
+                await self._stop(server)
+                print(f"🔄 已关闭MCP服务器: {server.name}")
+
+
+# 进程级会话池
+_pool: Optional[MCPSessionPool] = None
+
+
+def get_mcp_pool() -> MCPSessionPool:
+    """
+    获取进程级MCP会话池（必须在事件循环中调用）
+
+    Returns:
+        MCPSessionPool: 当前事件循环对应的会话池
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool._closed or _pool.loop is not loop:
+        pool_config = get_mcp_pool_config()
+        tool_schema_cache = pool_config.get("tool_schema_cache")
+        if tool_schema_cache and not os.path.isabs(tool_schema_cache):
+            tool_schema_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), tool_schema_cache)
+        _pool = MCPSessionPool(
+            read_timeout_seconds=pool_config.get("read_timeout_seconds", 60),
+            health_check_interval=pool_config.get("health_check_interval", 30.0),
+            startup_timeout=pool_config.get("startup_timeout", 120.0),
+            lazy_connect=pool_config.get("lazy_connect", False),
+            tool_schema_cache=tool_schema_cache,
+        )
+    return _pool
+
+
+async def shutdown_mcp_pool():
+    """关闭进程级MCP会话池"""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        if pool.loop is asyncio.get_running_loop():
+            await pool.close()
@@ -12,10 +12,11 @@ from contextlib import asynccontextmanager
 from typing import Dict, List, Optional, Any
 
 # AutoGen 0.4+ 正确的导入路径
-from autogen_ext.tools.mcp import McpWorkbench, StdioServerParams, mcp_server_tools
+from autogen_ext.tools.mcp import McpWorkbench, StdioServerParams
 from autogen_agentchat.agents import AssistantAgent
 
-from config import get_mcp_servers
+from config import get_mcp_servers, get_mcp_pool_config
+from mcp_pool import create_server_params, get_mcp_pool
 
 
 class MCPWorkbenchManager:
@@ -47,12 +48,7 @@ class MCPWorkbenchManager:
         Returns:
             StdioServerParams: 服务器参数
         """
-        return StdioServerParams(
-            command=server_config["command"],
-            args=server_config["args"],
-            env=server_config.get("env", {}),
-            read_timeout_seconds=60,  # 增加超时时间
-        )
+        return create_server_params(server_config, get_mcp_pool_config().get("read_timeout_seconds", 60))
 
     @asynccontextmanager
     async def get_workbenches(self) -> Dict[str, McpWorkbench]:
@@ -109,7 +105,7 @@ class MCPWorkbenchManager:
 
     async def get_tools_for_server(self, server_name: str) -> List[Any]:
         """
-        获取指定MCP服务器的工具列表 - 使用正确的 mcp_server_tools API
+        获取指定MCP服务器的工具列表 - 从进程级会话池获取，避免重复启动服务器
 
         Args:
             server_name: MCP服务器名称
@@ -127,9 +123,8 @@ class MCPWorkbenchManager:
             print(f"🔄 正在获取MCP工具: {server_name}")
             server_config = self.server_configs[server_name]
             
-            # 使用正确的 AutoGen 0.4+ API
-            server_params = self.create_server_params(server_config)
-            tools = await mcp_server_tools(server_params)
+            # 共享会话池中的会话和工具
+            tools = await get_mcp_pool().get_tools(server_name, server_config)
             
             print(f"✅ 成功获取 {len(tools)} 个工具 from {server_name}")
             return tools
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模型客户端包装模块
+ChatCompletionClient 的通用包装基类 - 缓存、回放等功能通过包装客户端实现，对智能体透明
+"""
+
+from typing import Any, AsyncGenerator, Literal, Mapping, Optional, Sequence, Union
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+
+class ModelClientWrapper(ChatCompletionClient):
+    """
+    模型客户端包装基类
+
+    所有方法默认透传给被包装的客户端，子类重写 create / create_stream 在调用前后增加逻辑。
+    """
+
+    def __init__(self, client: ChatCompletionClient):
+        self._client = client
+
+    @property
+    def client(self) -> ChatCompletionClient:
+        """被包装的客户端"""
+        return self._client
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        return await self._client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self._client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *,
+                         tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self):  # type: ignore
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+
+def unwrap_client(client: ChatCompletionClient) -> ChatCompletionClient:
+    """返回最内层的原始客户端"""
+    while isinstance(client, ModelClientWrapper):
+        client = client.client
+    return client
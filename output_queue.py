@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流式输出模块
+智能体启用 model_client_stream 后，模型输出以分块事件到达。分块事件放入有界队列，由后台任务写入输出端：
+- 控制台：写入在线程池中执行，慢终端或管道不会阻塞事件循环
+- Socket（tcp://host:port 或 unix:///path）：按 StreamWriter.drain 施加背压
+队列满时消息流的消费者等待（背压只作用于当前运行的消息处理），其他协程照常运行；
+后台任务每次把队列中积压的分块合并为一次写入，减少系统调用。
+"""
+
+import asyncio
+import sys
+from typing import Optional, TextIO
+
+from config import get_output_config
+
+
+class ConsoleSink:
+    """控制台输出端"""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream or sys.stdout
+
+    def _write(self, text: str):
+        self.stream.write(text)
+        self.stream.flush()
+
+    async def write(self, text: str):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, text)
+
+    async def close(self):
+        pass
+
+
+class SocketSink:
+    """TCP / Unix socket 输出端 - 首次写入时连接，连接失败时改为输出到控制台"""
+
+    def __init__(self, address: str):
+        """
+        初始化输出端
+
+        Args:
+            address: tcp://host:port 或 unix:///path/to/socket
+        """
+        self.address = address
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._fallback: Optional[ConsoleSink] = None
+
+    async def _connect(self):
+        if self.address.startswith("unix://"):
+            _, self._writer = await asyncio.open_unix_connection(self.address[len("unix://"):])
+        else:
+            host, _, port = self.address[len("tcp://"):].rpartition(":")
+            _, self._writer = await asyncio.open_connection(host, int(port))
+
+    async def write(self, text: str):
+        if self._fallback is not None:
+            await self._fallback.write(text)
+            return
+        try:
+            if self._writer is None:
+                await self._connect()
+            self._writer.write(text.encode("utf-8"))
+            await self._writer.drain()
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 流式输出地址 {self.address} 不可用 ({e})，改为输出到控制台")
+            self._fallback = ConsoleSink()
+            await self._fallback.write(text)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+
+
+def create_sink(address: str):
+    """根据地址创建输出端：console、tcp://host:port 或 unix:///path"""
+    if address.startswith(("tcp://", "unix://")):
+        return SocketSink(address)
+    if address not in ("", "console"):
+        raise ValueError(f"不支持的流式输出地址: {address}")
+    return ConsoleSink()
+
+
+class OutputQueue:
+    """有界输出队列 - 单个后台任务按顺序写入输出端"""
+
+    def __init__(self, sink, maxsize: int = 256, batch_chars: int = 4096):
+        """
+        初始化队列（必须在事件循环中创建）
+
+        Args:
+            sink: 输出端
+            maxsize: 队列最多容纳的文本块数，满时 put 等待
+            batch_chars: 合并写入时每次最多的字符数
+        """
+        self.sink = sink
+        self.batch_chars = batch_chars
+        self.stalls = 0  # put 因队列满而等待的次数
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, text: str):
+        """放入一段文本，队列满时等待输出端消化"""
+        if self._queue.full():
+            self.stalls += 1
+        await self._queue.put(text)
+
+    async def _run(self):
+        while True:
+            text = await self._queue.get()
+            if text is None:
+                return
+            parts = [text]
+            size = len(text)
+            closing = False
+            while size < self.batch_chars and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+                parts.append(item)
+                size += len(item)
+            try:
+                await self.sink.write("".join(parts))
+            except Exception as e:
+                print(f"⚠️ 流式输出失败: {e}")
+            if closing:
+                return
+
+    async def close(self):
+        """写完队列中剩余的文本并关闭输出端"""
+        await self._queue.put(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.sink.close()
+
+
+def open_output_queue() -> OutputQueue:
+    """按配置创建输出队列"""
+    output_config = get_output_config()
+    return OutputQueue(
+        create_sink(output_config.get("sink", "console")),
+        maxsize=output_config.get("queue_size", 256),
+        batch_chars=output_config.get("batch_chars", 4096),
+    )
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+同业比较模块
+同一行业的多只股票一起分析时，行业分析师和市场分析师的研究对整组是共性的：
+1. 行业与市场研究整组只运行一次
+2. 每只股票只运行协调者、公司、财务、新闻、技术分析师和策略顾问，共享章节作为已完成的结论广播给它们
+3. 策略顾问基于各股票的投资建议输出横向比较排名，保存为同业比较报告
+
+十只股票的一组可以少运行约二十次智能体（每只股票少两个，整组多一次排名）。
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.messages import BaseChatMessage
+from autogen_core.models import ChatCompletionClient
+
+from config import get_model_config, get_report_config, MCP_SERVERS_CONFIG
+from agent_factory import create_agent
+from workflow import REQUIRED_AGENTS, create_analysis_workflow
+from task import get_peer_comparison_task, get_peer_group_task
+from report_saver import ReportSaver
+from report_index import parse_report_sections
+from checkpoint import build_resume_messages
+from deadlines import is_degraded
+from batch_runner import BatchRunner
+from output_queue import open_output_queue
+
+# 整组只运行一次的行业级智能体
+SECTOR_AGENTS = ["industry_analyst", "market_analyst"]
+
+
+async def _create_agents(agent_names: List[str],
+                         model_client: Optional[ChatCompletionClient]) -> List[BaseChatAgent]:
+    """并发创建指定的智能体"""
+    mcp_servers = {server["name"]: server for server in MCP_SERVERS_CONFIG}
+    return list(await asyncio.gather(
+        *[create_agent(name, get_model_config(), mcp_servers, model_client) for name in agent_names]
+    ))
+
+
+async def run_sector_research(stock_codes: List[str], sector: Optional[str] = None, mode: str = "parallel",
+                              model_client: Optional[ChatCompletionClient] = None) -> Dict[str, str]:
+    """
+    整组运行一次行业与市场研究
+
+    Args:
+        stock_codes: 同组股票代码
+        sector: 行业名称，None 表示由分析师判断
+        mode: 工作流模式，parallel 时两个分析师并行执行
+        model_client: 指定的模型客户端，None 表示使用注册表中的共享客户端
+
+    Returns:
+        Dict[str, str]: 智能体名称到共享章节的映射（超时降级的章节不共享，由各股票单独运行）
+    """
+    agents = await _create_agents(SECTOR_AGENTS, model_client)
+    flow = await create_analysis_workflow(
+        agents, mode=mode, completed=[name for name in REQUIRED_AGENTS if name not in SECTOR_AGENTS]
+    )
+    sections: Dict[str, str] = {}
+    async for message in flow.run_stream(task=get_peer_group_task(stock_codes, sector)):
+        if isinstance(message, BaseChatMessage) and message.source in SECTOR_AGENTS:
+            content = message.content if isinstance(message.content, str) else message.to_text()
+            sections[message.source] = content
+            print(f"   ✅ {message.source} 完成 ({len(content)} 字)")
+    degraded = [name for name, content in sections.items() if is_degraded(content)]
+    if degraded:
+        print(f"   ⚠️ {', '.join(degraded)} 超时降级，改为每只股票单独运行")
+    return {name: content for name, content in sections.items() if name not in degraded}
+
+
+def _read_conclusion(report_path: str) -> Optional[str]:
+    """读取单只股票报告中策略顾问的结论，缺失或降级时返回 None"""
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            conclusion = parse_report_sections(f.read()).get("strategy_advisor")
+    except OSError:
+        return None
+    if conclusion is None or is_degraded(conclusion):
+        return None
+    return conclusion
+
+
+async def run_peer_comparison(conclusions: Dict[str, str], sector_sections: Dict[str, str],
+                              sector: Optional[str] = None, verbose: bool = True,
+                              model_client: Optional[ChatCompletionClient] = None) -> ReportSaver:
+    """
+    策略顾问基于各股票的投资建议输出横向比较排名
+
+    Args:
+        conclusions: 股票代码到策略顾问结论的映射
+        sector_sections: 共享的行业与市场章节，一并写入比较报告
+        sector: 行业名称
+        verbose: 是否显示输出
+        model_client: 指定的模型客户端
+
+    Returns:
+        ReportSaver: 报告保存器（含报告路径和错误信息）
+    """
+    agents = await _create_agents(["strategy_advisor"], model_client)
+    flow = await create_analysis_workflow(
+        agents, mode="sequential", completed=[name for name in REQUIRED_AGENTS if name != "strategy_advisor"]
+    )
+    task_description = get_peer_comparison_task(conclusions, sector)
+
+    output = open_output_queue() if verbose else None
+    report_saver = ReportSaver(verbose=verbose, streaming=get_report_config().get("streaming", False),
+                               output=output)
+    report_saver.set_user_request(task_description)
+    try:
+        await report_saver.process_stream(
+            flow.run_stream(task=build_resume_messages(task_description, sector_sections)),
+            f"同业比较_{'-'.join(conclusions)}",
+        )
+    finally:
+        if output is not None:
+            await output.close()
+    return report_saver
+
+
+async def analyze_peer_group(stock_codes: List[str], sector: Optional[str] = None, mode: str = "sequential",
+                             concurrency: int = 4, verbose: bool = False,
+                             model_client: Optional[ChatCompletionClient] = None) -> Dict[str, Any]:
+    """
+    同业比较分析
+
+    Args:
+        stock_codes: 同组股票代码（至少两只）
+        sector: 行业名称，None 表示由分析师判断
+        mode: 单只股票的工作流模式
+        concurrency: 同时分析的最大股票数
+        verbose: 是否显示单只股票分析过程中的消息（并发时输出会交错）
+        model_client: 指定的模型客户端，None 表示使用注册表中的共享客户端
+
+    Returns:
+        Dict[str, Any]: 分析结果
+            - stock_codes: 股票代码
+            - shared_agents: 整组共享、未逐只运行的智能体
+            - saved_agent_runs: 相比逐只完整分析少运行的智能体次数
+            - batch: 单只股票分析的批量汇总
+            - report_path: 同业比较报告路径，未生成时为空字符串
+            - error: 横向比较失败时的错误信息
+            - elapsed: 耗时（秒）
+    """
+    if len(stock_codes) < 2:
+        raise ValueError("同业比较至少需要两只股票")
+    start_time = time.perf_counter()
+
+    print(f"🏭 同业比较: {len(stock_codes)} 只股票{f' ({sector})' if sector else ''}，行业与市场研究整组运行一次")
+    try:
+        sector_sections = await run_sector_research(stock_codes, sector, mode="parallel", model_client=model_client)
+    except Exception as e:
+        print(f"⚠️ 行业与市场研究失败，改为每只股票单独运行: {e}")
+        sector_sections = {}
+
+    runner = BatchRunner(concurrency=concurrency, mode=mode, verbose=verbose, model_client=model_client,
+                         peer_group={"stock_codes": list(stock_codes), "sections": sector_sections})
+    summary = await runner.run(stock_codes)
+
+    conclusions = {}
+    for record in runner.results:
+        conclusion = _read_conclusion(record["report_path"]) if record["report_path"] else None
+        if conclusion is None:
+            print(f"   ⚠️ {record['stock_code']} 没有可用的投资建议，不参与排名")
+            continue
+        conclusions[record["stock_code"]] = conclusion
+
+    report_path, error = "", None
+    if len(conclusions) >= 2:
+        print(f"\n💡 策略顾问横向比较 {len(conclusions)} 只股票...")
+        report_saver = await run_peer_comparison(conclusions, sector_sections, sector, verbose=True,
+                                                 model_client=model_client)
+        report_path = report_saver.report_path
+        error = str(report_saver.error) if report_saver.error is not None else None
+    else:
+        error = "可比较的股票少于两只，未生成排名"
+
+    shared_agents = list(sector_sections)
+    return {
+        "stock_codes": list(stock_codes),
+        "shared_agents": shared_agents,
+        # 每只股票少运行共享的智能体，整组多运行一次行业研究
+        "saved_agent_runs": len(shared_agents) * (len(stock_codes) - 1),
+        "batch": summary,
+        "report_path": report_path,
+        "error": error,
+        "elapsed": time.perf_counter() - start_time,
+    }
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+性能分析模块
+按智能体记录每次运行的耗时、首 token 时间、token 用量、重试次数以及各MCP服务器的工具调用次数和耗时，
+运行结束后在 Markdown 报告旁输出 JSON / CSV 性能分析文件并打印汇总表
+
+当前运行的分析器通过 contextvars 传递：GraphFlow 的运行时任务继承启动时的上下文，
+并发运行的多只股票各自记录，互不干扰
+"""
+
+import contextvars
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence, Union
+
+import httpx
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import BaseTool, Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import get_profile_config
+from model_middleware import ModelClientWrapper
+from tool_middleware import ToolWrapper, wrap_tools
+
+# 当前运行的分析器
+_current_profiler: contextvars.ContextVar[Optional["RunProfiler"]] = contextvars.ContextVar(
+    "current_profiler", default=None
+)
+# 当前正在进行的模型调用记录，供 HTTP 请求钩子统计重试次数
+_current_call: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar(
+    "current_model_call", default=None
+)
+
+
+def _new_agent_profile() -> Dict[str, Any]:
+    return {
+        "started_at": None,
+        "finished_at": None,
+        "first_token_seconds": None,
+        "model_calls": 0,
+        "model_seconds": 0.0,
+        "cached_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "retries": 0,
+        "errors": 0,
+        "context_tokens_before": None,
+        "context_tokens_after": None,
+        "tools": {},
+    }
+
+
+class RunProfiler:
+    """单次分析运行的性能记录"""
+
+    def __init__(self, stock_code: str, mode: str = "sequential"):
+        """
+        初始化性能记录
+
+        Args:
+            stock_code: 股票代码
+            mode: 工作流模式
+        """
+        self.stock_code = stock_code
+        self.mode = mode
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._start = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.agents: Dict[str, Dict[str, Any]] = {}
+
+    def _agent(self, agent_name: str, start: float, end: float) -> Dict[str, Any]:
+        profile = self.agents.setdefault(agent_name, _new_agent_profile())
+        # 以相对运行开始的秒数记录智能体的活动区间
+        start, end = start - self._start, end - self._start
+        if profile["started_at"] is None or start < profile["started_at"]:
+            profile["started_at"] = start
+        if profile["finished_at"] is None or end > profile["finished_at"]:
+            profile["finished_at"] = end
+        return profile
+
+    def record_model_call(self, agent_name: str, start: float, end: float,
+                          first_token: Optional[float] = None, result: Optional[CreateResult] = None,
+                          http_requests: int = 0):
+        """
+        记录一次模型调用
+
+        Args:
+            agent_name: 智能体名称
+            start: 开始时间（perf_counter）
+            end: 结束时间（perf_counter）
+            first_token: 收到第一个 token 的时间，非流式调用为响应返回时间
+            result: 调用结果，None 表示调用失败
+            http_requests: 本次调用发出的 HTTP 请求数，超过 1 的部分计为重试
+        """
+        profile = self._agent(agent_name, start, end)
+        profile["model_calls"] += 1
+        profile["model_seconds"] += end - start
+        profile["retries"] += max(0, http_requests - 1)
+        if profile["first_token_seconds"] is None and first_token is not None:
+            profile["first_token_seconds"] = first_token - start
+        if result is None:
+            profile["errors"] += 1
+            return
+        if result.cached:
+            profile["cached_calls"] += 1
+        profile["prompt_tokens"] += result.usage.prompt_tokens
+        profile["completion_tokens"] += result.usage.completion_tokens
+
+    def record_tool_call(self, agent_name: str, server_name: str, start: float, end: float,
+                         error: bool = False):
+        """记录一次工具调用"""
+        profile = self._agent(agent_name, start, end)
+        tool_stats = profile["tools"].setdefault(server_name, {"calls": 0, "seconds": 0.0, "errors": 0})
+        tool_stats["calls"] += 1
+        tool_stats["seconds"] += end - start
+        if error:
+            tool_stats["errors"] += 1
+
+    def record_context(self, agent_name: str, before: int, after: int):
+        """记录上下文压缩前后的 token 数"""
+        profile = self.agents.setdefault(agent_name, _new_agent_profile())
+        profile["context_tokens_before"] = before
+        profile["context_tokens_after"] = after
+
+    def finish(self):
+        """结束记录"""
+        self.finished_at = time.time()
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为可序列化的字典"""
+        agents = {}
+        for agent_name, profile in self.agents.items():
+            if profile["started_at"] is None:
+                # 只有上下文记录、没有任何调用的智能体
+                profile["started_at"] = profile["finished_at"] = 0.0
+            agents[agent_name] = {
+                "wall_seconds": round(profile["finished_at"] - profile["started_at"], 3),
+                "started_at": round(profile["started_at"], 3),
+                "finished_at": round(profile["finished_at"], 3),
+                "first_token_seconds": (round(profile["first_token_seconds"], 3)
+                                        if profile["first_token_seconds"] is not None else None),
+                "model_calls": profile["model_calls"],
+                "model_seconds": round(profile["model_seconds"], 3),
+                "cached_calls": profile["cached_calls"],
+                "prompt_tokens": profile["prompt_tokens"],
+                "completion_tokens": profile["completion_tokens"],
+                "retries": profile["retries"],
+                "errors": profile["errors"],
+                "context_tokens_before": profile["context_tokens_before"],
+                "context_tokens_after": profile["context_tokens_after"],
+                "tool_calls": sum(t["calls"] for t in profile["tools"].values()),
+                "tool_seconds": round(sum(t["seconds"] for t in profile["tools"].values()), 3),
+                "tools": {name: {**t, "seconds": round(t["seconds"], 3)} for name, t in profile["tools"].items()},
+            }
+        return {
+            "stock_code": self.stock_code,
+            "mode": self.mode,
+            "started_at": datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d %H:%M:%S"),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "prompt_tokens": sum(a["prompt_tokens"] for a in agents.values()),
+            "completion_tokens": sum(a["completion_tokens"] for a in agents.values()),
+            "model_calls": sum(a["model_calls"] for a in agents.values()),
+            "tool_calls": sum(a["tool_calls"] for a in agents.values()),
+            "retries": sum(a["retries"] for a in agents.values()),
+            "context_tokens_before": sum(a["context_tokens_before"] or 0 for a in agents.values()),
+            "context_tokens_after": sum(a["context_tokens_after"] or 0 for a in agents.values()),
+            "agents": agents,
+        }
+
+    def save(self, base_path: str, formats: Sequence[str] = ("json", "csv")) -> List[str]:
+        """
+        保存性能分析文件
+
+        Args:
+            base_path: 不含扩展名的文件路径（通常与报告同名）
+            formats: 输出格式 json / csv
+
+        Returns:
+            List[str]: 已保存的文件路径
+        """
+        data = self.to_dict()
+        paths = []
+        os.makedirs(os.path.dirname(os.path.abspath(base_path)), exist_ok=True)
+        if "json" in formats:
+            path = f"{base_path}.profile.json"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            paths.append(path)
+        if "csv" in formats:
+            path = f"{base_path}.profile.csv"
+            servers = sorted({name for a in data["agents"].values() for name in a["tools"]})
+            columns = ["agent", "wall_seconds", "first_token_seconds", "model_calls", "model_seconds",
+                       "cached_calls", "prompt_tokens", "completion_tokens", "retries", "errors",
+                       "context_tokens_before", "context_tokens_after", "tool_calls", "tool_seconds"]
+            for server in servers:
+                columns += [f"{server}_calls", f"{server}_seconds"]
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                for agent_name, agent in data["agents"].items():
+                    row = {k: v for k, v in agent.items() if k in columns}
+                    row["agent"] = agent_name
+                    for server in servers:
+                        tool_stats = agent["tools"].get(server, {"calls": 0, "seconds": 0.0})
+                        row[f"{server}_calls"] = tool_stats["calls"]
+                        row[f"{server}_seconds"] = tool_stats["seconds"]
+                    writer.writerow(row)
+            paths.append(path)
+        return paths
+
+
+def print_profile_summary(profile: Dict[str, Any]):
+    """打印按智能体汇总的性能表"""
+    agents = profile.get("agents", {})
+    if not agents:
+        return
+    print(f"\n⏱️ 性能分析 ({profile['stock_code']}, 总耗时 {profile['wall_seconds']:.1f}秒):")
+    print(f"   {'智能体':<20}{'耗时':>8}{'首token':>9}{'模型调用':>8}{'提示tokens':>11}"
+          f"{'完成tokens':>11}{'重试':>6}{'工具调用':>8}{'工具耗时':>9}")
+    for agent_name, agent in sorted(agents.items(), key=lambda item: item[1]["started_at"]):
+        first_token = f"{agent['first_token_seconds']:.1f}s" if agent["first_token_seconds"] is not None else "-"
+        print(f"   {agent_name:<20}{agent['wall_seconds']:>7.1f}s{first_token:>9}{agent['model_calls']:>8}"
+              f"{agent['prompt_tokens']:>11}{agent['completion_tokens']:>11}{agent['retries']:>6}"
+              f"{agent['tool_calls']:>8}{agent['tool_seconds']:>8.1f}s")
+    print(f"   合计: 模型调用 {profile['model_calls']}  tokens {profile['prompt_tokens']} + "
+          f"{profile['completion_tokens']}  工具调用 {profile['tool_calls']}  重试 {profile['retries']}")
+    if profile.get("context_tokens_before"):
+        print(f"   上下文压缩: {profile['context_tokens_before']} → {profile['context_tokens_after']} tokens")
+
+
+class ProfiledModelClient(ModelClientWrapper):
+    """记录调用耗时和 token 用量的智能体模型客户端"""
+
+    def __init__(self, client: ChatCompletionClient, agent_name: str):
+        super().__init__(client)
+        self.agent_name = agent_name
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        profiler = _current_profiler.get()
+        call = {"http_requests": 0}
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await super().create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+            return result
+        finally:
+            _current_call.reset(token)
+            if profiler is not None:
+                end = time.perf_counter()
+                profiler.record_model_call(self.agent_name, start, end, end if result is not None else None,
+                                           result, call["http_requests"])
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        profiler = _current_profiler.get()
+        call = {"http_requests": 0}
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        first_token = None
+        result = None
+        try:
+            async for chunk in super().create_stream(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                if isinstance(chunk, CreateResult):
+                    result = chunk
+                elif first_token is None:
+                    first_token = time.perf_counter()
+                yield chunk
+        finally:
+            try:
+                _current_call.reset(token)
+            except ValueError:
+                # 生成器在其他上下文中被关闭
+                pass
+            if profiler is not None:
+                end = time.perf_counter()
+                if first_token is None and result is not None:
+                    first_token = end
+                profiler.record_model_call(self.agent_name, start, end, first_token, result,
+                                           call["http_requests"])
+
+
+class ProfiledTool(ToolWrapper):
+    """记录调用次数和耗时的工具"""
+
+    def __init__(self, tool: BaseTool, agent_name: str, server_name: str):
+        super().__init__(tool)
+        self.agent_name = agent_name
+        self._server_name = server_name
+
+    @property
+    def server_name(self) -> Optional[str]:
+        """工具所属的MCP服务器名称"""
+        return self._server_name
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        profiler = _current_profiler.get()
+        start = time.perf_counter()
+        error = True
+        try:
+            value = await self.call_tool(args, cancellation_token)
+            error = False
+            return value
+        finally:
+            if profiler is not None:
+                profiler.record_tool_call(self.agent_name, self._server_name, start,
+                                          time.perf_counter(), error)
+
+
+def record_context_tokens(agent_name: str, before: int, after: int):
+    """记录当前运行中智能体上下文压缩前后的 token 数（未启用性能分析时忽略）"""
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.record_context(agent_name, before, after)
+
+
+async def observe_request(request: httpx.Request):
+    """httpx 请求钩子：统计当前模型调用发出的 HTTP 请求数（客户端内部重试会多次触发）"""
+    call = _current_call.get()
+    if call is not None:
+        call["http_requests"] += 1
+
+
+def start_profiling(stock_code: str, mode: str = "sequential") -> Optional[contextvars.Token]:
+    """
+    为当前上下文创建并激活运行分析器
+
+    Returns:
+        Optional[contextvars.Token]: 用于 stop_profiling 的令牌，未启用时返回 None
+    """
+    if not get_profile_config().get("enabled", False):
+        return None
+    return _current_profiler.set(RunProfiler(stock_code, mode))
+
+
+def stop_profiling(token: Optional[contextvars.Token], base_path: str = "") -> Dict[str, Any]:
+    """
+    结束当前运行的分析并保存性能分析文件
+
+    Args:
+        token: start_profiling 返回的令牌
+        base_path: 不含扩展名的输出路径，为空时不保存文件
+
+    Returns:
+        Dict[str, Any]: 性能分析数据（含 files 字段），未启用时返回空字典
+    """
+    if token is None:
+        return {}
+    profiler = _current_profiler.get()
+    _current_profiler.reset(token)
+    profiler.finish()
+    profile = profiler.to_dict()
+    profile["files"] = []
+    if base_path:
+        try:
+            profile["files"] = profiler.save(base_path, get_profile_config().get("formats", ["json", "csv"]))
+        except Exception as e:
+            print(f"⚠️ 保存性能分析文件失败: {e}")
+    return profile
+
+
+def profile_model_client(client: ChatCompletionClient, agent_name: str) -> ChatCompletionClient:
+    """按配置为智能体的模型客户端加上性能记录"""
+    if not get_profile_config().get("enabled", False):
+        return client
+    return ProfiledModelClient(client, agent_name)
+
+
+def profile_tools(agent_name: str, server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """按配置为智能体的工具加上性能记录"""
+    if not get_profile_config().get("enabled", False):
+        return tools
+    return wrap_tools(tools, lambda tool: ProfiledTool(tool, agent_name, server_name))
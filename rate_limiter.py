@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+限流模块
+模型调用与MCP工具调用的共享限流层：
+- 令牌桶限制每分钟请求数和每分钟 token 数
+- 并发上限按 AIMD 自适应：成功时加性增加，遇到 429 / 超时时乘性减少
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence, Union
+
+import httpx
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import BaseTool, Tool, ToolSchema
+from pydantic import BaseModel
+
+from config import get_rate_limit_config
+from model_middleware import ModelClientWrapper
+from tool_middleware import ToolWrapper, wrap_tools
+
+# 视为限流或过载信号的错误关键字
+THROTTLE_KEYWORDS = ("429", "rate limit", "too many requests", "timed out", "timeout")
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """判断错误是否为限流（429）或超时"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    if getattr(error, "status_code", None) == 429:
+        return True
+    name = type(error).__name__.lower()
+    if "ratelimit" in name or "timeout" in name:
+        return True
+    message = str(error).lower()
+    return any(keyword in message for keyword in THROTTLE_KEYWORDS)
+
+
+class TokenBucket:
+    """令牌桶 - 按每分钟速率补充，允许最多 burst_seconds 秒的突发量"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        """当前可用令牌数（可能为负，表示欠账）"""
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float = 1.0):
+        """
+        获取令牌，不足时等待
+
+        超过桶容量的请求在桶满时放行并记为欠账，避免大请求永远无法执行
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((needed - self._tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """修正已扣除的令牌（正数为退还，负数为补扣）"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds: float):
+        """暂停发放令牌（例如服务端返回 Retry-After）"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    限流器 - 令牌桶 + AIMD 自适应并发
+
+    并发上限在 [min_concurrency, max_concurrency] 之间调整：
+    每次成功增加 1/当前上限（约每轮增加 1），遇到限流或超时时减半，
+    减半操作在 decrease_cooldown 秒内最多触发一次，避免同一波 429 连续减半。
+    """
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, initial_concurrency: int = 4,
+                 min_concurrency: int = 1, max_concurrency: int = 16,
+                 decrease_factor: float = 0.5, decrease_cooldown: float = 2.0,
+                 burst_seconds: float = 10.0):
+        """
+        初始化限流器
+
+        Args:
+            name: 限流器名称（如 model、tavily）
+            requests_per_minute: 每分钟请求数上限，None 表示不限制
+            tokens_per_minute: 每分钟 token 数上限，None 表示不限制
+            initial_concurrency: 初始并发上限
+            min_concurrency: 最小并发上限
+            max_concurrency: 最大并发上限
+            decrease_factor: 遇到限流时并发上限的乘数
+            decrease_cooldown: 两次减少之间的最短间隔（秒）
+            burst_seconds: 令牌桶允许的突发时长（秒）
+        """
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"requests": 0, "successes": 0, "throttled": 0, "errors": 0, "wait_seconds": 0.0}
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """限流器所属的事件循环"""
+        return self._loop
+
+    async def _acquire_slot(self):
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def _release_slot(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0):
+        """
+        获取一次调用的执行许可，退出时根据结果调整并发上限
+
+        Args:
+            estimated_tokens: 预估 token 数，用于 token 令牌桶
+        """
+        start = time.monotonic()
+        await self._acquire_slot()
+        try:
+            if self.requests is not None:
+                await self.requests.acquire(1)
+            if self.tokens is not None and estimated_tokens > 0:
+                await self.tokens.acquire(estimated_tokens)
+        except BaseException:
+            await self._release_slot()
+            raise
+        self.stats["requests"] += 1
+        self.stats["wait_seconds"] += time.monotonic() - start
+        try:
+            yield self
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if is_throttle_error(e):
+                self.on_throttle()
+            else:
+                self.stats["errors"] += 1
+            raise
+        else:
+            self.on_success()
+        finally:
+            await self._release_slot()
+
+    def record_tokens(self, estimated_tokens: int, actual_tokens: int):
+        """用实际 token 用量修正令牌桶"""
+        if self.tokens is not None and actual_tokens > 0:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def on_success(self):
+        """加性增加并发上限"""
+        self.stats["successes"] += 1
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """乘性减少并发上限，并按 Retry-After 暂停发放请求令牌"""
+        self.stats["throttled"] += 1
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_cooldown:
+            self._last_decrease = now
+            self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+        if retry_after and self.requests is not None:
+            self.requests.pause(retry_after)
+
+    async def observe_response(self, response: httpx.Response):
+        """httpx 响应钩子：客户端内部重试的 429 也能反馈给限流器"""
+        if response.status_code == 429:
+            retry_after = response.headers.get("retry-after")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            self.on_throttle(retry_after)
+
+    def get_state(self) -> Dict[str, Any]:
+        """获取限流器当前状态"""
+        return {
+            "name": self.name,
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests_available": round(self.requests.available, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.available, 1) if self.tokens else None,
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in self.stats.items()},
+        }
+
+
+def _estimate_tokens(client: ChatCompletionClient, messages: Sequence[LLMMessage],
+                     tools: Sequence[Union[Tool, ToolSchema]]) -> int:
+    """预估提示词 token 数，模型不被 tiktoken 识别时按字符数估算"""
+    try:
+        return client.count_tokens(messages, tools=tools)
+    except Exception:
+        return sum(len(str(m.content)) for m in messages) // 2
+
+
+class RateLimitedChatCompletionClient(ModelClientWrapper):
+    """受限流器控制的模型客户端"""
+
+    def __init__(self, client: ChatCompletionClient, limiter: RateLimiter):
+        super().__init__(client)
+        self.limiter = limiter
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        estimated = _estimate_tokens(self.client, messages, tools)
+        async with self.limiter.slot(estimated):
+            result = await super().create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+        self.limiter.record_tokens(estimated, result.usage.prompt_tokens + result.usage.completion_tokens)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+        json_output: Optional[Union[bool, type[BaseModel]]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        estimated = _estimate_tokens(self.client, messages, tools)
+        async with self.limiter.slot(estimated):
+            async for chunk in super().create_stream(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                if isinstance(chunk, CreateResult):
+                    self.limiter.record_tokens(estimated, chunk.usage.prompt_tokens + chunk.usage.completion_tokens)
+                yield chunk
+
+
+class RateLimitedTool(ToolWrapper):
+    """受限流器控制的工具"""
+
+    def __init__(self, tool: BaseTool, limiter: RateLimiter):
+        super().__init__(tool)
+        self.limiter = limiter
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        async with self.limiter.slot():
+            return await self.call_tool(args, cancellation_token)
+
+
+# 进程级限流器，按名称共享（model 以及各MCP服务器名称）
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """
+    获取指定名称的进程级限流器（必须在事件循环中调用）
+
+    Args:
+        name: 限流器名称，model 或MCP服务器名称
+
+    Returns:
+        Optional[RateLimiter]: 限流器，未启用或未配置时返回 None
+    """
+    rate_config = get_rate_limit_config()
+    if not rate_config.get("enabled", False) or name not in rate_config.get("limits", {}):
+        return None
+    limiter = _limiters.get(name)
+    # asyncio 同步原语与事件循环绑定，事件循环变化时重新创建
+    if limiter is None or limiter.loop is not asyncio.get_running_loop():
+        limiter = RateLimiter(name, **rate_config["limits"][name])
+        _limiters[name] = limiter
+    return limiter
+
+
+def rate_limit_model_client(client: ChatCompletionClient) -> ChatCompletionClient:
+    """按配置为模型客户端加上限流"""
+    limiter = get_rate_limiter("model")
+    if limiter is None:
+        return client
+    return RateLimitedChatCompletionClient(client, limiter)
+
+
+def rate_limit_tools(server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """按配置为MCP服务器的工具加上限流"""
+    limiter = get_rate_limiter(server_name)
+    if limiter is None:
+        return tools
+    return wrap_tools(tools, lambda tool: RateLimitedTool(tool, limiter))
+
+
+def get_rate_limit_state() -> List[Dict[str, Any]]:
+    """获取所有限流器的当前状态"""
+    return [limiter.get_state() for limiter in _limiters.values()]
+
+
+def print_rate_limit_state():
+    """打印所有限流器的状态（未使用时不输出）"""
+    states = get_rate_limit_state()
+    if not states:
+        return
+    print("\n🚦 限流器状态:")
+    for state in states:
+        print(f"   ├─ {state['name']}: 并发上限 {state['concurrency_limit']}  请求 {state['requests']}  "
+              f"成功 {state['successes']}  限流/超时 {state['throttled']}  错误 {state['errors']}  "
+              f"累计等待 {state['wait_seconds']}秒")
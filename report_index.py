@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+报告索引模块
+为 reports/ 目录建立索引（股票代码 → 最近报告、生成时间、包含的智能体），按时效策略复用近期报告：
+- 报告在有效期内且所有章节都未过期：直接返回已有报告，不运行工作流
+- 部分时效性强的章节（如新闻、技术面）已过期：只重新运行这些智能体和策略顾问，其余章节沿用
+也支持手动指定只重新运行部分智能体（--agents），其余章节从已有报告或检查点加载
+"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import AGENT_NAMES, AGENT_ROLES, get_report_config
+from workflow import REQUIRED_AGENTS
+from checkpoint import RunCheckpoint, get_checkpoint_path
+from deadlines import is_degraded
+
+# 索引文件格式版本，格式或报告解析规则不兼容时重建
+INDEX_VERSION = 3
+
+# 报告文件名：股票分析报告_{股票代码}_{YYYYmmdd_HHMMSS}.md
+REPORT_FILENAME_PATTERN = re.compile(r"^股票分析报告_(?P<code>.+)_(?P<timestamp>\d{8}_\d{6})\.md$")
+
+# 章节标题：### {角色} ({智能体名称})，较早的报告为 ## {角色} ({智能体名称})
+_SECTION_HEADER_PATTERN = re.compile(
+    r"^#{2,3} (?P<role>.+) \((?P<agent>%s)\)\n\n" % "|".join(re.escape(name) for name in AGENT_NAMES),
+    re.MULTILINE,
+)
+
+# 章节之后的内容：未完成标注、报告总结，或较早的报告中记录的用户请求
+_SECTIONS_END_MARKERS = ("\n> ⚠️ 分析未完成", "\n## 分析总结", "\n## user (user)\n", "\n### user (user)\n")
+
+
+def parse_report_sections(text: str) -> Dict[str, str]:
+    """
+    从报告 Markdown 中解析各智能体的章节内容
+
+    Args:
+        text: 报告全文
+
+    Returns:
+        Dict[str, str]: 智能体名称到章节内容的映射，按报告中的顺序排列
+    """
+    roles = dict(zip(AGENT_NAMES, AGENT_ROLES))
+    headers = [m for m in _SECTION_HEADER_PATTERN.finditer(text)
+               if roles.get(m.group("agent")) == m.group("role")]
+    if not headers:
+        return {}
+    body_end = len(text)
+    for marker in _SECTIONS_END_MARKERS:
+        index = text.rfind(marker, headers[-1].end())
+        if index != -1:
+            body_end = min(body_end, index + 1)
+
+    sections: Dict[str, str] = {}
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else body_end
+        content = text[header.end():end].rstrip()
+        if content.endswith("---"):
+            content = content[:-3].rstrip()
+        sections[header.group("agent")] = content
+    return sections
+
+
+class ReportIndex:
+    """报告目录索引 - 按文件修改时间增量更新，索引持久化为 JSON 文件"""
+
+    def __init__(self, reports_dir: str, index_path: str):
+        """
+        初始化索引
+
+        Args:
+            reports_dir: 报告目录
+            index_path: 索引文件路径
+        """
+        self.reports_dir = reports_dir
+        self.index_path = index_path
+        # 文件名到报告信息的映射
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """读取索引文件，不存在或格式不兼容时返回空索引"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                return data["reports"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    def save(self):
+        """原子写入索引文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "reports": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def refresh(self) -> int:
+        """
+        扫描报告目录，只解析新增或修改过的报告
+
+        Returns:
+            int: 重新解析的报告数量
+        """
+        try:
+            filenames = [name for name in os.listdir(self.reports_dir) if REPORT_FILENAME_PATTERN.match(name)]
+        except FileNotFoundError:
+            filenames = []
+
+        parsed = 0
+        current: Dict[str, Dict[str, Any]] = {}
+        for filename in filenames:
+            path = os.path.join(self.reports_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = self.entries.get(filename)
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                entry = self._index_report(filename, path, stat)
+                if entry is None:
+                    continue
+                parsed += 1
+            current[filename] = entry
+
+        changed = parsed > 0 or len(current) != len(self.entries)
+        self.entries = current
+        if changed:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"⚠️ 保存报告索引失败: {e}")
+        return parsed
+
+    @staticmethod
+    def _index_report(filename: str, path: str, stat: os.stat_result) -> Optional[Dict[str, Any]]:
+        """解析单个报告的索引信息"""
+        match = REPORT_FILENAME_PATTERN.match(filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        created_at = datetime.strptime(match.group("timestamp"), "%Y%m%d_%H%M%S").timestamp()
+        sections = parse_report_sections(text)
+        return {
+            "stock_code": match.group("code"),
+            "created_at": created_at,
+            "agents": list(sections),
+            "degraded": [name for name, content in sections.items() if is_degraded(content)],
+            "complete": "> ⚠️ 分析未完成" not in text,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        }
+
+    def latest(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        """
+        获取股票最近一份报告的索引信息
+
+        Args:
+            stock_code: 股票代码
+
+        Returns:
+            Optional[Dict[str, Any]]: 含 path 的索引信息，没有报告时返回 None
+        """
+        candidates = [(entry["created_at"], filename) for filename, entry in self.entries.items()
+                      if entry["stock_code"] == stock_code]
+        if not candidates:
+            return None
+        _, filename = max(candidates)
+        return {**self.entries[filename], "path": os.path.join(self.reports_dir, filename)}
+
+
+def _resolve_paths(reports_dir: Optional[str]) -> Tuple[str, str]:
+    """获取报告目录和索引文件的绝对路径"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if reports_dir is None:
+        reports_dir = os.path.join(base_dir, "reports")
+    index_path = get_report_config().get("index_path", ".cache/report_index.json")
+    if not os.path.isabs(index_path):
+        index_path = os.path.join(base_dir, index_path)
+    return reports_dir, index_path
+
+
+def _read_sections(path: str) -> Optional[Dict[str, str]]:
+    """读取报告中可沿用的智能体章节（不含超时降级的章节），读取失败时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            sections = parse_report_sections(f.read())
+    except OSError:
+        return None
+    return {name: content for name, content in sections.items() if not is_degraded(content)}
+
+
+def plan_report_reuse(stock_code: str, reports_dir: Optional[str] = None,
+                      now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    按时效策略决定是否复用近期报告
+
+    Args:
+        stock_code: 股票代码
+        reports_dir: 报告目录，默认为项目下的 reports 目录
+        now: 当前时间戳，默认为当前时间
+
+    Returns:
+        Optional[Dict[str, Any]]: 不复用时返回 None，否则返回
+            - path: 被复用的报告路径
+            - age_hours: 报告生成至今的小时数
+            - sections: 可沿用的智能体章节（名称到内容）
+            - rerun: 需要重新运行的智能体，为空表示整份报告直接复用
+    """
+    report_config = get_report_config()
+    max_age_hours = report_config.get("reuse_max_age_hours", 0)
+    if max_age_hours <= 0:
+        return None
+
+    index = ReportIndex(*_resolve_paths(reports_dir))
+    index.refresh()
+    entry = index.latest(stock_code)
+    now = time.time() if now is None else now
+    if entry is None:
+        return None
+    age_hours = (now - entry["created_at"]) / 3600
+    if age_hours < 0 or age_hours > max_age_hours:
+        return None
+
+    sections = _read_sections(entry["path"])
+    if sections is None:
+        return None
+
+    # 缺失的章节和超过各自时效的章节需要重新运行
+    section_max_age = report_config.get("section_max_age_hours", {})
+    rerun = [name for name in REQUIRED_AGENTS
+             if name not in sections or age_hours > section_max_age.get(name, max_age_hours)]
+    # 任何章节重新运行时，策略顾问都要基于新结论重新给出建议
+    if rerun and "strategy_advisor" not in rerun:
+        rerun.append("strategy_advisor")
+    if len(rerun) == len(REQUIRED_AGENTS):
+        return None
+    return {
+        "path": entry["path"],
+        "age_hours": age_hours,
+        "sections": {name: content for name, content in sections.items()
+                     if name in REQUIRED_AGENTS and name not in rerun},
+        "rerun": rerun,
+    }
+
+
+def plan_selective_rerun(stock_code: str, agents: List[str], report_path: Optional[str] = None,
+                         reports_dir: Optional[str] = None,
+                         now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    只重新运行指定的智能体，其余章节从已有报告或检查点加载
+
+    未指定报告时，在该股票最近的报告和检查点中选择较新的一个。
+
+    Args:
+        stock_code: 股票代码
+        agents: 需要重新运行的智能体
+        report_path: 作为基础的报告路径，None 表示自动选择
+        reports_dir: 报告目录，默认为项目下的 reports 目录
+        now: 当前时间戳，默认为当前时间
+
+    Returns:
+        Dict[str, Any]: 与 plan_report_reuse 相同结构的计划；
+            基础中缺失的智能体也会加入 rerun
+
+    Raises:
+        ValueError: 智能体名称无效，或找不到可用的报告和检查点
+    """
+    unknown = [name for name in agents if name not in REQUIRED_AGENTS]
+    if unknown:
+        raise ValueError(f"未知的智能体: {', '.join(unknown)}，可选: {', '.join(REQUIRED_AGENTS)}")
+    now = time.time() if now is None else now
+
+    source = None
+    if report_path is not None:
+        sections = _read_sections(report_path)
+        if sections is None:
+            raise ValueError(f"无法读取报告: {report_path}")
+        match = REPORT_FILENAME_PATTERN.match(os.path.basename(report_path))
+        created_at = (datetime.strptime(match.group("timestamp"), "%Y%m%d_%H%M%S").timestamp()
+                      if match else os.path.getmtime(report_path))
+        source = (created_at, report_path, sections)
+    else:
+        index = ReportIndex(*_resolve_paths(reports_dir))
+        index.refresh()
+        entry = index.latest(stock_code)
+        if entry is not None:
+            sections = _read_sections(entry["path"])
+            if sections is not None:
+                source = (entry["created_at"], entry["path"], sections)
+        checkpoint = RunCheckpoint.load(get_checkpoint_path(stock_code))
+        if checkpoint is not None and checkpoint.completed and (source is None or checkpoint.created_at > source[0]):
+            source = (checkpoint.created_at, checkpoint.path, dict(checkpoint.completed))
+    if source is None:
+        raise ValueError(f"{stock_code} 没有可用的报告或检查点，无法只运行部分智能体")
+
+    created_at, path, sections = source
+    missing = [name for name in REQUIRED_AGENTS if name not in sections and name not in agents]
+    if missing:
+        print(f"⚠️ {os.path.basename(path)} 中缺少 {', '.join(missing)} 的章节，一并重新运行")
+    rerun = [name for name in REQUIRED_AGENTS if name in agents or name in missing]
+    return {
+        "path": path,
+        "age_hours": max(0.0, (now - created_at) / 3600),
+        "sections": {name: content for name, content in sections.items()
+                     if name in REQUIRED_AGENTS and name not in rerun},
+        "rerun": rerun,
+    }
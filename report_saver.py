@@ -4,24 +4,49 @@
 """
 报告保存模块
 处理智能体消息和生成报告 - 只保存每个agent的最后一个输出
+流式模式下每个智能体完成后立即把其章节追加到临时文件（崩溃时保留已完成的章节），结束时按固定顺序生成正式报告并删除临时文件
+智能体启用 model_client_stream 时，模型输出分块通过有界输出队列实时显示
 """
 
 import os
+import time
 from datetime import datetime
-from typing import AsyncGenerator, Dict, Any
+from typing import AsyncGenerator, Dict, Any, Optional, TextIO
 import logging
+
+from autogen_agentchat.messages import BaseChatMessage, ModelClientStreamingChunkEvent
+
 from config import AGENT_NAMES, AGENT_ROLES
 
 
+def format_agent_section(agent_name: str, content: str) -> str:
+    """
+    格式化单个智能体的报告章节
+
+    Args:
+        agent_name: 智能体名称
+        content: 智能体最终输出
+
+    Returns:
+        str: Markdown 章节（含结尾分隔线）
+    """
+    display_name = dict(zip(AGENT_NAMES, AGENT_ROLES)).get(agent_name, agent_name)
+    return f"### {display_name} ({agent_name})\n\n{content}\n\n---\n\n"
+
+
 class ReportSaver:
     """报告保存器 - 只保存每个agent的最后一个输出"""
 
-    def __init__(self, output_dir: str = None):
+    def __init__(self, output_dir: str = None, verbose: bool = True, streaming: bool = False,
+                 output: Optional[Any] = None):
         """
         初始化报告保存器
 
         Args:
             output_dir: 输出目录，默认为当前目录下的 reports 文件夹
+            verbose: 是否在控制台打印每条消息（批量模式下关闭）
+            streaming: 是否在每个智能体完成后立即写入报告章节（运行中断时已完成的章节不会丢失）
+            output: 显示消息使用的输出队列（OutputQueue），None 表示直接 print
         """
         # 使用相对路径作为默认目录
         if output_dir is None:
@@ -34,6 +59,17 @@ class ReportSaver:
         self.user_request = ""  # 保存用户原始请求
         self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.current_agent = None
+        self.verbose = verbose
+        self.report_path = ""  # 最近一次保存的报告路径
+        self.error = None  # 处理消息流时发生的错误
+        self.streaming = streaming
+        self.partial_path = ""  # 流式模式下正在写入的临时文件
+        self._stock_code: Optional[str] = None
+        self._partial_file: Optional[TextIO] = None
+        self.output = output
+        self._streaming_source = None  # 正在逐块显示输出的智能体
+        self._started_at = time.perf_counter()
+        self.first_output_seconds: Optional[float] = None  # 开始处理消息流到第一个智能体输出（含分块）的秒数
 
         # 设置日志
         logging.basicConfig(level=logging.INFO)
@@ -69,13 +105,18 @@ class ReportSaver:
             Dict[str, str]: 智能体名称到最后结果的映射
         """
         try:
+            if self.streaming:
+                self._open_partial_report(stock_code)
+
             async for message in stream:
                 await self._process_message(message)
 
+            if self.streaming:
+                self.report_path = self._finalize_partial_report()
             # 保存所有智能体的最后一个结果
-            if self.agent_results:
+            elif self.agent_results:
                 self.logger.info("正在保存智能体最终结果...")
-                await self._save_agent_results(stock_code)
+                self.report_path = await self._save_agent_results(stock_code)
             else:
                 self.logger.warning("没有收集到任何智能体结果")
 
@@ -83,6 +124,10 @@ class ReportSaver:
 
         except Exception as e:
             self.logger.error(f"处理消息流时发生错误: {e}")
+            self.error = e
+            if self.streaming:
+                # 已完成的章节保留在报告中，并标注分析未完成
+                self.report_path = self._finalize_partial_report(error=e)
             return self.agent_results
 
     async def _process_message(self, message: Any):
@@ -104,6 +149,18 @@ class ReportSaver:
             if not content:
                 return
 
+            if source != "user" and self.first_output_seconds is None:
+                self.first_output_seconds = time.perf_counter() - self._started_at
+
+            # 模型输出分块只用于实时显示，完整消息到达后再保存
+            if isinstance(message, ModelClientStreamingChunkEvent):
+                if self.verbose:
+                    if self._streaming_source != source:
+                        await self._display(f"\n---------- {source} ----------\n")
+                        self._streaming_source = source
+                    await self._display(content)
+                return
+
             # 处理内容格式
             if isinstance(content, list):
                 content_str = '\n'.join(str(item) for item in content if str(item).strip())
@@ -113,15 +170,29 @@ class ReportSaver:
             if not content_str.strip():
                 return
 
-            # 显示消息
-            print(f"\n---------- {source} ----------")
-            print(content_str)
-            print("-" * 60)
+            # 显示消息（已逐块显示过的回复只补上分隔线）
+            if self.verbose:
+                if self._streaming_source == source and isinstance(message, BaseChatMessage):
+                    await self._display("\n" + "-" * 60 + "\n")
+                else:
+                    if self._streaming_source is not None:
+                        await self._display("\n")
+                    await self._display(f"\n---------- {source} ----------\n{content_str}\n{'-' * 60}\n")
+                self._streaming_source = None
 
             # 更新当前 agent
             self.current_agent = source
 
-            # 【关键修改】只保存每个agent的最后一个输出，替换之前的内容
+            if self.streaming:
+                # 流式模式只保留智能体的最终回复（工具调用等中间事件不驻留内存），并立即写入报告
+                if isinstance(message, BaseChatMessage) and source != "user":
+                    self.agent_results[source] = content_str
+                    self._append_section(source, content_str)
+                return
+
+            # 【关键修改】只保存每个agent的最后一个输出，替换之前的内容（用户请求已写在报告开头）
+            if source == "user":
+                return
             self.agent_results[source] = content_str
             self.logger.debug(f"已更新 {source} 的最终结果，长度: {len(content_str)}")
 
@@ -129,6 +200,131 @@ class ReportSaver:
             self.logger.error(f"处理消息时出错: {e}")
             # 不重新抛出异常，继续处理其他消息
 
+    async def _display(self, text: str):
+        """显示文本 - 有输出队列时放入队列，不阻塞事件循环"""
+        if self.output is not None:
+            await self.output.put(text)
+        else:
+            print(text, end="", flush=True)
+
+    def _report_filename(self, stock_code: str = None) -> str:
+        """生成报告文件名"""
+        if stock_code:
+            return f"股票分析报告_{stock_code}_{self.timestamp}.md"
+        return f"分析报告_{self.timestamp}.md"
+
+    def _write_header(self, f: TextIO, stock_code: str = None):
+        """写入报告标题和用户请求"""
+        # 【修改1】首先写入用户请求信息
+        f.write(f"# 股票分析报告\n\n")
+        f.write(f"**生成时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        if stock_code:
+            f.write(f"**股票代码**: {stock_code}\n\n")
+
+        # 写入用户原始请求
+        if self.user_request:
+            f.write("## 用户请求\n\n")
+            f.write(f"```\n{self.user_request}\n```\n\n")
+
+        f.write("---\n\n")
+
+    def _write_section(self, f: TextIO, agent_name: str, content: str):
+        """写入单个智能体的章节"""
+        f.write(format_agent_section(agent_name, content))
+
+    def _write_footer(self, f: TextIO):
+        """写入报告总结"""
+        f.write(f"## 分析总结\n\n")
+        f.write(f"本次分析共涉及 {len(self.agent_results)} 个智能体，")
+        f.write("每个智能体只保留最终输出结果，避免重复信息堆积。\n")
+        f.write(f"报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}。\n\n")
+
+    def _open_partial_report(self, stock_code: str = None):
+        """流式模式：创建临时报告文件并写入标题"""
+        filepath = os.path.join(self.output_dir, self._report_filename(stock_code))
+        self._stock_code = stock_code
+        self.partial_path = filepath + ".partial"
+        self._partial_file = open(self.partial_path, 'w', encoding='utf-8')
+        self._write_header(self._partial_file, stock_code)
+        self._partial_file.write("## 智能体分析结果\n\n")
+        self._partial_file.write("---\n\n")
+        self._flush_partial()
+
+    def _flush_partial(self):
+        """把临时文件刷到磁盘，进程崩溃时已完成的章节不会丢失"""
+        self._partial_file.flush()
+        os.fsync(self._partial_file.fileno())
+
+    def _append_section(self, agent_name: str, content: str):
+        """流式模式：追加一个智能体的章节"""
+        if self._partial_file is None:
+            return
+        try:
+            self._write_section(self._partial_file, agent_name, content)
+            self._flush_partial()
+            self.logger.info(f"已写入 {agent_name} 的分析章节")
+        except Exception as e:
+            self.logger.error(f"写入 {agent_name} 章节时出错: {e}")
+
+    def _finalize_partial_report(self, error: Exception = None) -> str:
+        """
+        流式模式：从内存中的最终结果生成正式报告，写入完成后删除临时文件
+
+        临时文件只用于进程崩溃时保留已完成的章节，其中的章节按完成顺序排列；
+        正式报告与非流式模式相同，按 AGENT_NAMES 顺序排列并包含智能体数量
+
+        Args:
+            error: 运行中断时的错误，会在报告中标注分析未完成
+
+        Returns:
+            str: 报告文件路径，没有任何章节或保存失败时返回空字符串
+        """
+        if self._partial_file is None:
+            return ""
+        try:
+            self._partial_file.close()
+            if not self.agent_results:
+                os.remove(self.partial_path)
+                self.logger.warning("没有收集到任何智能体结果")
+                return ""
+            filepath = self.partial_path[:-len(".partial")]
+            self._write_report_file(filepath, self._stock_code, error)
+            os.remove(self.partial_path)
+            self.logger.info(f"分析报告已保存到: {filepath}")
+            return filepath
+        except Exception as e:
+            self.logger.error(f"保存报告时出错: {e}")
+            return ""
+        finally:
+            self._partial_file = None
+
+    def _ordered_agents(self) -> list:
+        """按 config.py 中的智能体顺序排列已收集的结果，未知的智能体排在最后"""
+        ordered_agents = [name for name in AGENT_NAMES if name in self.agent_results]
+        ordered_agents += [name for name in self.agent_results if name not in AGENT_NAMES]
+        return ordered_agents
+
+    def _write_report_file(self, filepath: str, stock_code: str = None, error: Exception = None):
+        """写入完整报告：先写临时文件再原子重命名，读取方不会看到写了一半的报告"""
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            self._write_header(f, stock_code)
+
+            # 写入各智能体的最终结果
+            f.write("## 智能体分析结果\n\n")
+            f.write(f"**智能体数量**: {len(self.agent_results)} 个\n\n")
+            f.write("---\n\n")
+
+            for agent_name in self._ordered_agents():
+                self._write_section(f, agent_name, self.agent_results[agent_name])
+
+            if error is not None:
+                f.write(f"> ⚠️ 分析未完成: {error}\n\n---\n\n")
+
+            # 写入总结
+            self._write_footer(f)
+        os.replace(tmp_path, filepath)
+
     async def _save_agent_results(self, stock_code: str = None) -> str:
         """
         保存智能体最终结果到Markdown文件
@@ -141,60 +337,8 @@ class ReportSaver:
             str: 保存的文件路径，如果保存失败返回空字符串
         """
         try:
-            # 生成文件名
-            if stock_code:
-                filename = f"股票分析报告_{stock_code}_{self.timestamp}.md"
-            else:
-                filename = f"分析报告_{self.timestamp}.md"
-
-            filepath = os.path.join(self.output_dir, filename)
-
-            # 智能体显示顺序 - 直接从 config.py 导入，确保一致性
-            agent_display_order = dict(zip(AGENT_NAMES, AGENT_ROLES))
-
-            # 按优先级排序智能体
-            ordered_agents = []
-            # 先添加已知顺序的智能体
-            for agent_key in agent_display_order.keys():
-                if agent_key in self.agent_results:
-                    ordered_agents.append(agent_key)
-
-            # 再添加其他智能体
-            for agent_key in self.agent_results.keys():
-                if agent_key not in agent_display_order:
-                    ordered_agents.append(agent_key)
-
-            with open(filepath, 'w', encoding='utf-8') as f:
-                # 【修改1】首先写入用户请求信息
-                f.write(f"# 股票分析报告\n\n")
-                f.write(f"**生成时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                if stock_code:
-                    f.write(f"**股票代码**: {stock_code}\n\n")
-
-                # 写入用户原始请求
-                if self.user_request:
-                    f.write("## 用户请求\n\n")
-                    f.write(f"```\n{self.user_request}\n```\n\n")
-
-                f.write("---\n\n")
-
-                # 写入各智能体的最终结果
-                f.write("## 智能体分析结果\n\n")
-                f.write(f"**智能体数量**: {len(self.agent_results)} 个\n\n")
-                f.write("---\n\n")
-
-                for agent_name in ordered_agents:
-                    display_name = agent_display_order.get(agent_name, agent_name)
-                    f.write(f"### {display_name} ({agent_name})\n\n")
-                    f.write(self.agent_results[agent_name])
-                    f.write("\n\n---\n\n")
-
-                # 写入总结
-                f.write(f"## 分析总结\n\n")
-                f.write(f"本次分析共涉及 {len(self.agent_results)} 个智能体，")
-                f.write("每个智能体只保留最终输出结果，避免重复信息堆积。\n")
-                f.write(f"报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}。\n\n")
-
+            filepath = os.path.join(self.output_dir, self._report_filename(stock_code))
+            self._write_report_file(filepath, stock_code)
             self.logger.info(f"分析报告已保存到: {filepath}")
             return filepath
 
@@ -219,14 +363,17 @@ class ReportSaver:
 
 
 # 便捷函数
-def create_final_report_saver(output_dir: str = None) -> ReportSaver:
+def create_final_report_saver(output_dir: str = None, verbose: bool = True,
+                              streaming: bool = False) -> ReportSaver:
     """
     创建只保存最终结果的报告保存器
     
     Args:
         output_dir: 输出目录
+        verbose: 是否在控制台打印每条消息
+        streaming: 是否在每个智能体完成后立即写入报告章节
         
     Returns:
         ReportSaver: 配置好的报告保存器
     """
-    return ReportSaver(output_dir)
\ No newline at end of file
+    return ReportSaver(output_dir, verbose, streaming)
\ No newline at end of file
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+研究记忆模块
+每次运行都从零开始搜索，而 reports/ 目录中已有历史分析，工具结果缓存中也有搜索过的网页。
+本模块在本地 SQLite FTS5 全文索引中按章节收录这些内容，以 research_memory_search 工具提供给智能体，
+用于查找以往的结论（商业模式、治理历史等），不必重新搜索网络：
+- 报告按智能体章节切分，记录股票代码、智能体和生成时间；超时降级的章节不收录
+- 工具结果缓存中的搜索结果按条切分，主题为搜索查询
+- 索引按文件修改时间和缓存写入时间增量更新，每份报告保存后立即收录
+
+中文按二元组切分后写入索引（FTS5 默认分词器不切分中文），查询使用相同的切分并按 BM25 排序
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# AutoGen 0.4+ API
+from autogen_core.tools import BaseTool, FunctionTool
+
+from config import AGENT_NAMES, AGENT_ROLES, get_research_memory_config, get_tool_cache_config
+from report_index import INDEX_VERSION, REPORT_FILENAME_PATTERN, parse_report_sections
+from deadlines import is_degraded
+from tool_output import split_results, unwrap_text
+
+# 工具名称（OpenAI 接口要求只含字母、数字、下划线和连字符）
+MEMORY_TOOL_NAME = "research_memory_search"
+
+_ASCII_WORD = re.compile(r"[A-Za-z0-9]+")
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """切分索引词：英文单词和数字（小写）、中文二元组（单字的中文片段保留单字）"""
+    terms = [word.lower() for word in _ASCII_WORD.findall(text)]
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def split_chunks(content: str, max_chars: int) -> List[str]:
+    """按段落把长章节切分为不超过 max_chars 的片段"""
+    if len(content) <= max_chars:
+        return [content]
+    chunks: List[str] = []
+    current = ""
+    for paragraph in content.split("\n\n"):
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+        while len(current) > max_chars:
+            chunks.append(current[:max_chars])
+            current = current[max_chars:]
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+class ResearchMemory:
+    """研究记忆索引 - SQLite FTS5 持久化，按来源增量更新"""
+
+    def __init__(self, path: str, reports_dir: str, chunk_chars: int = 1500,
+                 tool_cache_path: Optional[str] = None, tools: Optional[List[str]] = None):
+        """
+        初始化索引
+
+        Args:
+            path: 索引数据库文件路径
+            reports_dir: 报告目录
+            chunk_chars: 每个片段的最大字符数
+            tool_cache_path: 工具结果缓存数据库路径，None 表示不收录工具结果
+            tools: 收录的工具名称
+        """
+        self.path = path
+        self.reports_dir = reports_dir
+        self.chunk_chars = chunk_chars
+        self.tool_cache_path = tool_cache_path
+        self.tools = list(tools or [])
+        self.searches = 0
+        self.hits = 0
+        self._reports_scanned = False
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                terms, source UNINDEXED, stock_code UNINDEXED, agent UNINDEXED,
+                topic UNINDEXED, created_at UNINDEXED, content UNINDEXED
+            );"""
+        )
+        # 报告解析规则变化后，已收录的报告按新规则重新收录
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'report_format'").fetchone()
+        if row is None or row[0] != INDEX_VERSION:
+            self._conn.execute("DELETE FROM chunks WHERE source NOT LIKE 'tool:%'")
+            self._conn.execute("DELETE FROM sources WHERE source NOT LIKE 'tool:%'")
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('report_format', ?)", (INDEX_VERSION,))
+        self._conn.commit()
+
+    def _replace_source(self, source: str, mtime: float, size: int, rows: List[tuple]):
+        """删除来源的旧片段并写入新片段（调用方持有锁）"""
+        self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+        self._conn.executemany(
+            "INSERT INTO chunks (terms, source, stock_code, agent, topic, created_at, content) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(" ".join(tokenize(f"{topic}\n{content}")), source, code, agent, topic, created_at, content)
+             for code, agent, topic, created_at, content in rows],
+        )
+        self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, mtime, size))
+
+    def index_report(self, path: str) -> int:
+        """
+        收录一份报告（已收录且未修改时跳过）
+
+        Args:
+            path: 报告文件路径
+
+        Returns:
+            int: 写入的片段数量
+        """
+        filename = os.path.basename(path)
+        match = REPORT_FILENAME_PATTERN.match(filename)
+        if match is None:
+            return 0
+        try:
+            stat = os.stat(path)
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return 0
+        with self._lock:
+            row = self._conn.execute("SELECT mtime, size FROM sources WHERE source = ?", (filename,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return 0
+
+        created_at = datetime.strptime(match.group("timestamp"), "%Y%m%d_%H%M%S").timestamp()
+        roles = dict(zip(AGENT_NAMES, AGENT_ROLES))
+        rows = [(match.group("code"), agent, roles.get(agent, agent), created_at, chunk)
+                for agent, content in parse_report_sections(text).items() if not is_degraded(content)
+                for chunk in split_chunks(content, self.chunk_chars)]
+        with self._lock:
+            self._replace_source(filename, stat.st_mtime, stat.st_size, rows)
+            self._conn.commit()
+        return len(rows)
+
+    def refresh_reports(self) -> int:
+        """
+        扫描报告目录，收录新增或修改过的报告，删除已不存在的报告的片段
+
+        Returns:
+            int: 写入的片段数量
+        """
+        try:
+            filenames = {name for name in os.listdir(self.reports_dir) if REPORT_FILENAME_PATTERN.match(name)}
+        except FileNotFoundError:
+            filenames = set()
+        with self._lock:
+            indexed = {row[0] for row in
+                       self._conn.execute("SELECT source FROM sources WHERE source NOT LIKE 'tool:%'")}
+            for source in indexed - filenames:
+                self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._conn.commit()
+        return sum(self.index_report(os.path.join(self.reports_dir, name)) for name in sorted(filenames))
+
+    def refresh_tool_cache(self) -> int:
+        """
+        收录工具结果缓存中上次更新之后写入的搜索结果
+
+        Returns:
+            int: 写入的片段数量
+        """
+        if not self.tool_cache_path or not self.tools or not os.path.exists(self.tool_cache_path):
+            return 0
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'tool_cache_watermark'").fetchone()
+        watermark = row[0] if row is not None else 0.0
+        try:
+            conn = sqlite3.connect(f"file:{self.tool_cache_path}?mode=ro", uri=True)
+            try:
+                entries = conn.execute(
+                    "SELECT key, tool, arguments, value, created_at FROM tool_cache WHERE created_at > ? "
+                    f"AND tool IN ({','.join('?' * len(self.tools))}) ORDER BY created_at",
+                    (watermark, *self.tools),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return 0
+        if not entries:
+            return 0
+
+        written = 0
+        with self._lock:
+            for key, tool, arguments, value, created_at in entries:
+                _, blocks = split_results(unwrap_text(value))
+                rows = [("", f"web:{tool}", arguments, created_at, chunk)
+                        for block in blocks
+                        for chunk in split_chunks("\n".join(block), self.chunk_chars)]
+                self._replace_source(f"tool:{key}", created_at, len(value), rows)
+                written += len(rows)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('tool_cache_watermark', ?)", (entries[-1][4],))
+            self._conn.commit()
+        return written
+
+    def refresh(self) -> int:
+        """增量更新：报告目录每个进程扫描一次（之后由 index_report 逐份收录），工具结果每次检查"""
+        written = 0
+        if not self._reports_scanned:
+            written += self.refresh_reports()
+            self._reports_scanned = True
+        return written + self.refresh_tool_cache()
+
+    def search(self, query: str, stock_code: str = "", agent: str = "", limit: int = 5,
+               max_age_days: float = 0) -> List[Dict[str, Any]]:
+        """
+        按关键词检索片段
+
+        Args:
+            query: 查询内容
+            stock_code: 只返回该股票的报告片段（搜索结果片段不限股票），空字符串表示不限
+            agent: 只返回该智能体的章节，空字符串表示不限
+            limit: 最多返回的片段数
+            max_age_days: 只返回该天数内的片段，0 表示不限
+
+        Returns:
+            List[Dict[str, Any]]: 片段列表，按相关性排序
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        conditions, params = ["chunks MATCH ?"], [" OR ".join(f'"{term}"' for term in terms)]
+        if stock_code:
+            conditions.append("(stock_code = ? OR stock_code = '')")
+            params.append(stock_code)
+        if agent:
+            conditions.append("agent = ?")
+            params.append(agent)
+        if max_age_days > 0:
+            conditions.append("created_at >= ?")
+            params.append(time.time() - max_age_days * 86400)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stock_code, agent, topic, created_at, content FROM chunks "
+                f"WHERE {' AND '.join(conditions)} ORDER BY bm25(chunks) LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+            self.searches += 1
+            self.hits += bool(rows)
+        return [{"stock_code": code, "agent": agent_name, "topic": topic, "created_at": created_at,
+                 "content": content} for code, agent_name, topic, created_at, content in rows]
+
+    def size(self) -> int:
+        """已收录的片段数量"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def print_stats(self):
+        """打印检索统计"""
+        if self.searches:
+            print(f"\n🧠 研究记忆: {self.searches} 次检索，{self.hits} 次命中，已收录 {self.size()} 个片段")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+# 进程级索引实例
+_memory: Optional[ResearchMemory] = None
+
+
+def _project_path(path: str) -> str:
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def get_research_memory() -> Optional[ResearchMemory]:
+    """
+    获取进程级研究记忆索引
+
+    Returns:
+        Optional[ResearchMemory]: 索引实例，配置中未启用时返回 None
+    """
+    global _memory
+    memory_config = get_research_memory_config()
+    if not memory_config.get("enabled", False):
+        return None
+    if _memory is None:
+        cache_config = get_tool_cache_config()
+        _memory = ResearchMemory(
+            path=_project_path(memory_config.get("path", ".cache/research_memory.sqlite")),
+            reports_dir=_project_path(memory_config.get("reports_dir", "reports")),
+            chunk_chars=memory_config.get("chunk_chars", 1500),
+            tool_cache_path=_project_path(cache_config["path"]) if memory_config.get("index_tool_cache", True)
+            else None,
+            tools=memory_config.get("tools", []),
+        )
+    return _memory
+
+
+def format_results(results: List[Dict[str, Any]], max_chars: int = 800) -> str:
+    """把检索结果格式化为工具返回的文本"""
+    if not results:
+        return "研究记忆中没有相关内容，请通过其他途径获取信息。"
+    parts = []
+    for result in results:
+        date = datetime.fromtimestamp(result["created_at"]).strftime("%Y-%m-%d")
+        if result["agent"].startswith("web:"):
+            label = f"[{date} 搜索结果] 查询: {result['topic']}"
+        else:
+            label = f"[{date} {result['stock_code']} 历史报告 · {result['topic']}]"
+        content = result["content"]
+        if max_chars and len(content) > max_chars:
+            content = content[:max_chars].rstrip() + " …"
+        parts.append(f"{label}\n{content}")
+    return "\n\n---\n\n".join(parts)
+
+
+async def search_research_memory(query: str, stock_code: str = "", agent: str = "") -> str:
+    """
+    检索以往分析报告和搜索结果中的相关内容
+
+    Args:
+        query: 要查找的内容，如 "商业模式"、"管理层 治理 历史"
+        stock_code: 股票代码，只看该股票的历史报告
+        agent: 只看某个智能体的章节，如 company_analyst
+
+    Returns:
+        str: 相关片段（标注日期和来源），没有时返回提示
+    """
+    memory = get_research_memory()
+    if memory is None:
+        return "研究记忆未启用。"
+    memory_config = get_research_memory_config()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, memory.refresh)
+    results = await loop.run_in_executor(
+        None, lambda: memory.search(query, stock_code.strip().upper(), agent.strip(),
+                                    limit=memory_config.get("max_results", 5),
+                                    max_age_days=memory_config.get("max_age_days", 0))
+    )
+    return format_results(results, memory_config.get("result_chars", 800))
+
+
+def memory_tools(agent_name: str) -> List[BaseTool]:
+    """按配置为智能体提供研究记忆检索工具"""
+    memory_config = get_research_memory_config()
+    if not memory_config.get("enabled", False) or agent_name not in memory_config.get("agents", []):
+        return []
+    return [FunctionTool(
+        search_research_memory,
+        name=MEMORY_TOOL_NAME,
+        description="检索以往分析报告（按智能体章节）和搜索过的网页中的相关结论，如商业模式、治理历史、行业格局。"
+                    "结果标注日期，时效性强的信息（股价、新闻）仍需核实。先查研究记忆，没有再搜索网络。",
+    )]
+
+
+async def index_new_report(report_path: str):
+    """报告保存后立即收录到研究记忆（在线程池中执行，未启用或没有报告时忽略）"""
+    memory = get_research_memory()
+    if memory is None or not report_path:
+        return
+    try:
+        count = await asyncio.get_running_loop().run_in_executor(None, memory.index_report, report_path)
+    except sqlite3.Error as e:
+        print(f"⚠️ 收录研究记忆失败: {e}")
+        return
+    if count:
+        print(f"🧠 已收录到研究记忆: {count} 个片段")
+
+
+def print_research_memory_stats():
+    """打印进程级研究记忆的检索统计（未使用时不输出）"""
+    if _memory is not None:
+        _memory.print_stats()
+
+
+def close_research_memory():
+    """关闭进程级研究记忆"""
+    global _memory
+    if _memory is not None:
+        _memory.close()
+        _memory = None
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分析执行模块
+单只股票分析的核心执行路径 - 供命令行单股分析和批量分析共用
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient
+
+from config import get_model_config, get_report_config, get_checkpoint_config
+from agent_factory import create_full_analysis_team
+from workflow import create_analysis_workflow
+from task import get_stock_analysis_task
+from report_saver import ReportSaver
+from checkpoint import RunCheckpoint, build_resume_messages, get_checkpoint_path, track_checkpoint
+from profiler import start_profiling, stop_profiling
+from report_index import plan_report_reuse, plan_selective_rerun
+from deadlines import is_degraded
+from budget import start_budget, stop_budget
+from tool_output import start_tool_output, stop_tool_output
+from research_memory import index_new_report
+from event_log import open_event_log, track_events
+from output_queue import open_output_queue
+from single_flight import get_single_flight
+
+
+async def reset_agents(agents: List[BaseChatAgent]):
+    """清空智能体的会话状态，使同一套团队可以在下一次分析中复用"""
+    for agent in agents:
+        await agent.on_reset(CancellationToken())
+
+
+async def _run_workflow(stock_code: str, mode: str, model_client: Optional[ChatCompletionClient],
+                        verbose: bool, resume: bool,
+                        agents: Optional[List[BaseChatAgent]],
+                        reused_sections: Optional[Dict[str, str]] = None,
+                        peers: Optional[List[str]] = None
+                        ) -> Tuple[ReportSaver, Dict[str, str], int, Dict[str, Any], str]:
+    """创建团队和工作流并处理消息流，返回报告保存器、智能体结果、未重新运行的智能体数量、预算用量和事件日志路径
+
+    reused_sections 为近期报告中仍在有效期内的章节（或同业比较模式下同组共享的行业与市场章节），
+    没有检查点进度时这些智能体不再运行。运行预算只分配给本次实际运行的智能体。
+    """
+    task_description = get_stock_analysis_task(stock_code, peers)
+
+    checkpoint = None
+    if get_checkpoint_config().get("enabled", False):
+        checkpoint_path = get_checkpoint_path(stock_code)
+        if resume:
+            checkpoint = RunCheckpoint.load(checkpoint_path)
+            if checkpoint is None:
+                print(f"ℹ️ {stock_code} 没有可用的检查点，从头开始分析")
+            else:
+                # 沿用中断前的任务描述，保证剩余智能体看到的上下文一致
+                task_description = checkpoint.task
+        if checkpoint is None:
+            checkpoint = RunCheckpoint(checkpoint_path, stock_code, mode, task_description)
+    completed = dict(checkpoint.completed) if checkpoint is not None else {}
+    if reused_sections and not completed:
+        completed = dict(reused_sections)
+
+    budget_token = None
+    if completed and checkpoint is not None and not checkpoint.remaining:
+        # 所有智能体都已完成（例如中断发生在保存报告时），直接回放检查点
+        stream = checkpoint.replay()
+    else:
+        if agents is None:
+            agents = await create_full_analysis_team(get_model_config(), model_client=model_client)
+        else:
+            await reset_agents(agents)
+        team = await create_analysis_workflow(agents, mode=mode, completed=completed)
+        budget_token = start_budget([agent.name for agent in agents if agent.name not in completed])
+        # 续跑或复用章节时，已有智能体的输出随任务一起广播给剩余智能体（同时写入新检查点）
+        task = build_resume_messages(task_description, completed) if completed else task_description
+        stream = team.run_stream(task=task)
+    if checkpoint is not None:
+        stream = track_checkpoint(stream, checkpoint)
+
+    # 显示消息经有界输出队列写入控制台或 socket，慢终端不会阻塞事件循环
+    output = open_output_queue() if verbose else None
+    report_saver = ReportSaver(verbose=verbose, streaming=get_report_config().get("streaming", False),
+                               output=output)
+    report_saver.set_user_request(task_description)
+
+    event_log = open_event_log(report_saver.output_dir, stock_code, report_saver.timestamp)
+    if event_log is not None:
+        stream = track_events(stream, event_log, {"stock_code": stock_code, "mode": mode,
+                                                  "skipped_agents": list(completed)})
+    try:
+        agent_results = await report_saver.process_stream(stream, stock_code)
+    finally:
+        budget = stop_budget(budget_token)
+        if event_log is not None:
+            await event_log.close()
+        if output is not None:
+            await output.close()
+
+    # 成功完成后删除检查点，中断时保留以便 --resume
+    if checkpoint is not None and report_saver.error is None and report_saver.report_path:
+        checkpoint.clear()
+
+    return report_saver, agent_results, len(completed), budget, event_log.path if event_log is not None else ""
+
+
+def _profile_base_path(report_saver: ReportSaver, stock_code: str) -> str:
+    """性能分析文件与报告同名，没有报告时按股票代码和时间戳命名"""
+    if report_saver.report_path:
+        return os.path.splitext(report_saver.report_path)[0]
+    return os.path.join(report_saver.output_dir, f"性能分析_{stock_code}_{report_saver.timestamp}")
+
+
+async def analyze_stock(stock_code: str, mode: str = "sequential",
+                        model_client: Optional[ChatCompletionClient] = None,
+                        verbose: bool = True, resume: bool = False,
+                        agents: Optional[List[BaseChatAgent]] = None,
+                        rerun_agents: Optional[List[str]] = None,
+                        base_report: Optional[str] = None,
+                        peer_group: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    执行一次完整的股票分析
+
+    默认每次调用都会创建独立的团队和工作流（智能体带有会话状态，不能在并发运行之间共享），
+    模型客户端默认来自进程级注册表，MCP会话由进程级会话池共享。
+    传入 agents 时复用这套团队（运行前重置会话状态），调用方需保证同一时间只有一次运行使用它。
+    启用请求合并时，相同（股票代码、任务、日期、模式）的并发调用共享一次执行和同一份报告。
+
+    Args:
+        stock_code: 股票代码
+        mode: 工作流模式 (sequential / parallel)
+        model_client: 指定的模型客户端，None 表示使用注册表中的共享客户端
+        verbose: 是否在控制台打印每条消息
+        resume: 是否从上次中断的检查点继续（没有检查点时从头开始）
+        agents: 预先创建的智能体团队，None 表示新建
+        rerun_agents: 只重新运行这些智能体，其余章节从 base_report 或最近的报告/检查点加载
+        base_report: rerun_agents 使用的基础报告路径，None 表示自动选择
+        peer_group: 同业比较模式下的同组信息 {"stock_codes": [...], "sections": {智能体: 共享章节}}，
+            共享章节的智能体不再运行，None 表示单独分析
+
+    Returns:
+        Dict[str, Any]: 分析结果
+            - stock_code: 股票代码
+            - agent_results: 智能体名称到最终输出的映射
+            - report_path: 报告文件路径，未保存时为空字符串
+            - error: 消息流处理中断时的错误信息，正常完成为 None
+            - elapsed: 耗时（秒）
+            - resumed_agents: 从检查点或近期报告恢复、未重新运行的智能体数量
+            - profile: 按智能体的性能分析数据，未启用时为空字典
+            - shared: 是否复用了另一个并发调用的执行结果
+            - reused_from: 按时效策略复用的历史报告路径，未复用时为空字符串
+            - degraded_agents: 超过期限、章节被降级的智能体
+            - budget: 运行预算的上限、用量和各智能体的额度，未启用时为空字典
+            - event_log: 结构化事件日志路径，未启用时为空字符串
+            - first_output_seconds: 开始处理消息流到第一个智能体输出的秒数，没有输出时为 None
+            - tool_output: 工具结果后处理前后的 token 数和节省的 token 数，未启用时为空字典
+    """
+    start_time = time.perf_counter()
+    group = get_single_flight("runs")
+    if group is None:
+        result = await _analyze_stock(stock_code, mode, model_client, verbose, resume, agents,
+                                      rerun_agents, base_report, peer_group)
+        return {**result, "elapsed": time.perf_counter() - start_time, "shared": False}
+
+    # 相同股票、任务、日期和模式的并发分析共享一次执行，后来者直接得到同一份报告
+    peers = peer_group["stock_codes"] if peer_group else None
+    key = "\n".join([stock_code, mode, str(resume), datetime.now().strftime("%Y-%m-%d"),
+                      ",".join(rerun_agents or []), base_report or "", get_stock_analysis_task(stock_code, peers),
+                      *(peer_group["sections"].values() if peer_group else [])])
+    shared = key in group
+    if shared:
+        print(f"🔗 {stock_code} 已有相同的分析正在进行，等待其结果")
+    result = await group.do(
+        key, lambda: _analyze_stock(stock_code, mode, model_client, verbose, resume, agents,
+                                    rerun_agents, base_report, peer_group)
+    )
+    return {**result, "elapsed": time.perf_counter() - start_time, "shared": shared}
+
+
+async def _analyze_stock(stock_code: str, mode: str, model_client: Optional[ChatCompletionClient],
+                         verbose: bool, resume: bool,
+                         agents: Optional[List[BaseChatAgent]], rerun_agents: Optional[List[str]],
+                         base_report: Optional[str], peer_group: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """执行一次分析（不合并），返回结果中不含 elapsed 和 shared"""
+    if peer_group is not None:
+        # 同业比较模式以同组共享的章节为准，不复用历史报告
+        reuse_plan = None
+    elif rerun_agents:
+        reuse_plan = plan_selective_rerun(stock_code, rerun_agents, base_report)
+    else:
+        # 续跑时以检查点为准，不复用历史报告
+        reuse_plan = None if resume else plan_report_reuse(stock_code)
+    reused_sections = dict(peer_group["sections"]) if peer_group is not None else None
+    if reuse_plan is not None:
+        if not reuse_plan["rerun"]:
+            print(f"♻️ {stock_code} 在 {reuse_plan['age_hours']:.1f} 小时前已分析，直接复用报告: {reuse_plan['path']}")
+            return {
+                "stock_code": stock_code,
+                "agent_results": reuse_plan["sections"],
+                "report_path": reuse_plan["path"],
+                "error": None,
+                "resumed_agents": len(reuse_plan["sections"]),
+                "profile": {},
+                "reused_from": reuse_plan["path"],
+                "degraded_agents": [],
+                "budget": {},
+                "event_log": "",
+                "first_output_seconds": None,
+                "tool_output": {},
+            }
+        reused_sections = reuse_plan["sections"]
+        print(f"♻️ {stock_code} 沿用 {reuse_plan['age_hours']:.1f} 小时前的 {len(reused_sections)} 个章节，"
+              f"重新运行: {', '.join(reuse_plan['rerun'])}")
+
+    profile_token = start_profiling(stock_code, mode)
+    tool_output_token = start_tool_output()
+    try:
+        report_saver, agent_results, resumed_agents, budget, event_log = await _run_workflow(
+            stock_code, mode, model_client, verbose, resume, agents, reused_sections,
+            peer_group["stock_codes"] if peer_group is not None else None
+        )
+    except BaseException:
+        stop_tool_output(tool_output_token)
+        stop_profiling(profile_token)
+        raise
+    tool_output = stop_tool_output(tool_output_token)
+    profile = stop_profiling(profile_token, _profile_base_path(report_saver, stock_code))
+    await index_new_report(report_saver.report_path)
+
+    return {
+        "stock_code": stock_code,
+        "agent_results": agent_results,
+        "report_path": report_saver.report_path,
+        "error": str(report_saver.error) if report_saver.error is not None else None,
+        "resumed_agents": resumed_agents,
+        "profile": profile,
+        "reused_from": reuse_plan["path"] if reuse_plan is not None else "",
+        "degraded_agents": [name for name, content in agent_results.items() if is_degraded(content)],
+        "budget": budget,
+        "event_log": event_log,
+        "first_output_seconds": report_saver.first_output_seconds,
+        "tool_output": tool_output,
+    }
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+常驻服务模块
+进程常驻并通过本地 HTTP（TCP 或 Unix socket）接收分析作业 - 模型客户端、MCP会话和智能体团队在作业之间保持热状态
+
+接口（请求和响应均为 JSON）:
+    POST /jobs            提交作业 {"stock_code": "600519", "mode": "parallel", "resume": false,
+                                    "agents": ["news_analyst", "strategy_advisor"]}
+    GET  /jobs            列出作业
+    GET  /jobs/{job_id}   查询作业状态、报告路径和错误信息
+    GET  /metrics         队列深度、排队耗时与运行耗时统计
+    GET  /health          健康检查
+"""
+
+import asyncio
+import json
+import os
+import signal
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from autogen_agentchat.agents import BaseChatAgent
+
+from config import get_model_config, get_service_config, get_workflow_config
+from agent_factory import create_full_analysis_team, get_missing_tool_servers
+from batch_runner import _percentile
+from mcp_pool import get_mcp_pool
+from runner import analyze_stock
+from workflow import REQUIRED_AGENTS, WORKFLOW_MODES
+
+# 作业状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# 请求体大小上限
+MAX_BODY_BYTES = 64 * 1024
+
+# 参与延迟统计的最近作业数
+LATENCY_WINDOW = 1000
+
+_HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                 405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+                 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    """带状态码的请求错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ResearchService:
+    """常驻分析服务 - 有界作业队列 + 固定数量的工作协程，每个工作协程复用一套智能体团队"""
+
+    def __init__(self, workers: int = 2, queue_size: int = 100, default_mode: str = "sequential",
+                 job_history: int = 1000):
+        """
+        初始化服务
+
+        Args:
+            workers: 工作协程数，即同时运行的最大作业数
+            queue_size: 排队作业上限
+            default_mode: 提交时未指定 mode 的作业使用的工作流模式
+            job_history: 内存中保留的已结束作业数
+        """
+        if workers < 1:
+            raise ValueError(f"工作协程数必须大于0: {workers}")
+        self.workers = workers
+        self.default_mode = default_mode
+        self.job_history = job_history
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(0, queue_size))
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.counters = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0}
+        self._running = 0
+        self._queue_waits: deque = deque(maxlen=LATENCY_WINDOW)
+        self._run_times: deque = deque(maxlen=LATENCY_WINDOW)
+        self._worker_tasks: List[asyncio.Task] = []
+        self._start_time = time.perf_counter()
+
+    # ==================== 作业管理 ====================
+
+    def submit(self, stock_code: str, mode: Optional[str] = None, resume: bool = False,
+               agents: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        提交作业
+
+        Args:
+            stock_code: 股票代码
+            mode: 工作流模式，None 表示使用默认模式
+            resume: 是否从检查点继续
+            agents: 只重新运行这些智能体，None 表示完整分析
+
+        Returns:
+            Dict[str, Any]: 作业记录
+
+        Raises:
+            HTTPError: 参数无效 (400) 或队列已满 (429)
+        """
+        stock_code = str(stock_code or "").strip().upper()
+        if not stock_code:
+            raise HTTPError(400, "缺少 stock_code")
+        mode = mode or self.default_mode
+        if mode not in WORKFLOW_MODES:
+            raise HTTPError(400, f"未知的工作流模式: {mode}，可选: {', '.join(WORKFLOW_MODES)}")
+        if agents is not None:
+            if not isinstance(agents, list) or not agents:
+                raise HTTPError(400, "agents 必须是非空的智能体名称列表")
+            unknown = [name for name in agents if name not in REQUIRED_AGENTS]
+            if unknown:
+                raise HTTPError(400, f"未知的智能体: {', '.join(map(str, unknown))}")
+            if resume:
+                raise HTTPError(400, "agents 不能与 resume 同时使用")
+
+        job = {
+            "job_id": uuid.uuid4().hex[:12],
+            "stock_code": stock_code,
+            "mode": mode,
+            "resume": bool(resume),
+            "agents_to_run": agents,
+            "status": JOB_QUEUED,
+            "submitted_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_wait": None,
+            "elapsed": None,
+            "report_path": "",
+            "agents": 0,
+            "resumed_agents": 0,
+            "profile_path": "",
+            "shared": False,
+            "reused_from": "",
+            "degraded_agents": [],
+            "budget": {},
+            "tool_output": {},
+            "error": None,
+            "_submitted": time.perf_counter(),
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise HTTPError(429, f"作业队列已满 ({self.queue.maxsize})")
+        self.jobs[job["job_id"]] = job
+        self.counters["submitted"] += 1
+        self._evict_finished_jobs()
+        print(f"📥 作业 {job['job_id']} 已排队: {stock_code} ({mode})，队列深度 {self.queue.qsize()}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """按ID查询作业"""
+        return self.jobs.get(job_id)
+
+    def _evict_finished_jobs(self):
+        """已结束作业超过保留数量时丢弃最早的记录"""
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job["status"] in (JOB_SUCCEEDED, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.job_history)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        """去掉内部字段后的作业记录"""
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    # ==================== 工作协程 ====================
+
+    @staticmethod
+    def _check_team(team: List[BaseChatAgent]) -> Optional[str]:
+        """
+        检查团队是否完整：必需智能体齐全，且创建时所有MCP服务器的工具都已获取
+
+        Returns:
+            Optional[str]: 不完整的原因，完整时返回 None
+        """
+        names = {agent.name for agent in team}
+        missing_agents = [name for name in REQUIRED_AGENTS if name not in names]
+        if missing_agents:
+            return f"缺少智能体: {', '.join(missing_agents)}"
+        missing_tools = []
+        for agent in team:
+            servers = get_missing_tool_servers(agent)
+            if servers:
+                missing_tools.append(f"{agent.name}({', '.join(servers)})")
+        if missing_tools:
+            return f"工具获取失败: {'; '.join(missing_tools)}"
+        return None
+
+    async def _worker(self, index: int):
+        """从队列取作业并运行，团队在首个作业时创建，之后复用；创建不完整或作业失败后重新创建"""
+        team: Optional[List[BaseChatAgent]] = None
+        while True:
+            job = await self.queue.get()
+            try:
+                if team is None:
+                    team = await create_full_analysis_team(get_model_config())
+                    problem = self._check_team(team)
+                    if problem is not None:
+                        # 一次性的创建失败不能让之后的作业都使用不完整的团队
+                        team = None
+                        raise RuntimeError(f"工作协程 {index} 团队不完整，下一个作业重新创建: {problem}")
+                    print(f"🔥 工作协程 {index} 团队已就绪: {len(team)} 个智能体")
+                await self._run_job(job, team)
+                if job["status"] == JOB_FAILED:
+                    team = None
+            except asyncio.CancelledError:
+                self._finish_job(job, error="服务关闭，作业被中断")
+                raise
+            except Exception as e:
+                team = None
+                self._finish_job(job, error=f"{type(e).__name__}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job: Dict[str, Any], team: List[BaseChatAgent]):
+        """运行单个作业并记录结果"""
+        job["status"] = JOB_RUNNING
+        job["started_at"] = _now()
+        job["queue_wait"] = round(time.perf_counter() - job["_submitted"], 3)
+        self._queue_waits.append(job["queue_wait"])
+        job["_started"] = time.perf_counter()
+        self._running += 1
+        print(f"🚀 作业 {job['job_id']} 开始: {job['stock_code']} (排队 {job['queue_wait']:.1f}秒)")
+        try:
+            result = await analyze_stock(job["stock_code"], mode=job["mode"], verbose=False,
+                                         resume=job["resume"], agents=team,
+                                         rerun_agents=job["agents_to_run"])
+        finally:
+            self._running -= 1
+
+        job["report_path"] = result["report_path"]
+        job["agents"] = len(result["agent_results"])
+        job["resumed_agents"] = result["resumed_agents"]
+        job["shared"] = result["shared"]
+        job["reused_from"] = result["reused_from"]
+        job["degraded_agents"] = result["degraded_agents"]
+        job["budget"] = result["budget"]
+        job["tool_output"] = result["tool_output"]
+        if result["profile"]:
+            job["profile_path"] = next(iter(result["profile"]["files"]), "")
+        error = result["error"]
+        if error is None and not result["agent_results"]:
+            error = "未收到任何分析结果"
+        self._finish_job(job, error=error)
+
+    def _finish_job(self, job: Dict[str, Any], error: Optional[str] = None):
+        """记录作业结束状态与耗时"""
+        job["finished_at"] = _now()
+        if "_started" in job:
+            job["elapsed"] = round(time.perf_counter() - job["_started"], 3)
+            self._run_times.append(job["elapsed"])
+        job["error"] = error
+        if error is None:
+            job["status"] = JOB_SUCCEEDED
+            self.counters["succeeded"] += 1
+            print(f"✅ 作业 {job['job_id']} 完成: {job['stock_code']} ({job['elapsed']:.1f}秒)")
+        else:
+            job["status"] = JOB_FAILED
+            self.counters["failed"] += 1
+            print(f"❌ 作业 {job['job_id']} 失败: {job['stock_code']}: {error}")
+
+    def start_workers(self):
+        """启动工作协程"""
+        for index in range(1, self.workers + 1):
+            self._worker_tasks.append(asyncio.create_task(self._worker(index)))
+
+    async def stop_workers(self):
+        """取消工作协程；运行中的作业保留检查点，可通过 resume 继续"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+
+    # ==================== 指标 ====================
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """队列深度、作业计数与延迟统计"""
+        def latency(values) -> Dict[str, float]:
+            values = list(values)
+            return {
+                "mean": round(sum(values) / len(values), 3) if values else 0.0,
+                "p50": round(_percentile(values, 50), 3),
+                "p95": round(_percentile(values, 95), 3),
+                "max": round(max(values), 3) if values else 0.0,
+            }
+
+        return {
+            "uptime": round(time.perf_counter() - self._start_time, 1),
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "running": self._running,
+            **self.counters,
+            "queue_wait": latency(self._queue_waits),
+            "run_time": latency(self._run_times),
+            "mcp_servers": get_mcp_pool().get_status(),
+        }
+
+    # ==================== HTTP 接口 ====================
+
+    async def handle_request(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        """
+        路由请求
+
+        Args:
+            method: HTTP 方法
+            path: 请求路径（不含查询参数）
+            body: 请求体
+
+        Returns:
+            Tuple[int, Any]: 状态码和响应对象
+        """
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"]:
+            return 200, {"status": "ok"}
+        if parts == ["metrics"]:
+            return 200, self.get_metrics()
+        if parts == ["jobs"]:
+            if method == "POST":
+                try:
+                    payload = json.loads(body.decode("utf-8") or "{}")
+                except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                    raise HTTPError(400, f"请求体不是有效的JSON: {e}")
+                if not isinstance(payload, dict):
+                    raise HTTPError(400, "请求体必须是JSON对象")
+                job = self.submit(payload.get("stock_code"), payload.get("mode"), payload.get("resume", False),
+                                  payload.get("agents"))
+                return 202, self.public_job(job)
+            if method == "GET":
+                return 200, {"jobs": [self.public_job(job) for job in self.jobs.values()]}
+            raise HTTPError(405, f"不支持的方法: {method}")
+        if len(parts) == 2 and parts[0] == "jobs":
+            if method != "GET":
+                raise HTTPError(405, f"不支持的方法: {method}")
+            job = self.get_job(parts[1])
+            if job is None:
+                raise HTTPError(404, f"作业不存在: {parts[1]}")
+            return 200, self.public_job(job)
+        raise HTTPError(404, f"路径不存在: {path}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个 HTTP/1.1 连接（每个连接一个请求）"""
+        try:
+            try:
+                request_line = (await reader.readline()).decode("latin-1").strip()
+                if not request_line:
+                    return
+                method, target, _ = request_line.split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0") or 0)
+                if length > MAX_BODY_BYTES:
+                    raise HTTPError(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.handle_request(method.upper(), target.split("?", 1)[0], body)
+            except HTTPError as e:
+                status, payload = e.status, {"error": str(e)}
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                status, payload = 400, {"error": f"无效的HTTP请求: {e}"}
+            except Exception as e:
+                status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+
+            data = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, socket_path: str = ""):
+        """
+        启动服务并运行到收到 SIGINT / SIGTERM
+
+        Args:
+            host: 监听地址
+            port: 监听端口
+            socket_path: 非空时监听该 Unix socket，忽略 host/port
+        """
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+            address = f"unix:{socket_path}"
+        else:
+            server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+            address = f"http://{host}:{port}"
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        self.start_workers()
+        print(f"🛰️ 研究服务已启动: {address} (工作协程 {self.workers}, 队列上限 {self.queue.maxsize or '无'})")
+        print(f"   提交作业: curl -X POST {address if not socket_path else 'http://localhost'}/jobs "
+              f"-d '{{\"stock_code\": \"600519\"}}'" + (f" --unix-socket {socket_path}" if socket_path else ""))
+        try:
+            await stop_event.wait()
+        finally:
+            print("\n🛑 正在关闭研究服务...")
+            server.close()
+            await server.wait_closed()
+            await self.stop_workers()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+async def run_service(host: Optional[str] = None, port: Optional[int] = None,
+                      socket_path: Optional[str] = None, workers: Optional[int] = None,
+                      mode: Optional[str] = None) -> ResearchService:
+    """
+    按配置启动常驻服务，参数为 None 时使用 SERVICE_CONFIG 中的值
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        socket_path: Unix socket 路径
+        workers: 工作协程数
+        mode: 默认工作流模式
+
+    Returns:
+        ResearchService: 已停止的服务实例
+    """
+    config = get_service_config()
+    service = ResearchService(
+        workers=workers if workers is not None else config.get("workers", 2),
+        queue_size=config.get("queue_size", 100),
+        default_mode=mode or get_workflow_config()["mode"],
+        job_history=config.get("job_history", 1000),
+    )
+    await service.serve(
+        host=host or config.get("host", "127.0.0.1"),
+        port=port if port is not None else config.get("port", 8765),
+        socket_path=socket_path if socket_path is not None else config.get("socket", ""),
+    )
+    return service
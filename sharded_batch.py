@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分片批量分析模块
+单个事件循环只能使用一个 CPU 核心：大体量工具结果的 JSON 解析、ReportSaver 的 Markdown 生成和 autogen 的消息处理
+都在同一个核心上执行。数千只股票的批量分析按分片分配给多个工作进程：
+- 每个工作进程有自己的事件循环、智能体团队、模型客户端和MCP会话池，分片内部仍由 BatchRunner 并发执行
+- 协调进程按顺序派发分片，工作进程空闲时领取下一个分片；工作进程崩溃或分片异常时重建进程并重试该分片
+- 全部分片完成后合并结果，生成与 BatchRunner 相同格式的汇总，另附各工作进程的 CPU 时间、内存峰值等指标
+
+限流额度按进程数平分；请求合并只在进程内生效，工具结果缓存和研究记忆通过 SQLite 文件在进程之间共享
+"""
+
+import asyncio
+import contextlib
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from autogen_core.models import ChatCompletionClient
+
+from config import PROJECT_CONFIG, get_batch_config
+from batch_runner import BatchRunner
+
+# 自动划分时每个工作进程的分片数：分片越多负载越均衡，重试的代价越小
+SHARDS_PER_PROCESS = 4
+
+
+def split_shards(stock_codes: List[str], shard_size: int) -> List[List[str]]:
+    """按顺序把股票代码划分为不超过 shard_size 只的分片"""
+    return [stock_codes[i:i + shard_size] for i in range(0, len(stock_codes), shard_size)]
+
+
+def _apply_config(snapshot: Dict[str, Any], processes: int, split_rate_limits: bool):
+    """在工作进程中恢复协调进程的配置（含命令行覆盖），并按进程数平分限流额度"""
+    for key, value in snapshot.items():
+        target = PROJECT_CONFIG.get(key)
+        # 原地更新：其他模块导入的配置对象（如 MCP_SERVERS_CONFIG）保持同一个引用
+        if isinstance(target, dict) and isinstance(value, dict):
+            target.clear()
+            target.update(value)
+        elif isinstance(target, list) and isinstance(value, list):
+            target[:] = value
+        else:
+            PROJECT_CONFIG[key] = value
+    if not split_rate_limits or processes <= 1:
+        return
+    for limits in PROJECT_CONFIG["rate_limit"].get("limits", {}).values():
+        for key in ("requests_per_minute", "tokens_per_minute"):
+            if limits.get(key):
+                limits[key] = max(1, limits[key] // processes)
+        for key in ("initial_concurrency", "max_concurrency"):
+            if limits.get(key):
+                limits[key] = max(limits.get("min_concurrency", 1), limits[key] // processes)
+
+
+def _max_rss_mb() -> float:
+    """当前进程的内存峰值（MB），不支持的平台返回 0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def _run_shard_async(stock_codes: List[str], options: Dict[str, Any],
+                           client_factory: Optional[Callable[[], ChatCompletionClient]]) -> List[Dict[str, Any]]:
+    """在工作进程的事件循环中运行一个分片，结束时关闭本进程的模型客户端和MCP会话"""
+    from client_registry import close_model_clients
+    from mcp_pool import shutdown_mcp_pool
+    from research_memory import close_research_memory
+
+    model_client = client_factory() if client_factory is not None else None
+    try:
+        runner = BatchRunner(model_client=model_client, **options)
+        await runner.run(stock_codes, save=False)
+        return runner.results
+    finally:
+        if model_client is not None:
+            await model_client.close()
+        await close_model_clients()
+        await shutdown_mcp_pool()
+        close_research_memory()
+
+
+def _run_shard(shard_index: int, stock_codes: List[str], options: Dict[str, Any],
+               config_snapshot: Dict[str, Any], processes: int, split_rate_limits: bool,
+               client_factory: Optional[Callable[[], ChatCompletionClient]], log_path: str) -> Dict[str, Any]:
+    """
+    工作进程入口：运行一个分片
+
+    Returns:
+        Dict[str, Any]: 分片结果和本进程的资源指标
+    """
+    _apply_config(config_snapshot, processes, split_rate_limits)
+    with contextlib.ExitStack() as stack:
+        if log_path:
+            log_file = stack.enter_context(open(log_path, "a", encoding="utf-8", buffering=1))
+            stack.enter_context(contextlib.redirect_stdout(log_file))
+            stack.enter_context(contextlib.redirect_stderr(log_file))
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        results = asyncio.run(_run_shard_async(stock_codes, options, client_factory))
+    return {
+        "shard": shard_index,
+        "pid": os.getpid(),
+        "results": results,
+        "wall_time": time.perf_counter() - start_time,
+        "cpu_seconds": time.process_time() - start_cpu,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+class ShardedBatchRunner:
+    """分片批量执行器 - 协调进程派发分片、重试失败的分片并合并结果"""
+
+    def __init__(self, processes: int, concurrency: int = 4, mode: str = "sequential",
+                 resume: bool = False, rerun_agents: Optional[List[str]] = None,
+                 shard_size: int = 0, shard_retries: int = 2, split_rate_limits: bool = True,
+                 worker_log_dir: str = "", output_dir: Optional[str] = None,
+                 client_factory: Optional[Callable[[], ChatCompletionClient]] = None):
+        """
+        初始化分片执行器
+
+        Args:
+            processes: 工作进程数
+            concurrency: 每个工作进程内同时运行的最大分析数
+            mode: 工作流模式 (sequential / parallel)
+            resume: 是否从各股票上次中断的检查点继续
+            rerun_agents: 只重新运行这些智能体
+            shard_size: 每个分片的股票数，0 表示自动划分
+            shard_retries: 分片失败后的重试次数
+            split_rate_limits: 是否按进程数平分限流额度
+            worker_log_dir: 工作进程输出的日志目录，空字符串表示输出到控制台
+            output_dir: 汇总文件输出目录，默认为 reports 目录
+            client_factory: 在工作进程中创建模型客户端的函数（必须可以 pickle），None 表示使用注册表
+        """
+        if processes < 1:
+            raise ValueError(f"工作进程数必须大于0: {processes}")
+        self.processes = processes
+        self.options = {"concurrency": concurrency, "mode": mode, "resume": resume, "rerun_agents": rerun_agents}
+        self.shard_size = shard_size
+        self.shard_retries = shard_retries
+        self.split_rate_limits = split_rate_limits
+        self.worker_log_dir = worker_log_dir
+        self.client_factory = client_factory
+        self.batch = BatchRunner(concurrency=concurrency, mode=mode, output_dir=output_dir)
+        self.shard_results: Dict[int, List[Dict[str, Any]]] = {}
+        self.workers: Dict[int, Dict[str, Any]] = {}
+        self.failed_shards: List[Dict[str, Any]] = []
+        self.retries = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn：工作进程不继承协调进程的事件循环和线程
+        return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+    def _log_path(self, shard_index: int) -> str:
+        if not self.worker_log_dir:
+            return ""
+        os.makedirs(self.worker_log_dir, exist_ok=True)
+        return os.path.join(self.worker_log_dir, f"分片_{shard_index}.log")
+
+    def _record_worker(self, outcome: Dict[str, Any]):
+        """累计工作进程的指标（进程崩溃重建后以新的 pid 记录）"""
+        worker = self.workers.setdefault(outcome["pid"], {
+            "pid": outcome["pid"], "shards": 0, "stock_codes": 0, "succeeded": 0, "busy_seconds": 0.0,
+            "cpu_seconds": 0.0, "max_rss_mb": 0.0, "tokens": 0,
+        })
+        results = outcome["results"]
+        worker["shards"] += 1
+        worker["stock_codes"] += len(results)
+        worker["succeeded"] += sum(1 for r in results if r["status"] == "succeeded")
+        worker["busy_seconds"] += outcome["wall_time"]
+        worker["cpu_seconds"] += outcome["cpu_seconds"]
+        worker["max_rss_mb"] = max(worker["max_rss_mb"], outcome["max_rss_mb"])
+        worker["tokens"] += sum(r["tokens"] for r in results)
+
+    async def _worker_slot(self, queue: asyncio.Queue, total: int, config_snapshot: Dict[str, Any]):
+        """一个工作进程：依次领取分片，进程崩溃时重建"""
+        loop = asyncio.get_running_loop()
+        pool = self._new_pool()
+        try:
+            while True:
+                try:
+                    shard_index, stock_codes, attempt = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    outcome = await loop.run_in_executor(
+                        pool, _run_shard, shard_index, stock_codes, self.options, config_snapshot,
+                        self.processes, self.split_rate_limits, self.client_factory, self._log_path(shard_index),
+                    )
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = self._new_pool()
+                    error = f"{type(e).__name__}: {e}"
+                    if attempt < self.shard_retries:
+                        self.retries += 1
+                        print(f"⚠️ 分片 {shard_index}/{total} 失败 (第 {attempt + 1} 次): {error}，重试")
+                        queue.put_nowait((shard_index, stock_codes, attempt + 1))
+                        continue
+                    print(f"❌ 分片 {shard_index}/{total} 重试 {attempt} 次后仍失败: {error}")
+                    self.failed_shards.append({"shard": shard_index, "stock_codes": stock_codes, "error": error})
+                    self.shard_results[shard_index] = [BatchRunner.new_record(code, f"分片失败: {error}")
+                                                       for code in stock_codes]
+                    continue
+                self.shard_results[shard_index] = outcome["results"]
+                self._record_worker(outcome)
+                succeeded = sum(1 for r in outcome["results"] if r["status"] == "succeeded")
+                print(f"🧩 分片 {shard_index}/{total} 完成: {succeeded}/{len(stock_codes)} 成功 "
+                      f"(进程 {outcome['pid']}, {outcome['wall_time']:.1f}秒)")
+        finally:
+            await loop.run_in_executor(None, pool.shutdown)
+
+    async def run(self, stock_codes: List[str]) -> Dict[str, Any]:
+        """
+        分片并行分析所有股票
+
+        Args:
+            stock_codes: 股票代码列表
+
+        Returns:
+            Dict[str, Any]: 批量运行汇总（与 BatchRunner 格式相同，另含 sharding 字段）
+        """
+        shard_size = self.shard_size or max(1, math.ceil(len(stock_codes) / (self.processes * SHARDS_PER_PROCESS)))
+        shards = split_shards(stock_codes, shard_size)
+        processes = min(self.processes, len(shards))
+        print(f"📦 分片批量分析: {len(stock_codes)} 只股票, {len(shards)} 个分片 (每片 {shard_size} 只), "
+              f"{processes} 个工作进程, 每进程并发数 {self.options['concurrency']}")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, shard in enumerate(shards, 1):
+            queue.put_nowait((index, shard, 0))
+        start_time = time.perf_counter()
+        await asyncio.gather(*[self._worker_slot(queue, len(shards), PROJECT_CONFIG) for _ in range(processes)])
+        wall_time = time.perf_counter() - start_time
+
+        self.batch.results = [record for index in sorted(self.shard_results) for record in self.shard_results[index]]
+        summary = self.batch.build_summary(wall_time)
+        summary["sharding"] = {
+            "processes": processes,
+            "shards": len(shards),
+            "shard_size": shard_size,
+            "retries": self.retries,
+            "failed_shards": self.failed_shards,
+            "workers": list(self.workers.values()),
+            "cpu_seconds": round(sum(w["cpu_seconds"] for w in self.workers.values()), 2),
+        }
+        summary["summary_path"] = self.batch.save_summary(summary)
+        self.batch.print_summary(summary)
+        self.print_sharding(summary["sharding"])
+        return summary
+
+    @staticmethod
+    def print_sharding(sharding: Dict[str, Any]):
+        """打印各工作进程的指标"""
+        print(f"   🧩 分片: {sharding['shards']} 个, 重试 {sharding['retries']} 次, "
+              f"失败 {len(sharding['failed_shards'])} 个, 工作进程 CPU 合计 {sharding['cpu_seconds']}秒")
+        for worker in sharding["workers"]:
+            print(f"   ├─ 进程 {worker['pid']}: {worker['shards']} 个分片, "
+                  f"{worker['succeeded']}/{worker['stock_codes']} 成功, 忙碌 {worker['busy_seconds']:.1f}秒, "
+                  f"CPU {worker['cpu_seconds']:.1f}秒, 内存峰值 {worker['max_rss_mb']}MB, tokens {worker['tokens']}")
+
+
+async def run_sharded_batch(stock_codes: List[str], processes: Optional[int] = None,
+                            concurrency: Optional[int] = None, mode: str = "sequential",
+                            resume: bool = False, rerun_agents: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    分片批量分析便捷函数
+
+    Args:
+        stock_codes: 股票代码列表
+        processes: 工作进程数，None 表示使用配置值
+        concurrency: 每个工作进程内的最大并发数，None 表示使用配置值
+        mode: 工作流模式
+        resume: 是否从各股票上次中断的检查点继续
+        rerun_agents: 只重新运行这些智能体
+
+    Returns:
+        Dict[str, Any]: 批量运行汇总
+    """
+    batch_config = get_batch_config()
+    log_dir = batch_config.get("worker_log_dir", "")
+    if log_dir and not os.path.isabs(log_dir):
+        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), log_dir)
+    runner = ShardedBatchRunner(
+        processes=processes or batch_config.get("processes", 1),
+        concurrency=concurrency or batch_config["concurrency"],
+        mode=mode, resume=resume, rerun_agents=rerun_agents,
+        shard_size=batch_config.get("shard_size", 0),
+        shard_retries=batch_config.get("shard_retries", 2),
+        split_rate_limits=batch_config.get("split_rate_limits", True),
+        worker_log_dir=log_dir,
+    )
+    return await runner.run(stock_codes)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+请求合并模块
+single-flight：同一时刻相同键的请求只执行一次，其余请求等待并共享同一个结果
+- runs：相同（股票代码、任务、日期、工作流模式）的并发分析共享一次 GraphFlow 执行
+- tools：不同智能体并发发出的相同工具调用只调用一次MCP服务器
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool
+from pydantic import BaseModel
+
+from config import get_single_flight_config
+from tool_cache import make_cache_key
+from tool_middleware import ToolWrapper, wrap_tools
+
+
+class SingleFlight:
+    """按键合并并发调用 - 首个调用者启动执行，后来者等待同一个任务"""
+
+    def __init__(self, name: str):
+        """
+        初始化合并组
+
+        Args:
+            name: 合并组名称，用于统计输出
+        """
+        self.name = name
+        self.stats = {"executions": 0, "shared": 0}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """合并组所属的事件循环"""
+        return self._loop
+
+    def inflight(self) -> int:
+        """正在执行的调用数"""
+        return len(self._inflight)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行调用，相同键的调用正在执行时等待其结果
+
+        执行在独立任务中进行：单个等待者被取消不影响其他等待者，
+        所有等待者都取消后才取消执行。异常同样会传递给所有等待者。
+
+        Args:
+            key: 合并键
+            func: 无参数的协程函数
+
+        Returns:
+            Any: 共享的执行结果
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._release(key, task))
+            self.stats["executions"] += 1
+        else:
+            self.stats["shared"] += 1
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _release(self, key: str, task: asyncio.Task):
+        """执行结束后移除键，之后的调用重新执行"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # 所有等待者都被取消时没有人读取结果，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+
+class CoalescedTool(ToolWrapper):
+    """合并并发相同调用的工具 - 参数规范化后相同的调用共享一次执行结果"""
+
+    def __init__(self, tool: BaseTool, group: SingleFlight):
+        super().__init__(tool)
+        self._group = group
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        key = make_cache_key(self.name, args.model_dump(exclude_unset=True))
+        # 共享执行使用独立的取消令牌，由合并组在所有等待者取消后取消
+        return await self._group.do(key, lambda: self.call_tool(args, CancellationToken()))
+
+
+# 进程级合并组
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> Optional[SingleFlight]:
+    """
+    获取进程级合并组（必须在事件循环中调用）
+
+    Args:
+        name: 合并组名称，runs 或 tools
+
+    Returns:
+        Optional[SingleFlight]: 合并组，配置中未启用时返回 None
+    """
+    if not get_single_flight_config().get(name, False):
+        return None
+    group = _groups.get(name)
+    # 执行任务与事件循环绑定，事件循环变化时重新创建
+    if group is None or group.loop is not asyncio.get_running_loop():
+        group = SingleFlight(name)
+        _groups[name] = group
+    return group
+
+
+def coalesce_tools(server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """
+    为配置中允许合并的MCP服务器包装工具
+
+    Args:
+        server_name: MCP服务器名称
+        tools: 工具列表
+
+    Returns:
+        List[BaseTool]: 包装后的工具列表，未启用时原样返回
+    """
+    group = get_single_flight("tools")
+    if group is None or server_name not in get_single_flight_config().get("tool_servers", []):
+        return tools
+    return wrap_tools(tools, lambda tool: CoalescedTool(tool, group))
+
+
+def print_single_flight_stats():
+    """打印合并统计（没有发生合并时不输出）"""
+    shared = {name: group.stats for name, group in _groups.items() if group.stats["shared"]}
+    if not shared:
+        return
+    labels = {"runs": "分析", "tools": "工具调用"}
+    print("\n🔗 请求合并统计:")
+    for name, stats in shared.items():
+        print(f"   ├─ {labels.get(name, name)}: 执行 {stats['executions']} 次, 合并 {stats['shared']} 次")
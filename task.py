@@ -3,23 +3,70 @@
 
 """
 任务描述模块
-股票分析任务描述
+股票分析任务描述，以及同业比较模式的行业研究和横向比较任务描述
 """
 
 from datetime import datetime
+from typing import Dict, List, Optional
 
 
-def get_stock_analysis_task(stock_code: str) -> str:
+def get_stock_analysis_task(stock_code: str, peers: Optional[List[str]] = None) -> str:
     """
     获取股票分析任务描述（简化版，让AI自主制定研究大纲）
     
     Args:
         stock_code: 股票代码，如 "000001"、"600519"、"AAPL" 等
+        peers: 同业比较模式下同组的全部股票代码，None 表示单独分析
         
     Returns:
         str: 简化的股票分析任务描述
     """
-    return f"""请对股票代码 {stock_code} 进行全面的投资分析。
+    task = f"""请对股票代码 {stock_code} 进行全面的投资分析。
 
 请协调者自主制定研究大纲和分析策略，研究分析师执行研究，策略顾问给出最终投资建议。"""
+    if peers:
+        task += f"""
+
+本次为同业比较分析（同组股票：{'、'.join(peers)}）。行业分析和市场分析是同组共享的研究结论，已附在下方，
+请在此基础上聚焦 {stock_code} 自身的公司、财务、新闻和技术面分析。"""
+    return task
+
+
+def get_peer_group_task(stock_codes: List[str], sector: Optional[str] = None) -> str:
+    """
+    获取同业比较模式中行业与市场研究的任务描述（整组只运行一次）
+
+    Args:
+        stock_codes: 同组股票代码
+        sector: 行业名称，None 表示由分析师根据股票判断
+
+    Returns:
+        str: 任务描述
+    """
+    sector_text = f"{sector}行业" if sector else "这些股票所属的行业"
+    return f"""请对{sector_text}进行行业和市场层面的研究，同组股票：{'、'.join(stock_codes)}。
+
+这些结论将共享给组内每只股票的后续分析：只研究行业格局、景气周期、政策环境、板块资金与市场情绪等共性因素，
+并简要说明组内各公司在行业中的位置，不做单个公司的深入分析。"""
+
+
+def get_peer_comparison_task(conclusions: Dict[str, str], sector: Optional[str] = None) -> str:
+    """
+    获取同业比较模式中横向比较排名的任务描述
+
+    Args:
+        conclusions: 股票代码到该股票策略顾问结论的映射
+        sector: 行业名称
+
+    Returns:
+        str: 任务描述
+    """
+    sector_text = f"{sector}行业" if sector else "同一行业"
+    sections = "\n\n".join(f"#### {code}\n\n{content}" for code, content in conclusions.items())
+    return f"""以下是{sector_text} {len(conclusions)} 只股票各自的投资建议，行业与市场研究结论附在其后。
+
+请策略顾问进行横向比较：按投资价值给出排名，说明每只股票的相对优势、主要风险和排名理由，
+最后给出组合配置建议。
+
+{sections}"""
 
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+工具结果缓存模块
+基于 SQLite 的本地持久化缓存 - 以工具名称 + 规范化参数为键，
+按工具设置过期时间（TTL），超出容量时按最近最少使用（LRU）淘汰
+
+模型调用缓存处于 record / replay 模式时，工具结果随模型调用一起固定：
+- record: 本次写入或命中的结果不再过期，也不参与 LRU 淘汰
+- replay: 只从缓存读取（忽略过期时间），未命中直接报错，回放不访问网络；
+  研究记忆的检索结果同样经过缓存，之后新增的报告不会改变回放的工具结果
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool
+from pydantic import BaseModel
+
+from config import get_tool_cache_config, get_llm_cache_config
+from llm_cache import ReplayMissError
+from tool_middleware import ToolWrapper, wrap_tools
+
+
+# 不区分大小写的参数：搜索查询和枚举值。URL、域名列表等其余字符串只去除首尾空白（URL 路径和查询参数区分大小写）
+CASE_INSENSITIVE_ARGUMENTS = ("query", "topic", "time_range", "search_depth", "extract_depth")
+
+# 固定工具结果的模型调用缓存模式
+REPLAY_MODES = ("record", "replay")
+# 固定条目的过期时间
+_PINNED = float("inf")
+
+
+def normalize_arguments(value: Any, key: Optional[str] = None) -> Any:
+    """
+    规范化工具参数，使仅有大小写或空白差异的请求命中同一缓存
+
+    - 字符串：去除首尾空白；CASE_INSENSITIVE_ARGUMENTS 中的参数另外合并连续空白并转为小写
+    - 字典：移除值为 None 的键
+    - 列表：逐项规范化，沿用所属参数名
+    """
+    if isinstance(value, str):
+        if key in CASE_INSENSITIVE_ARGUMENTS:
+            return re.sub(r"\s+", " ", value.strip()).lower()
+        return value.strip()
+    if isinstance(value, dict):
+        return {k: normalize_arguments(v, k) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(v, key) for v in value]
+    return value
+
+
+def make_cache_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+    """根据工具名称和规范化参数生成内容寻址的缓存键"""
+    payload = json.dumps(normalize_arguments(arguments), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{tool_name}\n{payload}".encode("utf-8")).hexdigest()
+
+
+class ToolResultCache:
+    """工具结果缓存 - SQLite 持久化，TTL 过期 + LRU 容量上限"""
+
+    def __init__(self, path: str, max_entries: int = 5000, default_ttl: float = 6 * 3600,
+                 ttl_rules: Optional[List[Dict[str, Any]]] = None, replay_mode: Optional[str] = None):
+        """
+        初始化缓存
+
+        Args:
+            path: SQLite 数据库文件路径
+            max_entries: 最大缓存条目数，超出后淘汰最久未访问的条目
+            default_ttl: 未匹配任何规则时的过期时间（秒）
+            ttl_rules: 过期时间规则列表，按顺序匹配第一条
+                {"tool": 工具名称, "match": {参数名: 参数值}, "ttl": 秒数}，ttl 为 0 表示不缓存
+            replay_mode: 模型调用缓存模式 record / replay，结果固定不过期；None 表示按 TTL 缓存
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttl_rules = ttl_rules or []
+        self.replay_mode = replay_mode
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tool_cache (
+                key TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                arguments TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_cache_accessed ON tool_cache (accessed_at)")
+        self._conn.commit()
+
+    def _count(self, tool_name: str, counter: str):
+        tool_stats = self.stats.setdefault(tool_name, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        tool_stats[counter] += 1
+
+    def get_ttl(self, tool_name: str, arguments: Dict[str, Any]) -> float:
+        """根据规则获取工具调用的过期时间（秒）"""
+        normalized = normalize_arguments(arguments)
+        for rule in self.ttl_rules:
+            if rule.get("tool", tool_name) != tool_name:
+                continue
+            match = normalize_arguments(rule.get("match", {}))
+            if all(normalized.get(k) == v for k, v in match.items()):
+                return rule["ttl"]
+        return self.default_ttl
+
+    def get(self, tool_name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """读取缓存，未命中或已过期返回 None"""
+        key = make_cache_key(tool_name, arguments)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] <= now and self.replay_mode != "replay"):
+                if row is not None:
+                    self._conn.execute("DELETE FROM tool_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self._count(tool_name, "misses")
+                return None
+            # 记录时命中的结果同样固定，之后的回放依赖它
+            expires_at = _PINNED if self.replay_mode == "record" else row[1]
+            self._conn.execute("UPDATE tool_cache SET accessed_at = ?, expires_at = ? WHERE key = ?",
+                               (now, expires_at, key))
+            self._conn.commit()
+            self._count(tool_name, "hits")
+            return row[0]
+
+    def set(self, tool_name: str, arguments: Dict[str, Any], value: str):
+        """写入缓存，TTL 为 0 的工具调用不缓存（记录模式下一律固定）"""
+        ttl = _PINNED if self.replay_mode == "record" else self.get_ttl(tool_name, arguments)
+        if ttl <= 0:
+            return
+        key = make_cache_key(tool_name, arguments)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, tool_name, json.dumps(arguments, ensure_ascii=False, sort_keys=True),
+                 value, now, now + ttl, now),
+            )
+            self._count(tool_name, "stores")
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """删除过期条目，并在超出容量时按 LRU 淘汰（调用方需持有锁，固定的条目不淘汰）"""
+        self._conn.execute("DELETE FROM tool_cache WHERE expires_at <= ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM tool_cache WHERE expires_at < ?", (_PINNED,)).fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            rows = self._conn.execute(
+                "SELECT key, tool FROM tool_cache WHERE expires_at < ? ORDER BY accessed_at ASC LIMIT ?",
+                (_PINNED, overflow),
+            ).fetchall()
+            self._conn.executemany("DELETE FROM tool_cache WHERE key = ?", [(row[0],) for row in rows])
+            for row in rows:
+                self._count(row[1], "evictions")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM tool_cache")
+            self._conn.commit()
+
+    def size(self) -> int:
+        """当前缓存条目数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        hits = sum(s["hits"] for s in self.stats.values())
+        misses = sum(s["misses"] for s in self.stats.values())
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "entries": self.size(),
+            "tools": {name: dict(s) for name, s in self.stats.items()},
+        }
+
+    def print_stats(self):
+        """打印命中统计"""
+        stats = self.get_stats()
+        if not stats["tools"]:
+            return
+        print("\n🗃️ 工具结果缓存统计:")
+        print(f"   命中: {stats['hits']}  未命中: {stats['misses']}  "
+              f"命中率: {stats['hit_rate']:.1%}  缓存条目: {stats['entries']}")
+        for name, s in stats["tools"].items():
+            print(f"   ├─ {name}: 命中 {s['hits']} / 未命中 {s['misses']} / "
+                  f"写入 {s['stores']} / 淘汰 {s['evictions']}")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedTool(ToolWrapper):
+    """带结果缓存的工具 - 命中时直接返回缓存内容，不调用MCP服务器"""
+
+    def __init__(self, tool: BaseTool, cache: ToolResultCache):
+        super().__init__(tool)
+        self._cache = cache
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        arguments = args.model_dump(exclude_unset=True)
+        cached = self._cache.get(self.name, arguments)
+        if cached is not None:
+            return cached
+        if self._cache.replay_mode == "replay":
+            raise ReplayMissError(f"回放模式下未找到工具调用记录: {self.name} "
+                                  f"{json.dumps(arguments, ensure_ascii=False, sort_keys=True)}")
+        # 工具报错时抛出异常，错误结果不会被缓存
+        value = await self.call_tool(args, cancellation_token)
+        self._cache.set(self.name, arguments, value)
+        return value
+
+
+# 进程级缓存实例
+_cache: Optional[ToolResultCache] = None
+
+
+def get_replay_mode() -> Optional[str]:
+    """模型调用缓存为 record / replay 时返回该模式，否则返回 None"""
+    mode = get_llm_cache_config().get("mode", "off")
+    return mode if mode in REPLAY_MODES else None
+
+
+def get_tool_cache() -> Optional[ToolResultCache]:
+    """
+    获取进程级工具结果缓存
+
+    Returns:
+        Optional[ToolResultCache]: 缓存实例，配置中未启用且不在记录/回放模式时返回 None
+    """
+    global _cache
+    cache_config = get_tool_cache_config()
+    replay_mode = get_replay_mode()
+    if not cache_config.get("enabled", False) and replay_mode is None:
+        return None
+    if _cache is None:
+        path = cache_config["path"]
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        _cache = ToolResultCache(
+            path=path,
+            max_entries=cache_config.get("max_entries", 5000),
+            default_ttl=cache_config.get("default_ttl", 6 * 3600),
+            ttl_rules=cache_config.get("ttl_rules", []),
+            replay_mode=replay_mode,
+        )
+    return _cache
+
+
+def cache_tools(server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """
+    为配置中启用缓存的MCP服务器包装工具（记录/回放模式下研究记忆的检索也经过缓存）
+
+    Args:
+        server_name: MCP服务器名称
+        tools: 工具列表
+
+    Returns:
+        List[BaseTool]: 包装后的工具列表，未启用缓存时原样返回
+    """
+    cache = get_tool_cache()
+    servers = list(get_tool_cache_config().get("servers", []))
+    if cache is not None and cache.replay_mode is not None:
+        servers.append("research_memory")
+    if cache is None or server_name not in servers:
+        return tools
+    return wrap_tools(tools, lambda tool: CachedTool(tool, cache))
+
+
+def print_tool_cache_stats():
+    """打印进程级缓存的命中统计（未使用缓存时不输出）"""
+    if _cache is not None:
+        _cache.print_stats()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+工具包装模块
+MCP工具的通用包装基类 - 缓存、限流等功能通过包装工具实现，对智能体透明
+"""
+
+from typing import Any, List, Optional, Callable
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool
+from pydantic import BaseModel
+
+
+class ToolWrapper(BaseTool[BaseModel, Any]):
+    """
+    工具包装基类
+
+    透传被包装工具的名称、描述和参数模式，子类重写 run 在调用前后增加逻辑。
+    包装后的工具统一返回字符串（即被包装工具 return_value_as_string 的结果），
+    因此多层包装可以任意叠加。
+    """
+
+    def __init__(self, tool: BaseTool):
+        super().__init__(tool.args_type(), str, tool.name, tool.description)
+        self._tool = tool
+
+    @property
+    def tool(self) -> BaseTool:
+        """被包装的工具"""
+        return self._tool
+
+    @property
+    def schema(self):
+        return self._tool.schema
+
+    @property
+    def server_name(self) -> Optional[str]:
+        """工具所属的MCP服务器名称"""
+        return getattr(self._tool, "server_name", None)
+
+    def return_value_as_string(self, value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        return self._tool.return_value_as_string(value)
+
+    async def call_tool(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        """调用被包装的工具并返回字符串结果"""
+        value = await self._tool.run(args, cancellation_token)
+        return self._tool.return_value_as_string(value)
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        return await self.call_tool(args, cancellation_token)
+
+
+def unwrap_tool(tool: BaseTool) -> BaseTool:
+    """返回最内层的原始工具"""
+    while isinstance(tool, ToolWrapper):
+        tool = tool.tool
+    return tool
+
+
+def wrap_tools(tools: List[BaseTool], wrapper: Callable[[BaseTool], BaseTool]) -> List[BaseTool]:
+    """对工具列表逐个应用包装"""
+    return [wrapper(tool) for tool in tools]
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+工具结果后处理模块
+搜索结果原样进入智能体上下文（reflect_on_tool_use 还会让模型再读一遍），并随链路在之后每一轮中重复计费。
+结果交给智能体之前依次处理：
+- 解码：MCP 适配器把内容列表序列化为 JSON（中文被转义为 \\uXXXX），还原为纯文本
+- URL 去重：同一智能体在本次运行中通过同一工具已经看到过的网页不再重复返回
+  （按工具分别记录：搜索摘要中出现过的网页，之后用 tavily-extract 提取全文时照常返回）
+- 去除样板内容：导航、版权、Cookie 提示、图片和纯链接行
+- 长度限制：单条结果和单次调用分别限制字符数；可选只保留与查询最相关的段落
+每次运行节省的 token 数按运行记录，与性能分析相同通过 contextvars 传递
+"""
+
+import contextvars
+import json
+import re
+from typing import Any, Dict, List, Optional, Pattern, Set, Tuple
+
+# AutoGen 0.4+ API
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool
+from pydantic import BaseModel
+
+from config import get_tool_output_config
+from context_policy import estimate_tokens
+from tool_middleware import ToolWrapper, wrap_tools
+
+# 当前运行的工具结果统计
+_current_stats: contextvars.ContextVar[Optional["ToolOutputStats"]] = contextvars.ContextVar(
+    "current_tool_output_stats", default=None
+)
+
+# 超过该长度的行视为正文，不按样板规则删除
+_BOILERPLATE_MAX_LINE = 120
+_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_LINK_ONLY = re.compile(r"^\s*(?:[-*•|]\s*)?(?:\[[^\]]*\]\([^)]*\)\s*[|·/]?\s*)+$")
+_PASSAGE_SPLIT = re.compile(r"(?<=[。！？!?])|\n+|(?<=\.)\s+")
+_ASCII_WORD = re.compile(r"[A-Za-z0-9]{2,}")
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+class ToolOutputStats:
+    """单次运行的工具结果处理统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.results = 0
+        self.duplicates = 0
+        self.truncated = 0
+        self.chars_before = 0
+        self.chars_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._seen_urls: Dict[Tuple[str, str], Set[str]] = {}
+
+    def seen_urls(self, agent_name: str, tool_name: str) -> Set[str]:
+        """智能体在本次运行中通过该工具已经看到过的 URL"""
+        return self._seen_urls.setdefault((agent_name, tool_name), set())
+
+    def record(self, before: str, after: str, results: int, duplicates: int, truncated: int):
+        self.calls += 1
+        self.results += results
+        self.duplicates += duplicates
+        self.truncated += truncated
+        self.chars_before += len(before)
+        self.chars_after += len(after)
+        self.tokens_before += estimate_tokens(before)
+        self.tokens_after += estimate_tokens(after)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "results": self.results,
+            "duplicates": self.duplicates,
+            "truncated": self.truncated,
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_before - self.tokens_after,
+        }
+
+
+def unwrap_text(value: str) -> str:
+    """把 MCP 内容列表的 JSON（[{"type": "text", "text": ...}, ...]）还原为纯文本，其他内容原样返回"""
+    if not value.startswith("[{"):
+        return value
+    try:
+        items = json.loads(value)
+    except ValueError:
+        return value
+    if not isinstance(items, list) or not all(isinstance(item, dict) and item.get("type") == "text"
+                                               for item in items):
+        return value
+    return "\n\n".join(str(item.get("text", "")) for item in items)
+
+
+def split_results(text: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    把 tavily 的文本输出拆分为开头部分和逐条结果
+
+    每条结果以 "Title:" 行开始（搜索），或以 "URL:" 行开始（网页提取）
+
+    Returns:
+        Tuple[List[str], List[List[str]]]: (开头部分的行, 每条结果的行)
+    """
+    header: List[str] = []
+    blocks: List[List[str]] = []
+    current: Optional[List[str]] = None
+    for line in text.splitlines():
+        starts_block = line.startswith("Title:") or (
+            line.startswith("URL:") and (current is None or any(l.startswith("URL:") for l in current))
+        )
+        if starts_block:
+            current = [line]
+            blocks.append(current)
+        elif current is None:
+            header.append(line)
+        else:
+            current.append(line)
+    return header, blocks
+
+
+def _result_url(block: List[str]) -> str:
+    for line in block:
+        if line.startswith("URL:"):
+            return line[len("URL:"):].strip()
+    return ""
+
+
+def strip_boilerplate(lines: List[str], patterns: List[Pattern]) -> List[str]:
+    """删除图片、纯链接行和匹配样板规则的短行，合并连续空行"""
+    cleaned: List[str] = []
+    for line in lines:
+        line = _IMAGE.sub("", line).rstrip()
+        if _LINK_ONLY.match(line):
+            continue
+        if len(line) < _BOILERPLATE_MAX_LINE and any(pattern.search(line) for pattern in patterns):
+            continue
+        if not line.strip() and (not cleaned or not cleaned[-1].strip()):
+            continue
+        cleaned.append(line)
+    while cleaned and not cleaned[-1].strip():
+        cleaned.pop()
+    return cleaned
+
+
+def _query_terms(query: str) -> Set[str]:
+    """查询词：英文单词和中文二元组"""
+    terms = {word.lower() for word in _ASCII_WORD.findall(query)}
+    for run in _CJK_RUN.findall(query):
+        terms.update(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    return terms
+
+
+def extract_passages(text: str, query: str, max_chars: int) -> str:
+    """
+    只保留与查询最相关的段落（按出现的查询词数量排序），按原文顺序拼接
+
+    Args:
+        text: 结果正文
+        query: 搜索查询
+        max_chars: 最大字符数
+
+    Returns:
+        str: 抽取的段落，没有段落包含查询词时截取开头
+    """
+    terms = _query_terms(query)
+    passages = [p.strip() for p in _PASSAGE_SPLIT.split(text) if p and p.strip()]
+    if not terms or len(passages) < 2:
+        return text[:max_chars]
+    scores = [sum(term in passage.lower() for term in terms) for passage in passages]
+    selected: List[int] = []
+    size = 0
+    # 不含查询词的段落不保留
+    for i in sorted((i for i in range(len(passages)) if scores[i] > 0), key=lambda i: (-scores[i], i)):
+        if size + len(passages[i]) > max_chars:
+            continue
+        selected.append(i)
+        size += len(passages[i]) + 1
+    if not selected:
+        return text[:max_chars]
+    return " … ".join(passages[i] for i in sorted(selected))
+
+
+def _cap_result(block: List[str], max_chars: int, query: str, passages: bool) -> Tuple[str, bool]:
+    """限制单条结果的长度，标题和 URL 行保留，返回 (文本, 是否截断)"""
+    head = [line for line in block[:2] if line.startswith(("Title:", "URL:"))]
+    body = "\n".join(block[len(head):])
+    if not max_chars or len(body) <= max_chars:
+        return "\n".join(head + ([body] if body else [])), False
+    if passages and query:
+        body = extract_passages(body, query, max_chars)
+    else:
+        body = body[:max_chars].rstrip()
+    return "\n".join(head + [body + " …（已截断）"]), True
+
+
+def process_tool_output(text: str, query: str = "", seen_urls: Optional[Set[str]] = None,
+                        config: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    处理一次工具调用的文本结果
+
+    Args:
+        text: 工具返回的文本
+        query: 搜索查询（用于抽取相关段落）
+        seen_urls: 已经返回过的 URL，处理后加入本次返回的 URL；None 表示只在本次调用内去重
+        config: 后处理配置，None 表示使用项目配置
+
+    Returns:
+        Tuple[str, Dict[str, int]]: (处理后的文本, {"results", "duplicates", "truncated"})
+    """
+    config = config if config is not None else get_tool_output_config()
+    seen_urls = seen_urls if seen_urls is not None else set()
+    patterns = [re.compile(p, re.IGNORECASE) for p in config.get("boilerplate_patterns", [])] \
+        if config.get("strip_boilerplate", True) else []
+    max_result = config.get("max_result_chars", 0)
+    max_call = config.get("max_call_chars", 0)
+    passages = config.get("extract_passages", False)
+
+    header, blocks = split_results(unwrap_text(text))
+    counts = {"results": len(blocks), "duplicates": 0, "truncated": 0}
+    if not blocks:
+        output = "\n".join(strip_boilerplate(header, patterns))
+        if max_call and len(output) > max_call:
+            counts["truncated"] = 1
+            output = output[:max_call].rstrip() + " …（已截断）"
+        return output, counts
+
+    parts = ["\n".join(strip_boilerplate(header, patterns))] if header else []
+    size = len(parts[0]) if parts else 0
+    kept = omitted = 0
+    for block in blocks:
+        url = _result_url(block)
+        if url and config.get("dedupe_urls", True) and url in seen_urls:
+            counts["duplicates"] += 1
+            continue
+        result, truncated = _cap_result(strip_boilerplate(block, patterns), max_result, query, passages)
+        if max_call and size + len(result) > max_call and kept > 0:
+            omitted += 1
+            continue
+        if url:
+            seen_urls.add(url)
+        counts["truncated"] += truncated
+        parts.append(result)
+        size += len(result) + 2
+        kept += 1
+
+    notes = []
+    if counts["duplicates"]:
+        notes.append(f"{counts['duplicates']} 条结果已在之前的调用中返回过")
+    if omitted:
+        notes.append(f"{omitted} 条结果因长度限制省略")
+        counts["truncated"] += omitted
+    if not kept:
+        return (f"本次结果均已在之前的工具调用中返回过（{counts['duplicates']} 条），"
+                "请基于已有信息分析或换用不同的查询。"), counts
+    if notes:
+        parts.append(f"（{'，'.join(notes)}）")
+    return "\n\n".join(part for part in parts if part), counts
+
+
+class PostProcessedTool(ToolWrapper):
+    """对返回结果去重、去除样板内容并限制长度的工具"""
+
+    def __init__(self, tool: BaseTool, agent_name: str):
+        super().__init__(tool)
+        self.agent_name = agent_name
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        value = await self.call_tool(args, cancellation_token)
+        stats = _current_stats.get()
+        query = str(args.model_dump().get("query") or "")
+        seen_urls = stats.seen_urls(self.agent_name, self.name) if stats is not None else None
+        output, counts = process_tool_output(value, query, seen_urls)
+        if stats is not None:
+            stats.record(value, output, **counts)
+        return output
+
+
+def start_tool_output() -> Optional[contextvars.Token]:
+    """
+    为当前上下文创建工具结果统计
+
+    Returns:
+        Optional[contextvars.Token]: 用于 stop_tool_output 的令牌，未启用时返回 None
+    """
+    if not get_tool_output_config().get("enabled", False):
+        return None
+    return _current_stats.set(ToolOutputStats())
+
+
+def stop_tool_output(token: Optional[contextvars.Token]) -> Dict[str, Any]:
+    """
+    结束当前运行的工具结果统计
+
+    Returns:
+        Dict[str, Any]: 处理前后的字符数、token 数和节省的 token 数，未启用时返回空字典
+    """
+    if token is None:
+        return {}
+    stats = _current_stats.get()
+    _current_stats.reset(token)
+    return stats.to_dict()
+
+
+def postprocess_tools(agent_name: str, server_name: str, tools: List[BaseTool]) -> List[BaseTool]:
+    """按配置为智能体的搜索工具加上结果后处理"""
+    output_config = get_tool_output_config()
+    if not output_config.get("enabled", False) or server_name not in output_config.get("servers", []):
+        return tools
+    return wrap_tools(tools, lambda tool: PostProcessedTool(tool, agent_name))
+
+
+def print_tool_output_summary(stats: Dict[str, Any]):
+    """打印工具结果后处理节省的 token"""
+    if not stats or not stats["calls"]:
+        return
+    print(f"\n✂️ 工具结果后处理: {stats['calls']} 次调用，{stats['tokens_before']} → {stats['tokens_after']} tokens "
+          f"(节省 {stats['tokens_saved']})，去重 {stats['duplicates']} 条，截断 {stats['truncated']} 条")
@@ -3,102 +3,203 @@
 
 """
 工作流模块
-基于 AutoGen 0.4+ 最新API - 8个智能体顺序执行
+基于 AutoGen 0.4+ 最新API - 8个智能体顺序执行 / 扇出扇入并行执行
 """
 
 import asyncio
-from typing import List
+from typing import Collection, Dict, List, Optional
 
 # AutoGen 0.4+ API
 from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import DiGraphBuilder, GraphFlow
 from autogen_agentchat.conditions import TextMentionTermination
 
+from config import get_workflow_config
+from constants import WORKFLOW_MODES
+from context_policy import apply_context_policy
+from deadlines import DeadlineAgent, apply_agent_deadlines
+
+
+# 完整团队的执行顺序
+REQUIRED_AGENTS = [
+    "coordinator_agent",       # 1. 协调者
+    "company_analyst",         # 2. 公司分析师
+    "financial_analyst",       # 3. 财务分析师
+    "industry_analyst",        # 4. 行业分析师
+    "market_analyst",          # 5. 市场分析师
+    "news_analyst",            # 6. 新闻分析师
+    "technical_analyst",       # 7. 技术分析师
+    "strategy_advisor"         # 8. 策略顾问
+]
+
+# 领域分析师 - 只依赖协调者的分析计划，彼此职责不重叠，可并行执行
+DOMAIN_ANALYSTS = REQUIRED_AGENTS[1:-1]
+
+AGENT_EMOJIS = {
+    "coordinator_agent": "🎯",
+    "company_analyst": "🏢",
+    "financial_analyst": "📊",
+    "industry_analyst": "🏭",
+    "market_analyst": "📰",
+    "news_analyst": "🗞️",
+    "technical_analyst": "📈",
+    "strategy_advisor": "💡"
+}
+
+AGENT_DESCRIPTIONS = {
+    "coordinator_agent": "协调者",
+    "company_analyst": "公司基本面分析",
+    "financial_analyst": "财务数据分析",
+    "industry_analyst": "行业研究分析",
+    "market_analyst": "市场情绪分析",
+    "news_analyst": "新闻舆情分析",
+    "technical_analyst": "技术面分析",
+    "strategy_advisor": "整合分析并输出最终投资建议"
+}
+
+
+def _describe_agent(agent_name: str) -> str:
+    """返回带图标的智能体描述，用于控制台输出"""
+    emoji = AGENT_EMOJIS.get(agent_name, "🤖")
+    role = AGENT_DESCRIPTIONS.get(agent_name, "分析任务")
+    return f"{emoji} {agent_name} - {role}"
+
+
+def _add_sequential_edges(builder: DiGraphBuilder, name_to_agent: Dict[str, AssistantAgent],
+                          execution_order: List[str]):
+    """顺序连接：coordinator → company → financial → industry → market → news → technical → strategy"""
+    for i in range(len(execution_order) - 1):
+        current = execution_order[i]
+        next_agent = execution_order[i + 1]
+        builder.add_edge(name_to_agent[current], name_to_agent[next_agent])
+
+
+def _add_parallel_edges(builder: DiGraphBuilder, name_to_agent: Dict[str, AssistantAgent],
+                        analysts: List[str]):
+    """扇出扇入连接：coordinator → [领域分析师并行] → strategy_advisor（等待全部完成）
+
+    续跑时已完成的协调者或策略顾问不在图中，剩余分析师直接作为起点或终点。
+    """
+    coordinator = name_to_agent.get("coordinator_agent")
+    strategy_advisor = name_to_agent.get("strategy_advisor")
+    for analyst_name in analysts:
+        if coordinator is not None:
+            builder.add_edge(coordinator, name_to_agent[analyst_name])
+        if strategy_advisor is not None:
+            # 默认激活条件为 "all"：策略顾问等待所有分析师完成后才执行
+            builder.add_edge(name_to_agent[analyst_name], strategy_advisor)
+    if not analysts and coordinator is not None and strategy_advisor is not None:
+        builder.add_edge(coordinator, strategy_advisor)
+
+
+async def create_analysis_workflow(agents: List[AssistantAgent], mode: str = "sequential",
+                                   completed: Collection[str] = (),
+                                   context_policy: Optional[str] = None) -> GraphFlow:
+    """
+    创建完整的分析工作流
+
+    Args:
+        agents: 智能体列表，必须包含全部未完成的智能体
+        mode: 工作流模式
+            - "sequential": 8个智能体严格顺序执行
+            - "parallel": 协调者 → 6个领域分析师并行 → 策略顾问汇总
+        completed: 已有结果的智能体（断点续跑或复用近期报告时跳过），工作流从第一个未完成的节点开始
+        context_policy: 上下文策略 full / compact，None 表示使用配置值
+
+    Returns:
+        GraphFlow: 工作流
+    """
+    if mode not in WORKFLOW_MODES:
+        raise ValueError(f"未知的工作流模式: {mode}，可选: {', '.join(WORKFLOW_MODES)}")
+
+    workflow_config = get_workflow_config()
+    if context_policy is None:
+        context_policy = workflow_config.get("context_policy", "full")
+    agents = apply_context_policy(
+        agents,
+        context_policy,
+        summary_max_chars=workflow_config.get("summary_max_chars", 600),
+        advisor_section_max_chars=workflow_config.get("advisor_section_max_chars", 0),
+    )
+    # 期限在最外层：超时的智能体输出降级章节，后续节点照常执行
+    agents = apply_agent_deadlines(agents)
 
-async def create_analysis_workflow(agents: List[AssistantAgent]) -> GraphFlow:
-    """创建完整的顺序分析工作流 - 8个智能体顺序执行"""
     name_to_agent = {agent.name: agent for agent in agents}
-    
-    # 检查必需的8个智能体
-    required_agents = [
-        "coordinator_agent",       # 1. 协调者
-        "company_analyst",         # 2. 公司分析师
-        "financial_analyst",       # 3. 财务分析师
-        "industry_analyst",        # 4. 行业分析师
-        "market_analyst",          # 5. 市场分析师
-        "news_analyst",            # 6. 新闻分析师
-        "technical_analyst",       # 7. 技术分析师
-        "strategy_advisor"         # 8. 策略顾问
-    ]
-    
-    for agent_name in required_agents:
+    execution_order = [name for name in REQUIRED_AGENTS if name not in completed]
+    if not execution_order:
+        raise ValueError("所有智能体均已完成，无需创建工作流")
+
+    # 检查必需的智能体
+    for agent_name in execution_order:
         if agent_name not in name_to_agent:
             raise ValueError(f"缺少必需的智能体: {agent_name}")
-    
+
     # 使用正确的 DiGraphBuilder API
     builder = DiGraphBuilder()
-    
-    # 添加8个节点
-    execution_order = required_agents
+
+    # 添加节点
     for agent_name in execution_order:
-        if agent_name in name_to_agent:
-            builder.add_node(name_to_agent[agent_name])
-    
-    # 构建7个顺序连接链：coordinator → company → financial → industry → market → news → technical → strategy
-    for i in range(len(execution_order) - 1):
-        current = execution_order[i]
-        next_agent = execution_order[i + 1]
-        
-        if current in name_to_agent and next_agent in name_to_agent:
-            builder.add_edge(name_to_agent[current], name_to_agent[next_agent])
-    
+        builder.add_node(name_to_agent[agent_name])
+
+    analysts = [name for name in DOMAIN_ANALYSTS if name in execution_order]
+    if mode == "parallel":
+        remaining_agents = {name: name_to_agent[name] for name in execution_order}
+        _add_parallel_edges(builder, remaining_agents, analysts)
+    else:
+        _add_sequential_edges(builder, name_to_agent, execution_order)
+
     # 构建图
     graph = builder.build()
-    
+
     # 创建终止条件
     termination_condition = TextMentionTermination("TERMINATE")
-    
+
     # 创建工作流 - 使用正确的API
     flow = GraphFlow(
         participants=builder.get_participants(),
         graph=graph,
         termination_condition=termination_condition
     )
-    
-    print("✅ 完整顺序GraphFlow工作流创建 (8个智能体):")
-    print("   📋 执行顺序:")
-    for i, agent_name in enumerate(execution_order, 1):
-        emoji = {
-            "coordinator_agent": "🎯",
-            "company_analyst": "🏢",
-            "financial_analyst": "📊", 
-            "industry_analyst": "🏭",
-            "market_analyst": "📰",
-            "news_analyst": "🗞️",
-            "technical_analyst": "📈",
-            "strategy_advisor": "💡"
-        }.get(agent_name, "🤖")
-        
-        role = {
-            "coordinator_agent": "协调者",
-            "company_analyst": "公司基本面分析",
-            "financial_analyst": "财务数据分析",
-            "industry_analyst": "行业研究分析",
-            "market_analyst": "市场情绪分析",
-            "news_analyst": "新闻舆情分析",
-            "technical_analyst": "技术面分析",
-            "strategy_advisor": "整合分析并输出最终投资建议"
-        }.get(agent_name, "分析任务")
-        
-        print(f"   {i}. {emoji} {agent_name} - {role}")
-    
-    print("   🏁 策略顾问负责输出投资建议并以 TERMINATE 结束")
-    print(f"   🔧 工作流配置: {len(execution_order)} 个智能体严格顺序执行")
-    
+
+    if completed:
+        skipped = [name for name in REQUIRED_AGENTS if name in completed]
+        print(f"⏭️ 跳过 {len(skipped)} 个已有结果的智能体 ({', '.join(skipped)})")
+
+    if mode == "parallel":
+        print(f"✅ 扇出扇入GraphFlow工作流创建 ({len(execution_order)}个智能体):")
+        print("   📋 执行拓扑:")
+        step = 1
+        if "coordinator_agent" in execution_order:
+            print(f"   {step}. {_describe_agent('coordinator_agent')}")
+            step += 1
+        if analysts:
+            print(f"   {step}. 并行执行 {len(analysts)} 个领域分析师:")
+            for agent_name in analysts:
+                print(f"      ├─ {_describe_agent(agent_name)}")
+            step += 1
+        if "strategy_advisor" in execution_order:
+            print(f"   {step}. {_describe_agent('strategy_advisor')} (等待全部分析师完成)")
+            step += 1
+        print("   🏁 策略顾问负责输出投资建议并以 TERMINATE 结束")
+        print(f"   🔧 工作流配置: 关键路径 {step - 1} 步 (协调者 → 分析师 → 策略顾问)")
+    else:
+        print(f"✅ 完整顺序GraphFlow工作流创建 ({len(execution_order)}个智能体):")
+        print("   📋 执行顺序:")
+        for i, agent_name in enumerate(execution_order, 1):
+            print(f"   {i}. {_describe_agent(agent_name)}")
+        print("   🏁 策略顾问负责输出投资建议并以 TERMINATE 结束")
+        print(f"   🔧 工作流配置: {len(execution_order)} 个智能体严格顺序执行")
+    if context_policy == "compact":
+        print("   🗜️ 上下文策略: 分析师只接收协调者计划和其他结论摘要，策略顾问接收整理后的章节")
+    deadlines = {agent.deadline for agent in agents
+                 if isinstance(agent, DeadlineAgent) and agent.name in execution_order and agent.deadline > 0}
+    if deadlines:
+        print(f"   ⏱️ 智能体期限: {'/'.join(f'{d:g}' for d in sorted(deadlines))} 秒，超时的章节降级后继续")
+
     return flow
 
 
 # 向后兼容的函数
-def create_legacy_workflow(agents: List[AssistantAgent]) -> GraphFlow:
+def create_legacy_workflow(agents: List[AssistantAgent], mode: str = "sequential") -> GraphFlow:
     """向后兼容的工作流创建函数"""
-    return asyncio.run(create_analysis_workflow(agents))
\ No newline at end of file
+    return asyncio.run(create_analysis_workflow(agents, mode))
\ No newline at end of file